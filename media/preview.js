@@ -0,0 +1,314 @@
+// Webview side of the preview: renders the script output as it streams in.
+//
+// `html` mode (custom scripts) appends the output lines as they are.
+// `json` mode (bundled script) receives one node per line, {h, k?, c?, child?},
+// and renders a collapsible tree. Only the blocks of rows near the viewport
+// get DOM; the others are empty placeholders that keep their height.
+// Figures rendered in the background arrive later as {fill, h} nodes that
+// replace their `pending-figure` placeholder. Expand links (`data-expand`) ask
+// the extension to rerun the script for details computed only on demand.
+(function () {
+  const vscode = acquireVsCodeApi();
+  const container = document.getElementById('x');
+  const loading = document.getElementById('loading');
+  const requestId = Number(container.dataset.requestId);
+  const mode = container.dataset.mode;
+
+  function finish() {
+    if (loading) {
+      loading.remove();
+    }
+  }
+
+  // ============ HTML mode ============
+
+  let hasContent = false;
+
+  function appendHtml(lines) {
+    if (lines.length === 0) {
+      return;
+    }
+    const html = (hasContent ? '<br>' : '') + lines.join('<br>');
+    container.insertAdjacentHTML('beforeend', html);
+    hasContent = true;
+  }
+
+  // ============ Tree mode ============
+
+  const BLOCK_ROWS = 100;   // Rows per virtualized block
+  const ROW_HEIGHT = 18;    // Estimated row height (px) of blocks never rendered
+  const INDENT_PX = 16;
+
+  const roots = [];
+  let rows = [];            // Visible rows in order: {node, depth}
+  let blocks = [];          // {start, end, el, rendered}
+
+  const observer = new IntersectionObserver((records) => {
+    for (const record of records) {
+      const block = blocks[Number(record.target.dataset.block)];
+      if (!block || block.el !== record.target) {
+        continue;
+      }
+      if (record.isIntersecting) {
+        renderBlock(block);
+      } else {
+        releaseBlock(block);
+      }
+    }
+  }, { rootMargin: '1000px 0px' });
+
+  function parseNode(line) {
+    try {
+      const node = JSON.parse(line);
+      if (node && typeof node === 'object' && typeof node.h === 'string') {
+        return node;
+      }
+    } catch (error) {
+      // Not a node, e.g. something the unpickled objects printed
+    }
+    return { h: line };
+  }
+
+  // ============ Figure fills ============
+
+  const pendingFigures = new Map();   // placeholder id -> node holding it
+  const earlyFills = new Map();       // fills that arrived before their placeholder
+
+  function placeholderPattern(id) {
+    return new RegExp(`<span class="pending-figure" id="${id}">[\\s\\S]*?</span>`);
+  }
+
+  function registerPlaceholders(node) {
+    if (node.h.includes('pending-figure')) {
+      for (const match of node.h.matchAll(/class="pending-figure" id="([^"]+)"/g)) {
+        const id = match[1];
+        if (earlyFills.has(id)) {
+          node.h = node.h.replace(placeholderPattern(id), earlyFills.get(id));
+          earlyFills.delete(id);
+        } else {
+          pendingFigures.set(id, node);
+        }
+      }
+    }
+    if (node.c) {
+      node.c.forEach(registerPlaceholders);
+    }
+  }
+
+  function fillFigure(id, html) {
+    const node = pendingFigures.get(id);
+    if (!node) {
+      earlyFills.set(id, html);
+      return;
+    }
+    pendingFigures.delete(id);
+    node.h = node.h.replace(placeholderPattern(id), html);
+    const el = document.getElementById(id);
+    if (el) {
+      el.outerHTML = html;
+    }
+  }
+
+  // ============ Expand links ============
+
+  const expanding = new Map();   // token -> node holding the link (null in html mode)
+
+  function expanderPattern(token) {
+    return new RegExp(`<span class='expand' data-expand='${token}'>[^<]*</span>`);
+  }
+
+  function requestExpand(el, node) {
+    const token = el.dataset.expand;
+    if (expanding.has(token)) {
+      return;
+    }
+    expanding.set(token, node);
+    el.textContent = '[…]';
+    vscode.postMessage({ type: 'expand', requestId, token });
+  }
+
+  function applyExpanded(token, lines) {
+    if (!expanding.has(token)) {
+      return;
+    }
+    const node = expanding.get(token);
+    expanding.delete(token);
+    if (!node) {
+      const el = container.querySelector(`[data-expand="${token}"]`);
+      if (el) {
+        el.outerHTML = lines.join('<br>');
+      }
+      return;
+    }
+    // The first node replaces the link; its children and any further nodes nest under the row
+    const result = lines.map(parseNode);
+    const first = result[0] || { h: '' };
+    node.h = node.h.replace(expanderPattern(token), first.h);
+    const children = (first.c || []).concat(result.slice(1));
+    if (children.length) {
+      node.c = (node.c || []).concat(children);
+      node.expanded = true;
+      rows = roots.reduce((out, root) => visibleRows(root, 0, out), []);
+    }
+    const index = rows.findIndex((row) => row.node === node);
+    if (index !== -1) {
+      rebuildFrom(index);
+    }
+  }
+
+  function visibleRows(node, depth, out) {
+    out.push({ node, depth });
+    if (node.expanded && node.c) {
+      for (const child of node.c) {
+        visibleRows(child, depth + 1, out);
+      }
+    }
+    return out;
+  }
+
+  function appendNodes(lines) {
+    const firstNewRow = rows.length;
+    for (const line of lines) {
+      const node = parseNode(line);
+      if (typeof node.fill === 'string') {
+        fillFigure(node.fill, node.h);
+        continue;
+      }
+      registerPlaceholders(node);
+      const parent = roots[roots.length - 1];
+      if (node.child && parent) {
+        parent.c = parent.c || [];
+        parent.c.push(node);
+        if (parent.expanded) {
+          visibleRows(node, 1, rows);
+        }
+      } else {
+        // Top-level nodes start expanded so their entries show up as they stream
+        node.expanded = true;
+        roots.push(node);
+        visibleRows(node, 0, rows);
+      }
+    }
+    rebuildFrom(firstNewRow);
+  }
+
+  function rowHtml(row, index) {
+    const node = row.node;
+    const toggle = node.c && node.c.length ? (node.expanded ? '▾' : '▸') : '';
+    const label = node.k !== undefined ? `${node.k}: ` : '';
+    return `<div class="row" data-index="${index}" style="padding-left: ${row.depth * INDENT_PX}px">`
+      + `<span class="toggle">${toggle}</span>${label}${node.h}</div>`;
+  }
+
+  function renderBlock(block) {
+    if (block.rendered) {
+      return;
+    }
+    const html = [];
+    for (let i = block.start; i < block.end; i++) {
+      html.push(rowHtml(rows[i], i));
+    }
+    block.el.innerHTML = html.join('');
+    block.el.style.height = '';
+    block.rendered = true;
+  }
+
+  function releaseBlock(block) {
+    if (!block.rendered) {
+      return;
+    }
+    // Keep the measured height so the scroll position doesn't move
+    block.el.style.height = `${block.el.offsetHeight}px`;
+    block.el.innerHTML = '';
+    block.rendered = false;
+  }
+
+  // Rows before `rowIndex` are unchanged; recreate the blocks from there on.
+  function rebuildFrom(rowIndex) {
+    const firstBlock = Math.floor(rowIndex / BLOCK_ROWS);
+    const wasRendered = blocks[firstBlock] !== undefined && blocks[firstBlock].rendered;
+    for (const block of blocks.splice(firstBlock)) {
+      observer.unobserve(block.el);
+      block.el.remove();
+    }
+    for (let start = firstBlock * BLOCK_ROWS; start < rows.length; start += BLOCK_ROWS) {
+      const el = document.createElement('div');
+      const block = { start, end: Math.min(start + BLOCK_ROWS, rows.length), el, rendered: false };
+      el.dataset.block = String(blocks.length);
+      el.style.height = `${(block.end - block.start) * ROW_HEIGHT}px`;
+      blocks.push(block);
+      container.appendChild(el);
+      observer.observe(el);
+    }
+    // Redraw the block in view right away instead of waiting for the observer
+    if (wasRendered && blocks[firstBlock]) {
+      renderBlock(blocks[firstBlock]);
+    }
+  }
+
+  function toggleRow(index) {
+    const row = rows[index];
+    const node = row.node;
+    if (!node.c || !node.c.length) {
+      return;
+    }
+    if (node.expanded) {
+      let end = index + 1;
+      while (end < rows.length && rows[end].depth > row.depth) {
+        end++;
+      }
+      rows.splice(index + 1, end - index - 1);
+      node.expanded = false;
+    } else {
+      node.expanded = true;
+      const subtree = visibleRows(node, row.depth, []).slice(1);
+      rows = rows.slice(0, index + 1).concat(subtree, rows.slice(index + 1));
+    }
+    rebuildFrom(index);
+  }
+
+  container.addEventListener('click', (event) => {
+    const target = event.target;
+    if (!(target instanceof Element) || target.closest('a')) {
+      return;
+    }
+    const expander = target.closest('[data-expand]');
+    if (expander) {
+      const expanderRow = expander.closest('.row');
+      requestExpand(expander, expanderRow ? rows[Number(expanderRow.dataset.index)].node : null);
+      return;
+    }
+    const rowEl = target.closest('.row');
+    if (rowEl && !window.getSelection().toString()) {
+      toggleRow(Number(rowEl.dataset.index));
+    }
+  });
+
+  // ============ Messages ============
+
+  const append = mode === 'json' ? appendNodes : appendHtml;
+
+  window.addEventListener('message', (event) => {
+    const message = event.data;
+    if (message.requestId !== requestId) {
+      return;
+    }
+    switch (message.type) {
+      case 'lines':
+        append(message.lines);
+        break;
+      case 'expanded':
+        applyExpanded(message.token, message.lines);
+        break;
+      case 'error':
+        appendHtml([`<span style='color: red'>${message.html}</span>`]);
+        finish();
+        break;
+      case 'done':
+        finish();
+        break;
+    }
+  });
+
+  vscode.postMessage({ type: 'ready', requestId });
+})();
@@ -3,19 +3,60 @@
 """
 sys.argv[1]: File Type ID
 sys.argv[2]: File Path
+sys.argv[3]: Mode (optional, `full` or `truncated`)
+sys.argv[4:]: Options (optional, `--key=value`)
 """
 
+import os
+import re
+import ast
+import array
 import sys
+import json
+import struct
+import pickle
+import pickletools
+import signal
+import time
 import types
+import threading
+import zipfile
+import zlib
+from collections import Counter, deque, namedtuple
 from enum import Enum
-from io import BytesIO
+from io import BufferedReader, BytesIO, RawIOBase
 import base64
+import dataclasses
+import hashlib
+import html
+import inspect
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 # ============ Configuration ============
 MAX_DEPTH = 10         # Max nesting level to prevent infinite recursion
 MAX_ITEMS = 30         # Max items to show per collection (start + end)
 MAX_STR_LEN = 1000      # Max string characters before truncation
 INDENT_SPACER = "&nbsp;&nbsp;&nbsp;&nbsp;" # 4 spaces for HTML indentation
+MEMORY_LIMIT_MB = 4096  # Max memory of the preview process (0 = unlimited)
+TIME_LIMIT_SEC = 60     # Max wall-clock time of the preview process (0 = unlimited)
+STRATEGY = 'auto'       # Preview strategy: auto, full, mmap, header, sampled or scan
+STATS_SAMPLE_SIZE = 1000000  # Max array elements read to compute statistics
+SCAN_MAX_OPS = 2000000       # Max pickle opcodes visited by an opcode scan
+OUTPUT_MODE = 'html'    # `html` lines, or `json` nodes for the tree view
+IMAGE_DIR = None        # Directory for rendered images and indexes (None = inline base64, no caching)
+IMAGE_URI = None        # URI under which the webview loads IMAGE_DIR
+FIGURE_DPI = 100        # Resolution of rendered matplotlib figures
+THUMBNAIL_SIZE = 640    # Max width/height (px) of rendered images
+CONTACT_SHEET_SIZE = 16 # Samples shown of batched (N×H×W×C) image arrays
+FRAME_SAMPLE_ROWS = 100000   # DataFrame column stats are sampled above this many rows
+MERGE_SHARDS = True     # Preview a checkpoint shard as the whole sharded checkpoint
+EXPAND = None           # Token of an expand link: print only what it stands for
 
 def set_config(mode):
     global MAX_DEPTH, MAX_ITEMS, MAX_STR_LEN
@@ -27,6 +68,48 @@ def set_config(mode):
             np.set_printoptions(threshold=sys.maxsize)
         if torch:
             torch.set_printoptions(threshold=float('inf'))
+
+def parse_options(args):
+    """Parses `--key=value` arguments into a dict (dashes become underscores)"""
+    options = {}
+    for arg in args:
+        if arg.startswith('--') and '=' in arg:
+            key, value = arg[2:].split('=', 1)
+            options[key.replace('-', '_')] = value
+    return options
+
+def _option_value(options, key, convert):
+    """convert(options[key]); a ValueError names the option and the bad value"""
+    try:
+        return convert(options[key])
+    except ValueError:
+        raise ValueError(f"invalid value for --{key.replace('_', '-')}: {options[key]!r}") from None
+
+def set_options(options):
+    global MEMORY_LIMIT_MB, TIME_LIMIT_SEC, STRATEGY, OUTPUT_MODE
+    global IMAGE_DIR, IMAGE_URI, FIGURE_DPI, THUMBNAIL_SIZE, FRAME_SAMPLE_ROWS
+    global MERGE_SHARDS, EXPAND
+    if 'memory_limit_mb' in options:
+        MEMORY_LIMIT_MB = _option_value(options, 'memory_limit_mb', int)
+    if 'time_limit_sec' in options:
+        TIME_LIMIT_SEC = _option_value(options, 'time_limit_sec', float)
+    if 'strategy' in options:
+        STRATEGY = options['strategy']
+    if 'output' in options:
+        OUTPUT_MODE = options['output']
+    if 'image_dir' in options and 'image_uri' in options:
+        IMAGE_DIR = options['image_dir']
+        IMAGE_URI = options['image_uri'].rstrip('/')
+    if 'figure_dpi' in options:
+        FIGURE_DPI = _option_value(options, 'figure_dpi', int)
+    if 'thumbnail_size' in options:
+        THUMBNAIL_SIZE = _option_value(options, 'thumbnail_size', int)
+    if 'frame_sample_rows' in options:
+        FRAME_SAMPLE_ROWS = _option_value(options, 'frame_sample_rows', int)
+    if 'merge_shards' in options:
+        MERGE_SHARDS = options['merge_shards'].lower() not in ('false', '0', 'no')
+    if 'expand' in options:
+        EXPAND = options['expand']
 # =======================================
 
 class FileType(Enum):
@@ -34,6 +117,15 @@ class FileType(Enum):
     PICKLE = 1
     PYTORCH = 2
     COMPRESSED_PICKLE = 3
+    PARQUET = 4
+    ARROW = 5  # Arrow IPC files and streams, Feather
+    HDF5 = 6
+    MATLAB = 7
+    SAFETENSORS = 8
+    CHECKPOINT_INDEX = 9  # *.safetensors.index.json / *.bin.index.json of sharded checkpoints
+    TAR = 10  # Uncompressed tar, e.g. WebDataset shards
+    JOBLIB = 11
+    DBM = 12  # shelve / dbm stores
 
 # Library Loading with Fallbacks
 try:
@@ -56,21 +148,1205 @@ try:
 except:
     HAS_MPL = False
 
+# ============ Resource Limits ============
+
+CostEstimate = namedtuple('CostEstimate', ['file_size', 'memory', 'basis'])
+
+PICKLE_EXPANSION = 3   # Python objects take roughly 3x their pickled size in memory
+
+def _format_bytes(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num) < 1024:
+            return f"{num:.4g} {unit}"
+        num /= 1024
+    return f"{num:.4g} TB"
+
+def _format_count(num):
+    for unit in ('', 'K', 'M', 'B'):
+        if abs(num) < 1000:
+            return f"{num:.4g}{unit}"
+        num /= 1000
+    return f"{num:.4g}T"
+
+def _read_npy_header(f):
+    """Reads (shape, fortran_order, dtype) from an open .npy stream"""
+    version = np.lib.format.read_magic(f)
+    if version == (1, 0):
+        return np.lib.format.read_array_header_1_0(f)
+    return np.lib.format.read_array_header_2_0(f)
+
+def _proc_statm():
+    """Returns (virtual, resident) bytes of this process, or None off Linux"""
+    try:
+        with open('/proc/self/statm') as f:
+            fields = f.read().split()
+        page_size = os.sysconf('SC_PAGE_SIZE')
+        return int(fields[0]) * page_size, int(fields[1]) * page_size
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def _resident_memory():
+    statm = _proc_statm()
+    if statm:
+        return statm[1]
+    if resource is not None:
+        # Peak RSS: kilobytes on Linux, bytes on macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss * 1024
+    return None
+
+def _available_memory():
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def estimate_cost(file_type, file_path):
+    """Estimates the memory a full load needs, from headers and file size only"""
+    file_size = os.path.getsize(file_path)
+
+    if file_type == FileType.NUMPY.value and np is not None:
+        with open(file_path, 'rb') as f:
+            magic = f.read(6)
+            f.seek(0)
+            if magic == b'\x93NUMPY':
+                shape, _, dtype = _read_npy_header(f)
+                count = int(np.prod(shape)) if shape else 1
+                return CostEstimate(file_size, count * dtype.itemsize, 'npy header')
+        if zipfile.is_zipfile(file_path):
+            with zipfile.ZipFile(file_path) as zf:
+                total = sum(info.file_size for info in zf.infolist())
+            return CostEstimate(file_size, total, 'npz directory')
+
+    if file_type == FileType.PYTORCH.value and zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as zf:
+            total = 0
+            for info in zf.infolist():
+                if info.filename.endswith('.pkl'):
+                    total += info.file_size * PICKLE_EXPANSION
+                else:
+                    total += info.file_size
+        return CostEstimate(file_size, total, 'checkpoint directory')
+
+    if file_type == FileType.COMPRESSED_PICKLE.value and file_path.endswith('.gz'):
+        # gzip stores the uncompressed size modulo 2**32 in its last 4 bytes
+        with open(file_path, 'rb') as f:
+            f.seek(-4, os.SEEK_END)
+            raw_size = int.from_bytes(f.read(4), 'little')
+        if raw_size < file_size:
+            raw_size = file_size * 4  # wrapped around, assume a typical ratio
+        return CostEstimate(file_size, raw_size * PICKLE_EXPANSION, 'gzip trailer')
+
+    return CostEstimate(file_size, file_size * PICKLE_EXPANSION, 'file size')
+
+def warn_if_expensive(file_type, file_path):
+    """Prints a warning before loading when the estimate exceeds the memory limit"""
+    try:
+        estimate = estimate_cost(file_type, file_path)
+    except Exception:
+        return None
+    if MEMORY_LIMIT_MB and estimate.memory > MEMORY_LIMIT_MB * 1024 * 1024:
+        emit(f"<span style='color:orange'>Warning: loading this file needs about "
+              f"{_format_bytes(estimate.memory)} (from {estimate.basis}, file size "
+              f"{_format_bytes(estimate.file_size)}), above the memory limit of "
+              f"{_format_bytes(MEMORY_LIMIT_MB * 1024 * 1024)}. The preview may stop early.</span>")
+        sys.stdout.flush()
+    return estimate
+
+class ResourceGuard:
+    """
+    Enforces the memory and wall-clock limits of a preview run.
+    A watchdog thread polls RSS and elapsed time and records which limit was hit.
+    The formatter then stops descending so the partial result still gets printed;
+    if the main thread is stuck inside a loader, the watchdog flushes and exits.
+    Only resident memory counts, so memory-mapped files larger than the limit
+    still open (no RLIMIT_AS / RLIMIT_DATA, which would refuse their mappings).
+    """
+    POLL_INTERVAL = 0.2
+    GRACE_PERIOD = 2.0         # Time the main thread gets to wind down after a time trip...
+    MEMORY_GRACE_PERIOD = 0.2  # ...and after a memory trip, while RSS may still be growing
+
+    def __init__(self, memory_limit_mb, time_limit_sec):
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.time_limit = time_limit_sec
+        self.tripped = None
+        self._started_at = time.monotonic()
+        self._tripped_at = None
+        self._done = threading.Event()
+
+    def start(self):
+        if self.memory_limit or self.time_limit:
+            threading.Thread(target=self._watch, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._done.set()
+
+    def notice(self):
+        if self.tripped == 'memory':
+            limit = f"memory limit ({_format_bytes(self.memory_limit)})"
+        else:
+            limit = f"time limit ({self.time_limit:g}s)"
+        return (f"<span style='color:orange'>Preview stopped: {limit} reached. "
+                f"The output above is partial.</span>")
+
+    def _check(self):
+        if self.time_limit and time.monotonic() - self._started_at > self.time_limit:
+            return 'time'
+        if self.memory_limit:
+            rss = _resident_memory()
+            if rss is not None and rss > self.memory_limit:
+                return 'memory'
+        return None
+
+    def _watch(self):
+        while not self._done.wait(self.POLL_INTERVAL):
+            if self.tripped is None:
+                self.tripped = self._check()
+                if self.tripped:
+                    self._tripped_at = time.monotonic()
+            elif time.monotonic() - self._tripped_at > (
+                    self.MEMORY_GRACE_PERIOD if self.tripped == 'memory' else self.GRACE_PERIOD):
+                # Main thread didn't wind down (e.g. stuck in np.load), bail out
+                emit(self.notice())
+                sys.stdout.flush()
+                os._exit(0)
+
+_guard = None  # Active ResourceGuard, installed by main()
+
+def limit_reached():
+    return _guard is not None and _guard.tripped is not None
+
+def _stats_sample(arr):
+    """
+    Returns (sample, is_sampled). Arrays above STATS_SAMPLE_SIZE are sampled as
+    evenly spaced contiguous blocks, so memory-mapped arrays only touch a few pages.
+    """
+    if arr.size <= STATS_SAMPLE_SIZE:
+        return arr, False
+    flat = arr.reshape(-1, order='A')
+    starts, block = _sample_blocks(flat.size)
+    return np.concatenate([flat[start:start + block] for start in starts]), True
+
+def _sample_blocks(size):
+    """(start indices, block length) of the 64 evenly spaced blocks sampled from `size` elements"""
+    blocks = 64
+    block = max(STATS_SAMPLE_SIZE // blocks, 1)
+    return np.linspace(0, size - block, blocks).astype(np.int64).tolist(), block
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+HIST_BINS = 16
+NUMERIC_PROBE_SIZE = 1000  # List elements type-checked to detect numeric lists
+FROMITER_CHUNK = 65536     # List elements converted per np.fromiter call
+
+def summarize_values(sample):
+    """min/max/mean of a numeric sample followed by its histogram sparkline"""
+    text = f"min: {np.min(sample):.4g}, max: {np.max(sample):.4g}, mean: {np.mean(sample):.4g}"
+    spark = _sparkline(sample)
+    if spark:
+        text += f" <span title='histogram, {HIST_BINS} bins from min to max'>{spark}</span>"
+    return text
+
+CATEGORY_MAX_VALUES = 32  # Integer arrays with at most this many distinct values get value counts
+STATS_CHUNK = 65536       # Elements processed at a time by the dtype-aware summaries
+
+def dtype_summary(sample):
+    """
+    Summary of a flat (sampled) array by dtype: value counts for bools and
+    low-cardinality integers, lengths and most common values for strings, the
+    range of datetimes, magnitude and phase of complex numbers; else
+    summarize_values. Bounded temporaries: STATS_CHUNK elements at a time.
+    """
+    kind = sample.dtype.kind
+    if kind == 'b':
+        true = sum(int(np.count_nonzero(chunk)) for chunk in _chunks(sample))
+        return f"True: {true} ({true / sample.size:.1%}), False: {sample.size - true}"
+    if kind in 'iu':
+        return _int_counts_summary(sample) or summarize_values(sample)
+    if kind in 'US':
+        return _string_summary(sample)
+    if kind in 'mM':
+        return _time_summary(sample)
+    if kind == 'c':
+        magnitude = np.empty(sample.size)
+        phase = np.empty(sample.size)
+        for start in range(0, sample.size, STATS_CHUNK):
+            chunk = sample[start:start + STATS_CHUNK]
+            magnitude[start:start + chunk.size] = np.abs(chunk)
+            phase[start:start + chunk.size] = np.angle(chunk)
+        return f"|z| {summarize_values(magnitude)}; phase {summarize_values(phase)}"
+    return summarize_values(sample)
+
+def _chunks(flat):
+    for start in range(0, flat.size, STATS_CHUNK):
+        yield flat[start:start + STATS_CHUNK]
+
+def _top_counts(counts, total):
+    return ', '.join(f"{cell_html(value)} ×{count} ({count / total:.0%})"
+                     for value, count in counts.most_common(TOP_K))
+
+def _int_counts_summary(sample):
+    """Value counts of an integer array (labels, masks), or None above CATEGORY_MAX_VALUES distinct values"""
+    lo, hi = int(sample.min()), int(sample.max())
+    counts = Counter()
+    if hi - lo < STATS_CHUNK:
+        bins = np.zeros(hi - lo + 1, dtype=np.int64)
+        for chunk in _chunks(sample):
+            # Offsets from lo must not wrap around in small dtypes (int8: 127 - -128)
+            offsets = chunk - chunk.dtype.type(lo) if chunk.dtype.kind == 'u' else chunk.astype(np.int64) - lo
+            bins += np.bincount(offsets.astype(np.int64), minlength=bins.size)
+            if np.count_nonzero(bins) > CATEGORY_MAX_VALUES:
+                return None
+        counts.update({lo + int(i): int(bins[i]) for i in np.flatnonzero(bins)})
+    else:
+        for chunk in _chunks(sample):
+            values, chunk_counts = np.unique(chunk, return_counts=True)
+            counts.update(dict(zip(values.tolist(), chunk_counts.tolist())))
+            if len(counts) > CATEGORY_MAX_VALUES:
+                return None
+    return f"{len(counts)} distinct: {_top_counts(counts, sample.size)}"
+
+def _string_summary(sample):
+    """Length distribution and most common values of a str / bytes array"""
+    lengths = np.empty(sample.size, dtype=np.int64)
+    counts = Counter()
+    for start in range(0, sample.size, STATS_CHUNK):
+        chunk = sample[start:start + STATS_CHUNK]
+        lengths[start:start + chunk.size] = np.char.str_len(chunk)
+        values, chunk_counts = np.unique(chunk, return_counts=True)
+        if sample.dtype.kind == 'S':
+            values = [value.decode('utf-8', errors='replace') for value in values.tolist()]
+        counts.update(dict(zip(values if isinstance(values, list) else values.tolist(), chunk_counts.tolist())))
+    return f"len {summarize_values(lengths)}; top: {_top_counts(counts, sample.size)} <i>({len(counts)} distinct)</i>"
+
+def _time_summary(sample):
+    """Range of a datetime64 / timedelta64 array, with its NaT count"""
+    nat = sum(int(np.count_nonzero(np.isnat(chunk))) for chunk in _chunks(sample))
+    valid = sample[~np.isnat(sample)] if nat else sample
+    if valid.size == 0:
+        return "<i>all NaT</i>"
+    lo, hi = valid.min(), valid.max()
+    text = f"from {lo} to {hi}" if sample.dtype.kind == 'M' else f"min: {lo}, max: {hi}"
+    if sample.dtype.kind == 'M':
+        text += f" <i>(span {hi - lo})</i>"
+    return text + (f", NaT: {nat}" if nat else "")
+
+def _sparkline(sample):
+    """Histogram of the finite values as block characters; empty if there is no spread"""
+    if sample.dtype.kind not in 'iuf':
+        return ""
+    values = sample[np.isfinite(sample)] if sample.dtype.kind == 'f' else sample
+    if values.size == 0:
+        return ""
+    lo, hi = float(values.min()), float(values.max())
+    if lo == hi:
+        return ""
+    try:
+        counts, _ = np.histogram(values, bins=HIST_BINS, range=(lo, hi))
+    except ValueError:
+        return ""  # Spread too small for HIST_BINS finite bins
+    # Any non-empty bin gets at least the second level so it stays visible
+    levels = np.ceil(counts / counts.max() * (len(SPARK_CHARS) - 1)).astype(int)
+    return ''.join(SPARK_CHARS[level] for level in levels)
+
+OBJECT_PROBE_SIZE = 1000  # Elements of object arrays type-checked, evenly spaced
+
+def object_types_summary(flat):
+    """
+    Type frequencies of up to OBJECT_PROBE_SIZE evenly spaced elements of a flat
+    object array, followed by their stats when they are all numbers.
+    """
+    positions = np.unique(np.linspace(0, flat.size - 1, min(flat.size, OBJECT_PROBE_SIZE)).astype(np.int64))
+    sample = flat[positions]
+    types = Counter(type(value).__name__ for value in sample)
+    text = ', '.join(f"{name} ×{count}" for name, count in types.most_common(TOP_K))
+    if len(types) > TOP_K:
+        text += f", <i>{len(types) - TOP_K} more types</i>"
+    if positions.size < flat.size:
+        text += f" <i>(of {positions.size} sampled)</i>"
+    numbers = (int, float, np.integer, np.floating)
+    if all(isinstance(value, numbers) and not isinstance(value, (bool, np.bool_)) for value in sample):
+        text += " " + summarize_values(np.array(sample.tolist(), dtype=np.float64))
+    return text
+
+def numeric_list_sample(seq):
+    """
+    Returns (values, is_sampled) for a list or tuple of ints and floats, or None
+    if it isn't one. Element types are probed on NUMERIC_PROBE_SIZE evenly spaced
+    elements; the conversion (np.fromiter, in chunks) touches at most
+    STATS_SAMPLE_SIZE elements, taken as evenly spaced blocks like _stats_sample.
+    """
+    length = len(seq)
+    types = set(map(type, seq[::max(length // NUMERIC_PROBE_SIZE, 1)]))
+    if not all(issubclass(t, (int, float)) and not issubclass(t, bool) for t in types):
+        return None
+    ints = all(issubclass(t, int) for t in types)
+
+    if length <= STATS_SAMPLE_SIZE:
+        ranges, sampled = [(0, length)], False
+    else:
+        blocks = 64
+        block = max(STATS_SAMPLE_SIZE // blocks, 1)
+        starts = np.linspace(0, length - block, blocks).astype(np.int64)
+        ranges, sampled = [(int(start), int(start) + block) for start in starts], True
+
+    try:
+        chunks = _fromiter_chunks(seq, ranges, np.int64) if ints else None
+        if chunks is None:
+            # A float the int probe missed: an int64 np.fromiter would truncate it
+            chunks = _fromiter_chunks(seq, ranges, np.float64)
+    except (TypeError, ValueError, OverflowError):
+        # A non-number the probe missed, or an int beyond int64
+        return None
+    return np.concatenate(chunks), sampled
+
+def _fromiter_chunks(seq, ranges, dtype):
+    """
+    np.fromiter of the (start, stop) ranges of `seq`, FROMITER_CHUNK elements at
+    a time. For int64, every chunk's element types are checked first; returns
+    None as soon as one holds anything but ints.
+    """
+    chunks = []
+    for start, stop in ranges:
+        for chunk_start in range(start, stop, FROMITER_CHUNK):
+            part = seq[chunk_start:min(chunk_start + FROMITER_CHUNK, stop)]
+            if dtype is np.int64 and not all(issubclass(t, int) for t in set(map(type, part))):
+                return None
+            chunks.append(np.fromiter(part, dtype=dtype, count=len(part)))
+    return chunks
+
+# ----- Lists of records -----
+
+TABLE_MIN_ROWS = 5        # Shorter lists of records keep the nested view
+TABLE_MAX_COLUMNS = 50
+TABLE_PREVIEW_ROWS = 10   # Head + tail rows shown in the table
+TABLE_CELL_LEN = 40
+TOP_K = 3                 # Most common values listed for categorical columns
+
+RecordSchema = namedtuple('RecordSchema', ['kind', 'columns'])
+_MISSING = object()       # A key the dict row doesn't have
+
+def _record_kind(row):
+    if isinstance(row, dict):
+        return 'dict'
+    if isinstance(row, tuple) and hasattr(type(row), '_fields'):
+        return 'namedtuple'
+    if dataclasses.is_dataclass(row) and not isinstance(row, type):
+        return 'dataclass'
+    return None
+
+def _record_columns(kind, row):
+    if kind == 'dict':
+        return list(row.keys())
+    if kind == 'namedtuple':
+        return list(row._fields)
+    return [field.name for field in dataclasses.fields(row)]
+
+def record_value(schema, row, column):
+    if schema.kind == 'dict':
+        return row.get(column, _MISSING)
+    return getattr(row, column, _MISSING)
+
+def infer_schema(seq):
+    """
+    Returns a RecordSchema if the list or tuple holds records of one kind: dicts
+    with str keys, or namedtuples / dataclass instances of one type. Columns
+    come from NUMERIC_PROBE_SIZE evenly spaced rows, in first-seen order.
+    Returns None otherwise, and for dicts whose keys vary so much that the
+    table would be mostly empty.
+    """
+    rows = seq[::max(len(seq) // NUMERIC_PROBE_SIZE, 1)]
+    kind = _record_kind(rows[0])
+    if kind is None:
+        return None
+    columns = {}
+    widths = []
+    for row in rows:
+        if _record_kind(row) != kind or (kind != 'dict' and type(row) is not type(rows[0])):
+            return None
+        row_columns = _record_columns(kind, row)
+        if kind == 'dict' and not all(isinstance(column, str) for column in row_columns):
+            return None
+        widths.append(len(row_columns))
+        columns.update(dict.fromkeys(row_columns))
+        if len(columns) > TABLE_MAX_COLUMNS:
+            return None
+    if not columns or len(columns) > 2 * sorted(widths)[len(widths) // 2]:
+        return None
+    return RecordSchema(kind, list(columns))
+
+def cell_html(value):
+    """Short single-line HTML of a table cell"""
+    if value is _MISSING:
+        return ""
+    if value is None:
+        return "<span style='color:#888'>None</span>"
+    if isinstance(value, bool):
+        return f"<span style='color:#cc7832'>{value}</span>"
+    if isinstance(value, (int, float, complex)):
+        return f"<span style='color:#6897bb'>{value}</span>"
+    if isinstance(value, str):
+        text = value if len(value) <= TABLE_CELL_LEN else value[:TABLE_CELL_LEN] + '...'
+        text = text.replace('<', '&lt;').replace('>', '&gt;').replace('\n', '\\n')
+        return f"<span style='color:#6a8759'>'{text}'</span>"
+    if np is not None and isinstance(value, np.ndarray):
+        return f"<i>ndarray{tuple(value.shape)}</i>".replace(" ", "")
+    if hasattr(value, '__len__'):
+        try:
+            return f"<i>{type(value).__name__} (len={len(value)})</i>"
+        except Exception:
+            pass
+    return f"<i>{type(value).__name__}</i>"
+
+def column_summary(values, nulls=0):
+    """
+    HTML summary of one column: numeric columns get the array stats (computed on
+    an ndarray), others their TOP_K most common values. `values` is a list, where
+    None and missing keys count as nulls, or an ndarray without nulls; `nulls`
+    adds the nulls already dropped from it.
+    """
+    if np is not None and isinstance(values, np.ndarray) and values.dtype.kind in 'iufmM':
+        return _array_column_summary(values, nulls)
+    present = [value for value in values if value is not None and value is not _MISSING]
+    nulls += len(values) - len(present)
+    summary = "<i>all null</i>"
+    numeric = all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present)
+    if present and numeric and np is not None:
+        dtype = np.int64 if all(isinstance(value, int) for value in present) else np.float64
+        try:
+            summary = f"<i>{np.dtype(dtype)}</i> " + summarize_values(
+                np.fromiter(present, dtype=dtype, count=len(present)))
+        except OverflowError:
+            summary = "<i>int</i>"
+    elif present:
+        types = Counter(type(value).__name__ for value in present)
+        try:
+            counts = Counter(present)
+            top = ', '.join(f"{cell_html(value)} ×{count}" for value, count in counts.most_common(TOP_K))
+            summary = f"<i>{'/'.join(types)}</i> top: {top} <i>({len(counts)} distinct)</i>"
+        except TypeError:
+            # Unhashable values (lists, dicts...): show the type mix instead
+            summary = ', '.join(f"<i>{name}</i> ×{count}" for name, count in types.most_common(TOP_K))
+    if nulls:
+        summary += f", nulls: {nulls}"
+    return summary
+
+def _array_column_summary(values, nulls):
+    if values.size == 0:
+        summary = "<i>all null</i>"
+    elif values.dtype.kind in 'mM':
+        summary = f"<i>{values.dtype}</i> min: {values.min()}, max: {values.max()}"
+    else:
+        summary = f"<i>{values.dtype}</i> " + summarize_values(values)
+    if nulls:
+        summary += f", nulls: {nulls}"
+    return summary
+
+def table_indices(length):
+    """Head and tail row indices of a TABLE_PREVIEW_ROWS table, -1 marking the gap"""
+    if length <= TABLE_PREVIEW_ROWS:
+        return list(range(length))
+    head = TABLE_PREVIEW_ROWS // 2
+    return list(range(head)) + [-1] + list(range(length - head, length))
+
+def html_table(columns, rows, length):
+    """
+    A records table: `rows` holds (label, cells) HTML pairs for table_indices(length),
+    with None in place of the gap row.
+    """
+    cells = ''.join(f"<th>{str(column).replace('<', '&lt;').replace('>', '&gt;')}</th>"
+                    for column in columns)
+    table = [f"<table class='records'><tr><th></th>{cells}</tr>"]
+    for row in rows:
+        if row is None:
+            table.append(f"<tr><td colspan='{len(columns) + 1}'>"
+                         f"<i>... ({length - TABLE_PREVIEW_ROWS // 2 * 2} more rows) ...</i></td></tr>")
+            continue
+        label, cells = row
+        table.append(f"<tr><td>{label}</td>{''.join(f'<td>{cell}</td>' for cell in cells)}</tr>")
+    table.append("</table>")
+    return ''.join(table)
+
+# ----- DataFrames -----
+
+def dataframe_library(obj):
+    """'pandas' or 'polars' for their DataFrames and Series (and subclasses), without importing either"""
+    for cls in type(obj).__mro__:
+        library = cls.__module__.split('.')[0]
+        if library in ('pandas', 'polars') and cls.__name__ in ('DataFrame', 'Series'):
+            return library
+    return None
+
+# ----- Sparse matrices -----
+
+SPARSE_WINDOW = 8  # Rows and columns of the dense top-left block shown
+
+def scipy_sparse_format(obj):
+    """'csr', 'coo', ... for scipy.sparse matrices and arrays, without importing scipy"""
+    sparse = sys.modules.get('scipy.sparse')
+    if sparse is not None and sparse.issparse(obj):
+        return obj.format
+    return None
+
+def sparse_density(nnz, shape):
+    total = 1
+    for size in shape:
+        total *= size
+    return f"{100 * nnz / total:.3g}%" if total else "-"
+
+def sparse_window(rows, cols, values, shape):
+    """Dense top-left SPARSE_WINDOW block from (row, column, value) triplets"""
+    r, c = min(shape[0], SPARSE_WINDOW), min(shape[1], SPARSE_WINDOW)
+    mask = (rows < r) & (cols < c)
+    window = np.zeros((r, c), dtype=values.dtype)
+    np.add.at(window, (rows[mask], cols[mask]), values[mask])
+    return window
+
+def compressed_window(indptr, indices, values, shape, by_row):
+    """sparse_window of a CSR (by_row) or CSC matrix, reading only its first rows / columns"""
+    outer = min(shape[0 if by_row else 1], SPARSE_WINDOW)
+    end = int(indptr[outer])
+    major = np.repeat(np.arange(outer), np.diff(indptr[:outer + 1]))
+    minor = np.asarray(indices[:end])
+    rows, cols = (major, minor) if by_row else (minor, major)
+    return sparse_window(rows, cols, np.asarray(values[:end]), shape)
+
+def nnz_distribution(counts):
+    """Stats of the stored entries per row (or column), with the number of empty ones"""
+    counts = np.asarray(counts)
+    empty = int(np.count_nonzero(counts == 0))
+    return Html(summarize_values(counts) + (f", empty: {empty}" if empty else ""))
+
+# ----- Buffer-backed objects -----
+
+BYTES_PREVIEW_LEN = 64  # Leading bytes shown of bytes-like objects
+
+def buffer_view(obj):
+    """
+    ndarray view of bytes-like objects, array.array, memoryview and other
+    objects exposing __array_interface__ or the buffer protocol (PIL images,
+    Arrow buffers), without copying the payload. None for anything else.
+    """
+    if np is None or isinstance(obj, (str, np.generic)):
+        return None
+    if isinstance(obj, (bytes, bytearray)):
+        return np.frombuffer(obj, dtype=np.uint8)
+    cls = type(obj)
+    if hasattr(cls, '__array_interface__') or hasattr(cls, '__array_struct__'):
+        try:
+            return np.asarray(obj)
+        except Exception:
+            return None
+    try:
+        view = memoryview(obj)
+    except TypeError:
+        return None
+    try:
+        return np.asarray(view)
+    except (TypeError, ValueError, NotImplementedError):
+        # A format numpy doesn't know (e.g. ctypes structs): fall back to the raw bytes
+        return np.frombuffer(view.cast('B'), dtype=np.uint8) if view.c_contiguous else None
+
+def is_buffer_like(obj):
+    if isinstance(obj, (bytes, bytearray, memoryview, array.array)):
+        return True
+    cls = type(obj)
+    return (np is not None and not isinstance(obj, np.generic)
+            and (hasattr(cls, '__array_interface__') or hasattr(cls, '__array_struct__')))
+
+def bytes_preview(data):
+    """Escaped repr of the first BYTES_PREVIEW_LEN bytes"""
+    head = repr(bytes(data[:BYTES_PREVIEW_LEN])) + ('...' if len(data) > BYTES_PREVIEW_LEN else '')
+    return head.replace('<', '&lt;').replace('>', '&gt;')
+
+# ----- Repeated structures -----
+
+FOLD_MIN_RUN = 3                 # Shorter runs of same-shaped objects are listed one by one
+FOLD_SCAN_SIZE = 100000          # Longer lists are only probed, then folded whole or not at all
+_public_attrs_cache = {}         # type -> (attribute names, public attribute names)
+_own_formatter_cache = {}        # type -> whether JetBrainsFormatter has its own view of it
+
+def _value_shape(value):
+    if np is not None and isinstance(value, np.ndarray):
+        return ('ndarray', value.shape, value.dtype.str)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float  # 1 and 1.5 are the same kind of field
+    return type(value)
+
+def _has_own_formatter(obj):
+    """Objects JetBrainsFormatter renders before falling back to _format_object, decided once per type"""
+    cls = type(obj)
+    own = _own_formatter_cache.get(cls)
+    if own is None:
+        own = _own_formatter_cache[cls] = _detect_own_formatter(obj)
+    return own
+
+def _detect_own_formatter(obj):
+    if HAS_MPL and isinstance(obj, plt.Figure):
+        return True
+    if torch is not None and isinstance(obj, torch.Tensor):
+        return True
+    if dataframe_library(obj) is not None or h5py_object_kind(obj) is not None:
+        return True
+    if scipy_sparse_format(obj) is not None or is_buffer_like(obj):
+        return True
+    if torch is not None and isinstance(obj, torch.nn.Module):
+        return True
+    return isinstance(obj, (dict, list, tuple, set, str, bytes))
+
+def structure_signature(obj):
+    """
+    Structural signature of an object with __dict__: its type, public attribute
+    names and the kinds of their values (arrays with their shape and dtype).
+    The public names are cached per type while instances keep the same
+    attributes. Returns None for everything else.
+    """
+    attrs = getattr(obj, '__dict__', None)
+    if not isinstance(attrs, dict) or isinstance(obj, type) or _has_own_formatter(obj):
+        return None
+    cls = type(obj)
+    keys = tuple(attrs)
+    cached = _public_attrs_cache.get(cls)
+    if cached is None or cached[0] != keys:
+        cached = _public_attrs_cache[cls] = (keys, tuple(k for k in keys if not k.startswith('_')))
+    names = cached[1]
+    return (cls, names, tuple(_value_shape(attrs[name]) for name in names))
+
+def structure_runs(items):
+    """
+    Splits a list into (start, stop) runs of elements with one signature (None
+    signatures never form runs). NUMERIC_PROBE_SIZE evenly spaced elements are
+    probed first: lists without any object to fold (numbers, strings) stop
+    there, and lists above FOLD_SCAN_SIZE are folded whole if all probed
+    signatures are equal, else not at all. Returns None when there is no run
+    of FOLD_MIN_RUN.
+    """
+    length = len(items)
+    step = max(length // NUMERIC_PROBE_SIZE, 1)
+    signatures = [structure_signature(item) for item in items[::step]]
+    if all(signature is None for signature in signatures):
+        return None
+    if length > FOLD_SCAN_SIZE:
+        first = signatures[0]
+        if first is not None and all(signature == first for signature in signatures):
+            return [(0, length)]
+        return None
+    if step > 1:
+        signatures = [structure_signature(item) for item in items]
+    runs = []
+    start = 0
+    for i in range(1, length + 1):
+        if i == length or signatures[i] is None or signatures[i] != signatures[start]:
+            runs.append((start, i))
+            start = i
+    if not any(stop - start >= FOLD_MIN_RUN and signatures[start] is not None for start, stop in runs):
+        return None
+    return runs
+
+class FoldedRun:
+    """items[start:stop], objects sharing one structure signature"""
+    def __init__(self, items, start, stop):
+        self.items = items
+        self.start = start
+        self.stop = stop
+
+# ----- Module trees -----
+
+MODULE_TREE_MIN_KEYS = 8  # Smaller state_dicts keep the plain dict view
+
+class ModuleNode:
+    """One dotted prefix of a state_dict: sub-modules, own tensors and totals of everything below"""
+    def __init__(self, name, kind):
+        self.name = name
+        self.kind = kind
+        self.children = {}
+        self.tensors = {}
+        self.tensor_count = 0
+        self.params = 0
+        self.nbytes = 0
+        self.dtypes = Counter()
+        self._signature = None
+
+    def add(self, numel, nbytes, dtype):
+        self.tensor_count += 1
+        self.params += numel
+        self.nbytes += nbytes
+        self.dtypes[dtype] += 1
+
+    def signature(self):
+        """Structure of the subtree (names, shapes, dtypes), equal for identical blocks"""
+        if self._signature is None:
+            self._signature = (
+                self.kind,
+                tuple((name, child.signature()) for name, child in self.children.items()),
+                tuple((name, tuple(value.shape), str(value.dtype)) for name, value in self.tensors.items()))
+        return self._signature
+
+ModuleRepeat = namedtuple('ModuleRepeat', ['node', 'count'])  # `count` identical blocks, shown once
+
+def is_tensor_value(value):
+    return ((np is not None and isinstance(value, np.ndarray))
+            or (torch is not None and isinstance(value, torch.Tensor)))
+
+def tensor_meta(value):
+    """(numel, bytes, dtype name) of a tensor, ndarray or checkpoint header entry, without touching its data"""
+    if np is not None and isinstance(value, np.ndarray):
+        return value.size, value.nbytes, str(value.dtype)
+    if isinstance(value, SafeTensor):
+        return value.numel, value.nbytes, safetensors_dtype_name(value.dtype)
+    if isinstance(value, ShardTensor):
+        return value.numel, value.nbytes, value.dtype
+    return value.numel(), value.numel() * value.element_size(), str(value.dtype).replace('torch.', '')
+
+def has_module_keys(keys):
+    """At least MODULE_TREE_MIN_KEYS string keys, some of them dotted"""
+    if len(keys) < MODULE_TREE_MIN_KEYS:
+        return False
+    return all(isinstance(key, str) for key in keys) and any('.' in key for key in keys)
+
+def is_state_dict(d):
+    """At least MODULE_TREE_MIN_KEYS tensors under string keys, some of them dotted"""
+    return has_module_keys(d) and all(is_tensor_value(value) for value in d.values())
+
+def build_module_tree(named_tensors, kind, kinds=None):
+    """
+    Groups (dotted name, tensor) pairs into a ModuleNode tree. Each tensor is
+    added to the totals of every prefix on its way down, so the counts of all
+    levels come from this one pass. `kinds` maps prefixes to a type name
+    (sub-module classes); other prefixes are 'module'.
+    """
+    kinds = kinds or {}
+    root = ModuleNode('', kind)
+    for full_name, value in named_tensors:
+        meta = tensor_meta(value)
+        *path, leaf = full_name.split('.')
+        node = root
+        node.add(*meta)
+        for depth, part in enumerate(path):
+            child = node.children.get(part)
+            if child is None:
+                prefix = '.'.join(path[:depth + 1])
+                child = node.children[part] = ModuleNode(part, kinds.get(prefix, 'module'))
+            child.add(*meta)
+            node = child
+        node.tensors[leaf] = value
+    return root
+
+def module_tree_children(node):
+    """
+    (label, ModuleNode or ModuleRepeat) for the sub-modules of a node. Chains of
+    single sub-modules are joined (`model.encoder`), and runs of numbered blocks
+    with the same structure (layers 0..N) become one ModuleRepeat.
+    """
+    items = []
+    for name, child in node.children.items():
+        while not child.tensors and len(child.children) == 1:
+            sub_name, child = next(iter(child.children.items()))
+            name = f"{name}.{sub_name}"
+        items.append((name, child))
+    i = 0
+    while i < len(items):
+        name, child = items[i]
+        end = i + 1
+        if name.isdigit():
+            while (end < len(items) and items[end][0].isdigit()
+                   and int(items[end][0]) == int(name) + end - i
+                   and items[end][1].signature() == child.signature()):
+                end += 1
+        if end - i > 1:
+            yield f"{name}..{items[end - 1][0]}", ModuleRepeat(child, end - i)
+        else:
+            yield name, child
+        i = end
+
+def dtype_mix(dtypes):
+    """`dtype=float32`, or the tensor count of each dtype when there are several"""
+    if len(dtypes) == 1:
+        return f"dtype={next(iter(dtypes))}"
+    return "dtypes=" + ", ".join(f"{dtype} ×{count}" for dtype, count in dtypes.most_common())
+
+# ----- Fallback repr -----
+
+REPR_TIME_LIMIT_SEC = 1.0   # Max time a str() of an object without a formatter may take
+REPR_MAX_LEN = 1024 * 1024  # Longer str() results mark their type as too large to print
+_slow_repr_types = {}       # type -> why its str() is skipped ('slow' or 'large')
+
+class ReprTimeout(Exception):
+    pass
+
+def call_guarded(func):
+    """
+    Calls func() and raises ReprTimeout if it runs longer than REPR_TIME_LIMIT_SEC.
+    Uses SIGALRM, so outside the main thread (or without SIGALRM) the call is
+    only bounded by the ResourceGuard.
+    """
+    if not hasattr(signal, 'setitimer') or threading.current_thread() is not threading.main_thread():
+        return func()
+
+    def on_alarm(signum, frame):
+        raise ReprTimeout()
+
+    previous = signal.signal(signal.SIGALRM, on_alarm)
+    signal.setitimer(signal.ITIMER_REAL, REPR_TIME_LIMIT_SEC)
+    try:
+        return func()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def _slot_names(cls):
+    names = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        for name in ([slots] if isinstance(slots, str) else slots):
+            if name not in ('__dict__', '__weakref__') and name not in names:
+                names.append(name)
+    return names
+
+def _state_attrs(state):
+    """Attributes in a pickle state: a dict, or a (dict, slots dict) pair"""
+    if isinstance(state, tuple) and len(state) == 2:
+        attrs = dict(state[0]) if isinstance(state[0], dict) else {}
+        if isinstance(state[1], dict):
+            attrs.update(state[1])
+        return attrs
+    return dict(state) if isinstance(state, dict) else None
+
+def structural_view(obj):
+    """
+    Public attributes of an object without __dict__, from its __slots__, a
+    custom __getstate__ or the state of __reduce_ex__, as (source, attrs).
+    The hooks run under the repr time limit. Returns None when none of them
+    yields public attributes.
+    """
+    cls = type(obj)
+    slots = [name for name in _slot_names(cls) if not name.startswith('_')]
+    if slots:
+        missing = object()
+        values = {name: getattr(obj, name, missing) for name in slots}
+        return '__slots__', {name: value for name, value in values.items() if value is not missing}
+    hooks = []
+    getstate = getattr(cls, '__getstate__', None)
+    if getstate is not None and getstate is not getattr(object, '__getstate__', None):
+        hooks.append(('__getstate__', obj.__getstate__))
+    hooks.append(('__reduce_ex__', lambda: obj.__reduce_ex__(2)))
+    for source, hook in hooks:
+        try:
+            state = call_guarded(hook)
+        except ReprTimeout:
+            _slow_repr_types[cls] = 'slow'
+            return None
+        except Exception:
+            continue
+        if source == '__reduce_ex__':
+            state = state[2] if isinstance(state, tuple) and len(state) > 2 else None
+        attrs = _state_attrs(state)
+        if attrs:
+            attrs = {k: v for k, v in attrs.items() if isinstance(k, str) and not k.startswith('_')}
+            if attrs:
+                return source, attrs
+    return None
+
+def guarded_str(obj):
+    """
+    str(obj) under REPR_TIME_LIMIT_SEC, cut to MAX_STR_LEN. Types whose str()
+    timed out or exceeded REPR_MAX_LEN are remembered and not called again.
+    Returns (text, truncated length) or (None, why it was skipped).
+    """
+    cls = type(obj)
+    if cls in _slow_repr_types:
+        return None, _slow_repr_types[cls]
+    try:
+        text = call_guarded(lambda: str(obj))
+    except ReprTimeout:
+        _slow_repr_types[cls] = 'slow'
+        return None, 'slow'
+    except Exception as e:
+        return f"<str() failed: {type(e).__name__}: {e}>", None
+    if len(text) > REPR_MAX_LEN:
+        _slow_repr_types[cls] = 'large'
+    if len(text) > MAX_STR_LEN:
+        return text[:MAX_STR_LEN], len(text)
+    return text, None
+
+# ============ Images ============
+
+def image_html(render, fmt, key=None):
+    """
+    Returns an <img> tag for the encoded image bytes `render()` produces.
+    With IMAGE_DIR set the bytes are written to `<key>.<fmt>` there and loaded
+    by URI, and an existing file with that key is reused without rendering.
+    Otherwise (or without a key) the image is inlined as base64.
+    """
+    if IMAGE_DIR and key:
+        name = f"{key}.{fmt}"
+        path = os.path.join(IMAGE_DIR, name)
+        if not os.path.exists(path):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(render())
+            os.replace(tmp_path, path)
+        return f'<img src="{IMAGE_URI}/{name}">'
+    img_base64 = base64.b64encode(render()).decode('utf-8')
+    return f'<img src="data:image/{fmt};base64,{img_base64}">'
+
+def render_figure(fig, fmt):
+    """Rasterizes a figure at FIGURE_DPI, scaled down to fit THUMBNAIL_SIZE"""
+    dpi = min(FIGURE_DPI, THUMBNAIL_SIZE / max(max(fig.get_size_inches()), 1e-3))
+    buf = BytesIO()
+    fig.savefig(buf, format=fmt, dpi=dpi)
+    return buf.getvalue()
+
+def _figure_key(data):
+    """Content hash of a pickled figure and the render settings (None without IMAGE_DIR)"""
+    if not IMAGE_DIR or data is None:
+        return None
+    digest = hashlib.sha1(data)
+    digest.update(f"{FIGURE_DPI}:{THUMBNAIL_SIZE}".encode())
+    return f"fig-{digest.hexdigest()[:20]}"
+
+def _image_cached(key, fmt):
+    return key is not None and os.path.exists(os.path.join(IMAGE_DIR, f"{key}.{fmt}"))
+
+def _init_figure_worker(config):
+    global IMAGE_DIR, IMAGE_URI, FIGURE_DPI, THUMBNAIL_SIZE
+    IMAGE_DIR, IMAGE_URI, FIGURE_DPI, THUMBNAIL_SIZE = config
+
+def _render_pickled_figure(data, fmt, key):
+    """Worker side of FigureRenderer: unpickles one figure and rasterizes it"""
+    fig = pickle.loads(data)
+    try:
+        return image_html(lambda: render_figure(fig, fmt), fmt, key)
+    finally:
+        plt.close(fig)
+
+# ----- Image-shaped arrays -----
+
+MIN_IMAGE_SIDE = 8     # Smaller arrays are tables, not images
+MAX_IMAGE_ASPECT = 16  # Longer strips are tables too
+MIN_MATRIX_IMAGE_SIDE = 64  # 2-D arrays without an image dtype must be at least this large...
+MAX_MATRIX_IMAGE_ASPECT = 4  # ...and roughly square to be shown as grayscale images
+
+def image_layout(arr):
+    """
+    Returns (batch, height, width, channels) if `arr` looks like an image:
+    H×W, H×W×C or N×H×W×C with C in 1/3/4 and a numeric dtype. batch is None
+    for a single image. Plain H×W matrices also need a uint8/bool dtype or a
+    large, roughly square shape, so feature matrices keep their numeric
+    summary. Only the shape and dtype are looked at. Returns None otherwise.
+    """
+    if arr.dtype.kind not in 'biuf':
+        return None
+    shape = arr.shape
+    if arr.ndim == 2:
+        short, long = min(shape), max(shape)
+        if arr.dtype not in (np.uint8, np.bool_) and (
+                short < MIN_MATRIX_IMAGE_SIDE or long > MAX_MATRIX_IMAGE_ASPECT * short):
+            return None
+        batch, (height, width), channels = None, shape, 1
+    elif arr.ndim == 3 and shape[2] in (1, 3, 4):
+        batch, (height, width, channels) = None, shape
+    elif arr.ndim == 4 and shape[3] in (1, 3, 4) and shape[0] > 0:
+        batch, height, width, channels = shape
+    else:
+        return None
+    if min(height, width) < MIN_IMAGE_SIDE or max(height, width) > MAX_IMAGE_ASPECT * min(height, width):
+        return None
+    return batch, height, width, channels
+
+def _downsample(arr, size):
+    """Strided slicing down to `size` px on the long side; on a memmap this only reads those rows"""
+    height, width = arr.shape[1:3] if arr.ndim == 4 else arr.shape[:2]
+    step = -(-max(height, width) // size)
+    if arr.ndim == 4:
+        return np.asarray(arr[:, ::step, ::step])
+    return np.asarray(arr[::step, ::step])
+
+def _to_pixels(img):
+    """
+    Scales image data to uint8. uint8 and bool are taken as they are, floats in
+    [0, 1] and ints in [0, 255] keep their range, anything else is min-max
+    normalized. NaN and inf become black.
+    """
+    if img.dtype == np.uint8:
+        return img
+    if img.dtype == np.bool_:
+        return img.astype(np.uint8) * 255
+    data = img.astype(np.float32)
+    finite = np.isfinite(data)
+    if not finite.any():
+        return np.zeros(img.shape, dtype=np.uint8)
+    lo, hi = float(data[finite].min()), float(data[finite].max())
+    if img.dtype.kind == 'f' and lo >= 0 and hi <= 1:
+        lo, hi = 0.0, 1.0
+    elif img.dtype.kind in 'iu' and lo >= 0 and hi <= 255:
+        lo, hi = 0.0, 255.0
+    scale = 255.0 / (hi - lo) if hi > lo else 0.0
+    data = (data - lo) * scale
+    data[~finite] = 0
+    return np.clip(data, 0, 255).astype(np.uint8)
+
+def _contact_sheet(tiles, gap=2):
+    """Lays out (k, h, w, c) tiles on a grid with `gap` px between them"""
+    count, height, width, channels = tiles.shape
+    cols = int(np.ceil(np.sqrt(count)))
+    rows = -(-count // cols)
+    tiles = np.pad(tiles, ((0, rows * cols - count), (0, gap), (0, gap), (0, 0)))
+    sheet = tiles.reshape(rows, cols, height + gap, width + gap, channels)
+    sheet = sheet.transpose(0, 2, 1, 3, 4).reshape(rows * (height + gap), cols * (width + gap), channels)
+    return sheet[:-gap, :-gap]
+
+def encode_png(pixels):
+    """Encodes a uint8 H×W or H×W×C (C in 1/3/4) array as PNG"""
+    if pixels.ndim == 3 and pixels.shape[2] == 1:
+        pixels = pixels[:, :, 0]
+    height, width = pixels.shape[:2]
+    channels = 1 if pixels.ndim == 2 else pixels.shape[2]
+    color_type = {1: 0, 3: 2, 4: 6}[channels]
+    # Every scanline starts with filter type 0 (None)
+    raw = np.zeros((height, 1 + width * channels), dtype=np.uint8)
+    raw[:, 1:] = pixels.reshape(height, -1)
+
+    def chunk(tag, data):
+        return (struct.pack('>I', len(data)) + tag + data
+                + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header)
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6)) + chunk(b'IEND', b''))
+
+def array_thumbnail(arr):
+    """Returns an <img> of an image-shaped array (a contact sheet for batches), or None"""
+    layout = image_layout(arr)
+    if layout is None:
+        return None
+    batch = layout[0]
+    if batch is None:
+        pixels = _to_pixels(_downsample(arr, THUMBNAIL_SIZE))
+    else:
+        count = min(batch, CONTACT_SHEET_SIZE)
+        tile_size = max(THUMBNAIL_SIZE // int(np.ceil(np.sqrt(count))), MIN_IMAGE_SIDE)
+        pixels = _contact_sheet(_to_pixels(_downsample(arr[:count], tile_size)))
+    pixels = np.ascontiguousarray(pixels)
+    key = None
+    if IMAGE_DIR:
+        key = f"array-{hashlib.sha1(pixels.tobytes() + str(pixels.shape).encode()).hexdigest()[:20]}"
+    return image_html(lambda: encode_png(pixels), 'png', key)
+
+class FigureRenderer:
+    """
+    Rasterizes matplotlib figures, in a process pool when a file holds several.
+    The first figure (and any already on disk) is rendered in place, so a single
+    plot doesn't pay for the pool start-up. In json mode later figures are sent
+    pickled to the workers and return a placeholder; `flush()` emits a
+    {"fill": id, "h": html} node for each finished one and the webview swaps it in.
+    Figures the formatter never reaches (past MAX_ITEMS or MAX_DEPTH) are never
+    submitted. In html mode everything is rendered in place.
+    """
+    MAX_WORKERS = 4
+
+    def __init__(self):
+        self._pool = None
+        self._pending = {}  # placeholder id -> Future
+        self._count = 0
+        self._flushing = False
+
+    def render(self, fig):
+        """Returns the HTML of a figure: the image, or a placeholder filled in later"""
+        fmt = 'png' if IMAGE_DIR else 'jpeg'
+        self._count += 1
+        try:
+            data = pickle.dumps(fig)
+        except Exception:
+            data = None
+        key = _figure_key(data)
+        if OUTPUT_MODE != 'json' or self._count == 1 or data is None or _image_cached(key, fmt):
+            return image_html(lambda: render_figure(fig, fmt), fmt, key)
+        fill_id = f"pending-figure-{self._count}"
+        self._pending[fill_id] = self._executor().submit(_render_pickled_figure, data, fmt, key)
+        return f'<span class="pending-figure" id="{fill_id}"><i>rendering figure...</i></span>'
+
+    def _executor(self):
+        if self._pool is None:
+            # Workers fork with matplotlib (Agg) already imported where possible
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+            self._pool = ProcessPoolExecutor(
+                max_workers=min(self.MAX_WORKERS, os.cpu_count() or 1),
+                mp_context=context,
+                initializer=_init_figure_worker,
+                initargs=((IMAGE_DIR, IMAGE_URI, FIGURE_DPI, THUMBNAIL_SIZE),))
+        return self._pool
+
+    def flush(self, wait=False):
+        """Emits the fills of finished figures; with `wait`, of all submitted ones"""
+        if self._flushing:
+            return
+        self._flushing = True
+        try:
+            for fill_id, future in list(self._pending.items()):
+                if not (wait or future.done()):
+                    continue
+                if limit_reached() and not future.done():
+                    future.cancel()
+                    html = f"<i>(figure not rendered: {_guard.tripped} limit reached)</i>"
+                else:
+                    try:
+                        html = future.result()
+                    except Exception as e:
+                        html = f"&lt;Plot Error: {e}&gt;"
+                del self._pending[fill_id]
+                emit({"fill": fill_id, "h": html})
+        finally:
+            self._flushing = False
+
+    def close(self):
+        """Waits for the pending figures, emits their fills and stops the pool"""
+        self.flush(wait=True)
+        if self._pool is not None:
+            if sys.version_info >= (3, 9):
+                self._pool.shutdown(cancel_futures=True)
+            else:
+                self._pool.shutdown()  # Nothing is pending after the flush above
+            self._pool = None
+        self._count = 0
+
+_figures = FigureRenderer()
+
 # ============ Core Formatter ============
 
+class Html(str):
+    """Preformatted HTML that a block embeds as-is instead of formatting it"""
+
+def emit(line):
+    """Prints one output line: HTML, or a node in json mode (HTML becomes a leaf node)"""
+    if isinstance(line, dict):
+        print(json.dumps(line, ensure_ascii=False))
+    elif OUTPUT_MODE == 'json':
+        print(json.dumps({"h": line}, ensure_ascii=False))
+    else:
+        print(line)
+    # Fill in figures that finished rendering in the meantime
+    _figures.flush()
+
 class JetBrainsFormatter:
     def __init__(self):
         self.seen_ids = set()
+        self.read_payload = True  # False: lazily read formats show headers only
 
     def _render_plot_to_html(self, fig):
-        """Renders a matplotlib figure to base64 HTML"""
+        """Renders a matplotlib figure to an image file, or to base64 HTML without IMAGE_DIR"""
         try:
-            buf = BytesIO()
-            fig.savefig(buf, format='jpeg')
-            buf.seek(0)
-            img_base64 = base64.b64encode(buf.read()).decode('utf-8')
+            img = _figures.render(fig)
             plt.close(fig)
-            return f'<br><img src="data:image/jpeg;base64,{img_base64}"><br>'
+            return f'<br>{img}<br>'
         except Exception as e:
             return f"&lt;Plot Error: {e}&gt;"
 
@@ -91,7 +1367,9 @@ class JetBrainsFormatter:
         if HAS_MPL and isinstance(obj, plt.Figure):
             return self._render_plot_to_html(obj)
 
-        # 2. Check Recursion Depth & Circular References
+        # 2. Check Resource Limits, Recursion Depth & Circular References
+        if limit_reached():
+            return f"<i>... (preview stopped: {_guard.tripped} limit reached)</i>"
         if level > MAX_DEPTH:
             return "<i>... (max depth exceeded)</i>"
         
@@ -111,8 +1389,68 @@ class JetBrainsFormatter:
             if is_container:
                 self.seen_ids.remove(obj_id)
         
+        if OUTPUT_MODE == 'json' and isinstance(res, str):
+            return self._leaf_node(res)
         return res
 
+    # --- Output structure ---
+    # Containers are rendered as blocks: a header plus (label, value) entries.
+    # In html mode a block becomes `header {<br>entries<br>}`; in json mode it
+    # becomes a node {"h": header, "c": [children]} for the webview tree.
+
+    def _leaf_node(self, html):
+        """Turns formatted HTML into a node; extra lines become its children"""
+        parts = [part for part in re.split(r'<br>|\n', html) if part]
+        if len(parts) <= 1:
+            return {"h": parts[0] if parts else html}
+        children = [{"h": re.sub(r'^(&nbsp;)+', '', part)} for part in parts[1:]]
+        return {"h": parts[0], "c": children}
+
+    def _join(self, prefix, formatted):
+        """Prepends inline HTML to a formatted value of either mode"""
+        if isinstance(formatted, dict):
+            return dict(formatted, h=prefix + formatted["h"])
+        return prefix + formatted
+
+    def _iter_block(self, header, entries, level):
+        """
+        Yields a block: the header line, one line per entry, then the closing brace
+        (html), or the header node followed by one node per entry (json).
+        `entries` yields (label, value); values are formatted one level deeper
+        unless they are Html, and a None label marks a note without a key.
+        """
+        json_mode = OUTPUT_MODE == 'json'
+        child_indent = self._get_indent(level + 1)
+        yield {"h": header} if json_mode else header + " {"
+        for label, value in entries:
+            formatted = value if isinstance(value, Html) else self.format(value, level + 1)
+            if json_mode:
+                node = formatted if isinstance(formatted, dict) else self._leaf_node(formatted)
+                if label is not None:
+                    node["k"] = label
+                yield node
+            elif label is None:
+                yield f"{child_indent}{formatted}"
+            else:
+                yield f"{child_indent}{label}: {formatted}"
+        if not json_mode:
+            yield f"{self._get_indent(level)}}}"
+
+    def _block(self, header, entries, level):
+        lines = self._iter_block(header, entries, level)
+        if OUTPUT_MODE == 'json':
+            node = next(lines)
+            node["c"] = list(lines)
+            return node
+        return "<br>".join(lines)
+
+    def _indices_to_show(self, length):
+        """Head and tail indices under MAX_ITEMS, with -1 marking the gap"""
+        if length <= MAX_ITEMS:
+            return range(length)
+        half = MAX_ITEMS // 2
+        return list(range(half)) + [-1] + list(range(length - half, length))
+
     def _dispatch_format(self, obj, level):
         indent = self._get_indent(level)
         
@@ -135,8 +1473,8 @@ class JetBrainsFormatter:
                 return f"<i>(len={len(obj)})</i><span style='color:#6a8759'>'{safe_str}'</span>"
 
         # --- Bytes ---
-        if isinstance(obj, bytes):
-            return f"<b>bytes</b> <i>(len={len(obj)})</i>"
+        if isinstance(obj, (bytes, bytearray)):
+            return self._format_bytes_like(obj)
 
         # --- NumPy Arrays ---
         if np and isinstance(obj, np.ndarray):
@@ -144,8 +1482,52 @@ class JetBrainsFormatter:
 
         # --- PyTorch Tensors ---
         if torch and isinstance(obj, torch.Tensor):
+            if obj.layout != torch.strided:
+                return self._format_torch_sparse(obj, level)
             return self._format_torch(obj, level)
 
+        # --- Full nn.Module pickles: the module tree of their parameters ---
+        if torch and isinstance(obj, torch.nn.Module):
+            return self._format_module(obj, level)
+
+        # --- Sparse matrices (scipy) ---
+        if scipy_sparse_format(obj) is not None:
+            return self._format_scipy_sparse(obj, level)
+
+        # --- DataFrames / Series (pandas, polars) ---
+        library = dataframe_library(obj)
+        if library == 'pandas':
+            return self._format_pandas(obj, level)
+        if library == 'polars':
+            return self._format_polars(obj, level)
+
+        # --- safetensors entries ---
+        if isinstance(obj, SafeTensor):
+            return self._format_safetensor(obj, level)
+
+        # --- HDF5 groups / datasets (h5py) ---
+        h5_kind = h5py_object_kind(obj)
+        if h5_kind == 'group':
+            return self._format_h5_group(obj, level)
+        if h5_kind == 'dataset':
+            return self._format_h5_dataset(obj, level)
+
+        # --- Samples of tar shards ---
+        if isinstance(obj, TarSample):
+            return self._format_tar_sample(obj, level)
+
+        # --- Tensors of sharded checkpoints ---
+        if isinstance(obj, ShardTensor):
+            return self._format_shard_tensor(obj)
+
+        # --- Levels of module trees (state_dicts, nn.Module) ---
+        if isinstance(obj, (ModuleNode, ModuleRepeat)):
+            return self._format_module_tree(obj, level)
+
+        # --- Runs of same-shaped objects ---
+        if isinstance(obj, FoldedRun):
+            return self._format_folded_run(obj, level)
+
         # --- Dictionaries ---
         if isinstance(obj, dict):
             return self._format_dict(obj, level)
@@ -154,23 +1536,40 @@ class JetBrainsFormatter:
         if isinstance(obj, (list, tuple, set)):
             return self._format_sequence(obj, level)
 
+        # --- Buffer protocol / __array_interface__ (memoryview, array.array, PIL images) ---
+        if is_buffer_like(obj) or not hasattr(obj, '__dict__'):
+            arr = buffer_view(obj)
+            if arr is not None:
+                return self._format_buffer(obj, arr, level)
+
         # --- Generic Objects (Classes) ---
         if hasattr(obj, '__dict__'):
             return self._format_object(obj, level)
 
-        # --- Fallback ---
-        return str(obj)
+        # --- Fallback: structure from __slots__ / pickle state, else a guarded str() ---
+        return self._format_fallback(obj, level)
+
+    def _format_array_header(self, shape, dtype):
+        shape_str = str(tuple(shape)).replace(" ", "")
+        dtype = str(dtype).replace('<', '&lt;').replace('>', '&gt;')
+        return self._format_header("ndarray", f"(shape={shape_str}, dtype={dtype})")
+
+    def _format_numpy(self, arr, level, header=None):
+        if header is None:
+            header = self._format_array_header(arr.shape, arr.dtype)
 
-    def _format_numpy(self, arr, level):
-        shape_str = str(arr.shape).replace(" ", "")
-        header = self._format_header("ndarray", f"(shape={shape_str}, dtype={arr.dtype})")
-        
         if arr.size == 0:
             return header + " []"
         
         if arr.size == 1:
             # Use recursive format for the single item
-            return header + f" {self.format(arr.item(), level + 1)}"
+            return self._join(header + " ", self.format(arr.item(), level + 1))
+
+        # Per-field stats of structured arrays, sampled elements of object arrays
+        if arr.dtype.names:
+            return self._block(header, self._field_entries(arr), level)
+        if arr.dtype.hasobject:
+            return self._block(header, self._object_array_entries(arr), level)
 
         # If small 1D/2D, print full content
         if (arr.size < 20 and arr.ndim <= 2) or MAX_ITEMS > 1000:
@@ -178,10 +1577,115 @@ class JetBrainsFormatter:
             return f"{header}<br>{self._get_indent(level+1)}{content}"
 
         # Otherwise, show preview
+        stats = self._array_summary(arr)
+        summary = f"{header} {stats}" if stats else header
         try:
-            return f"{header} min: {np.min(arr):.4g}, max: {np.max(arr):.4g}, mean: {np.mean(arr):.4g}"
+            thumbnail = array_thumbnail(arr)
         except Exception as e:
-            return f"{header}"
+            thumbnail = f"&lt;Thumbnail Error: {e}&gt;"
+        if thumbnail is None:
+            return summary
+        return f"{summary}<br>{self._get_indent(level+1)}{thumbnail}"
+
+    def _format_bytes_like(self, obj, data=None):
+        """Length, leading bytes and (for longer data) byte-value stats of its uint8 view"""
+        data = obj if data is None else data
+        header = (f"{self._format_header(type(obj).__name__, f'(len={len(data)})')} "
+                  f"<span style='color:#6a8759'>{bytes_preview(data)}</span>")
+        if len(data) <= BYTES_PREVIEW_LEN:
+            return header
+        stats = self._array_summary(np.frombuffer(data, dtype=np.uint8))
+        return f"{header} {stats}" if stats else header
+
+    def _format_buffer(self, obj, arr, level):
+        """Array-likes shown through their zero-copy ndarray view, under their own type name"""
+        # Plain byte buffers (memoryview of bytes, Arrow buffers, mmap) read as bytes
+        raw = isinstance(obj, memoryview) or not is_buffer_like(obj)
+        if raw and arr.ndim == 1 and arr.dtype.itemsize == 1 and arr.dtype.kind in 'iu' and arr.flags.c_contiguous:
+            return self._format_bytes_like(obj, memoryview(obj).cast('B'))
+        shape_str = str(tuple(arr.shape)).replace(" ", "")
+        dtype = str(arr.dtype).replace('<', '&lt;').replace('>', '&gt;')
+        header = self._format_header(type(obj).__name__, f"(shape={shape_str}, dtype={dtype})")
+        return self._format_numpy(arr, level, header)
+
+    def _array_summary(self, arr):
+        """One-line stats of an array's values ('' when they can't be summarized)"""
+        if arr.size == 0:
+            return ''
+        if arr.dtype.hasobject:
+            return object_types_summary(arr.reshape(-1))
+        try:
+            sample, sampled = _stats_sample(arr)
+            note = " <i>(sampled)</i>" if sampled else ""
+            return f"{dtype_summary(sample.reshape(-1))}{note}"
+        except Exception:
+            return ''
+
+    def _field_entries(self, arr):
+        """Stats of each field of a structured array, computed on its (zero-copy) field view"""
+        names = arr.dtype.names
+        for i in self._indices_to_show(len(names)):
+            if limit_reached():
+                return
+            if i == -1:
+                yield None, Html(f"<i>... ({len(names) - MAX_ITEMS} more fields) ...</i>")
+                continue
+            field = arr[names[i]]
+            if field.dtype.names:
+                yield f"<b>{names[i]}</b>", field  # Nested record: its own per-field block
+                continue
+            stats = self._array_summary(field)
+            dtype = str(arr.dtype[names[i]]).replace('<', '&lt;').replace('>', '&gt;')
+            yield f"<b>{names[i]}</b>", Html(f"<i>{dtype}</i>" + (f" {stats}" if stats else ""))
+
+    def _object_array_entries(self, arr):
+        """Type frequencies of a bounded sample, then the head and tail elements formatted"""
+        flat = arr.reshape(-1)
+        yield "<b>types</b>", Html(object_types_summary(flat))
+        for i in self._indices_to_show(flat.size):
+            if limit_reached():
+                return
+            if i == -1:
+                yield None, Html(f"<i>... ({flat.size - MAX_ITEMS} more items) ...</i>")
+                continue
+            index = ','.join(str(j) for j in np.unravel_index(i, arr.shape))
+            yield f"<b>[{index}]</b>", flat[i]
+
+    def format_pickle_scan(self, scan):
+        """Formats the counters collected by an opcode scan"""
+        protocol = scan['protocol'] if scan['protocol'] is not None else '<2'
+        total = scan['total_size']
+        progress = f"{scan['position'] / total:.0%} of {_format_bytes(total)}" if total else "0 B"
+        status = "complete" if scan['complete'] else "stopped early"
+        header = self._format_header(
+            "pickle scan",
+            f"(protocol={protocol}, objects={scan['objects']}, opcodes={sum(scan['ops'].values())}, "
+            f"scanned {progress}, {status})"
+        )
+        return self._block(header, self._scan_entries(scan), 0)
+
+    def _scan_entries(self, scan):
+        counts = []
+        for label, names in _OP_GROUPS:
+            count = sum(scan['ops'][name] for name in names)
+            if count:
+                counts.append(f"{label} ×{count}")
+        if counts:
+            yield "<b>values</b>", Html(', '.join(counts))
+
+        if scan['classes']:
+            classes = [f"{name} ×{count}" for name, count in scan['classes'].most_common(MAX_ITEMS)]
+            more = len(scan['classes']) - MAX_ITEMS
+            if more > 0:
+                classes.append(f"<i>... ({more} more)</i>")
+            yield "<b>classes</b>", Html(', '.join(classes))
+
+        if scan['payload_bytes']:
+            yield "<b>payloads</b>", Html(f"{_format_bytes(scan['payload_bytes'])} "
+                                          f"<i>(largest {_format_bytes(scan['largest_payload'])})</i>")
+        if scan['frames']:
+            yield "<b>frames</b>", Html(f"{scan['frames']} "
+                                        f"<i>(largest {_format_bytes(scan['largest_frame'])})</i>")
 
     def _format_torch(self, tensor, level):
         shape_str = str(tuple(tensor.shape)).replace(" ", "")
@@ -194,106 +1698,1699 @@ class JetBrainsFormatter:
             
         return f"{header}"
 
+    def _format_scipy_sparse(self, mat, level):
+        """Format, shape, nnz and density, with stats of the stored values only"""
+        shape_str = str(mat.shape).replace(" ", "")
+        header = self._format_header(type(mat).__name__, (
+            f"(shape={shape_str}, dtype={mat.dtype}, nnz={mat.nnz}, density={sparse_density(mat.nnz, mat.shape)})"))
+        return self._block(header, self._scipy_sparse_entries(mat, level), level)
+
+    def _scipy_sparse_entries(self, mat, level):
+        fmt = mat.format
+        if fmt not in ('csr', 'csc', 'coo'):
+            mat = mat.tocoo()  # A copy of the stored entries only
+        values = mat.data
+        yield "<b>values</b>", Html(self._sparse_values_summary(values))
+        if len(mat.shape) != 2:
+            return
+        if fmt == 'csr':
+            row_counts = np.diff(mat.indptr)
+            col_counts = np.bincount(mat.indices, minlength=mat.shape[1])
+            window = compressed_window(mat.indptr, mat.indices, values, mat.shape, by_row=True)
+        elif fmt == 'csc':
+            row_counts = np.bincount(mat.indices, minlength=mat.shape[0])
+            col_counts = np.diff(mat.indptr)
+            window = compressed_window(mat.indptr, mat.indices, values, mat.shape, by_row=False)
+        else:
+            row_counts = np.bincount(mat.row, minlength=mat.shape[0])
+            col_counts = np.bincount(mat.col, minlength=mat.shape[1])
+            window = sparse_window(mat.row, mat.col, values, mat.shape)
+        yield "<b>nnz per row</b>", nnz_distribution(row_counts)
+        yield "<b>nnz per column</b>", nnz_distribution(col_counts)
+        yield "<b>top-left</b>", self._sparse_window_html(window, level)
+
+    def _format_torch_sparse(self, tensor, level):
+        """Sparse layouts of _format_torch: nnz, density and the stored values, never densified"""
+        shape = tuple(tensor.shape)
+        layout = str(tensor.layout).replace("torch.", "")
+        if tensor.layout == torch.sparse_coo:
+            tensor = tensor.coalesce()
+            nnz = tensor._nnz()
+        else:
+            nnz = tensor.values().numel()
+        header = self._format_header("tensor", (
+            f"(shape={str(shape).replace(' ', '')}, dtype={str(tensor.dtype).replace('torch.', '')}, "
+            f"layout={layout}, nnz={nnz}, density={sparse_density(nnz, shape)})"))
+        return self._block(header, self._torch_sparse_entries(tensor, level), level)
+
+    def _torch_sparse_entries(self, tensor, level):
+        values = tensor.values()
+        yield "<b>values</b>", Html(torch_tensor_stats(values))
+        if tensor.dim() != 2 or values.dim() != 1:
+            return  # Hybrid and block layouts: values only
+        shape = tuple(tensor.shape)
+        values = values.detach()
+        if values.dtype in (torch.float16, torch.bfloat16):
+            values = values.to(torch.float32)
+        values = values.numpy()
+        if tensor.layout == torch.sparse_coo:
+            rows, cols = tensor.indices().numpy()
+            row_counts = np.bincount(rows, minlength=shape[0])
+            col_counts = np.bincount(cols, minlength=shape[1])
+            window = sparse_window(rows, cols, values, shape)
+        elif tensor.layout == torch.sparse_csr:
+            indptr, indices = tensor.crow_indices().numpy(), tensor.col_indices().numpy()
+            row_counts = np.diff(indptr)
+            col_counts = np.bincount(indices, minlength=shape[1])
+            window = compressed_window(indptr, indices, values, shape, by_row=True)
+        elif tensor.layout == torch.sparse_csc:
+            indptr, indices = tensor.ccol_indices().numpy(), tensor.row_indices().numpy()
+            row_counts = np.bincount(indices, minlength=shape[0])
+            col_counts = np.diff(indptr)
+            window = compressed_window(indptr, indices, values, shape, by_row=False)
+        else:
+            return
+        yield "<b>nnz per row</b>", nnz_distribution(row_counts)
+        yield "<b>nnz per column</b>", nnz_distribution(col_counts)
+        yield "<b>top-left</b>", self._sparse_window_html(window, level)
+
+    def _sparse_values_summary(self, values):
+        if values.size == 0:
+            return "<i>(no stored values)</i>"
+        try:
+            sample, sampled = _stats_sample(values)
+            note = " <i>(sampled)</i>" if sampled else ""
+            return f"{summarize_values(sample)}{note}"
+        except Exception as e:
+            return f"&lt;stats error: {e}&gt;"
+
+    def _sparse_window_html(self, window, level):
+        rows, cols = window.shape
+        indent = self._get_indent(level + 2)
+        return Html(f"<i>({rows}×{cols})</i><br>{indent}" + str(window).replace('\n', f'<br>{indent}'))
+
+    def _format_safetensor(self, tensor, level):
+        """Same header as _format_torch, followed by stats of a sample of its bytes"""
+        shape_str = str(tensor.shape).replace(" ", "")
+        header = self._format_header("tensor", (
+            f"(shape={shape_str}, dtype={safetensors_dtype_name(tensor.dtype)}, "
+            f"bytes={tensor.offsets[0]}..{tensor.offsets[1]})"))
+        stats = safetensor_stats(tensor) if self.read_payload else ''
+        return f"{header} {stats}" if stats else header
+
+    def _format_tar_sample(self, sample, level):
+        nbytes = sum(size for _, _, _, size in sample.members)
+        header = self._format_header("sample", f"(members={len(sample.members)}, bytes={_format_bytes(nbytes)})")
+        return self._block(header, self._tar_sample_entries(sample), level)
+
+    def _tar_sample_entries(self, sample):
+        for extension, name, offset, size in sample.members:
+            label = f"<b>'{extension}'</b>"
+            if not sample.load:
+                yield label, Html(f"<i>{_format_bytes(size)}</i> "
+                                  + expander_html(expand_token(kind='tar-member', name=name), 'preview'))
+                continue
+            try:
+                yield label, load_tar_member(sample.tar_path, name, offset, size)
+            except Exception as e:
+                yield label, Html(f"<span style='color:red'>&lt;load error: {e}&gt;</span>")
+
+    def _format_shard_tensor(self, tensor):
+        """Header of a tensor of a sharded checkpoint, its shard, and a link to its stats"""
+        shape_str = str(tensor.shape).replace(" ", "")
+        line = self._format_header("tensor", f"(shape={shape_str}, dtype={tensor.dtype})")
+        line += f" <span style='color:#888'>{tensor.shard}</span> "
+        return line + expander_html(expand_token(kind='tensor', shard=tensor.shard, name=tensor.name))
+
+    def format_lines(self, obj, level=0):
+        """
+        Like format(), but yields a top-level dict/list/tuple/set one entry at a time,
+        so callers can print (and stream) it before the rest is formatted.
+        In json mode the entries after the header node are marked as its children.
+        """
+        block = None
+        if not limit_reached() and level <= MAX_DEPTH:
+            if isinstance(obj, dict):
+                block = self._dict_block(obj)
+            elif isinstance(obj, (list, tuple, set)):
+                block = self._sequence_block(obj)
+        if block is None or block[1] is None:
+            yield self.format(obj, level)
+            return
+
+        self.seen_ids.add(id(obj))
+        try:
+            yield from self.stream_block(*block, level)
+        finally:
+            self.seen_ids.discard(id(obj))
+
+    def stream_block(self, header, entries, level=0):
+        """Yields a block for printing line by line; json children point at their header"""
+        for i, line in enumerate(self._iter_block(header, entries, level)):
+            if i and OUTPUT_MODE == 'json':
+                line["child"] = True
+            yield line
+
     def _format_sequence(self, seq, level):
-        # Lists, Tuples, Sets
+        header, entries = self._sequence_block(seq)
+        if entries is None:
+            return header + " []"
+        return self._block(header, entries, level)
+
+    def _sequence_block(self, seq):
+        """Returns (header, entries) for lists, tuples and sets; entries is None when empty"""
         type_name = type(seq).__name__
         length = len(seq)
         header = self._format_header(type_name, f"(len={length})")
         
         if length == 0:
-            return header + " []"
+            return header, None
+
+        if length > MAX_ITEMS and isinstance(seq, (list, tuple)) and np is not None:
+            header += self._numeric_summary(seq)
+
+        if length >= TABLE_MIN_ROWS and isinstance(seq, (list, tuple)):
+            schema = infer_schema(seq)
+            if schema is not None:
+                header += f" <i>table of {len(schema.columns)} columns</i>"
+                return header, self._record_entries(seq, schema)
 
-        indent = self._get_indent(level)
-        child_indent = self._get_indent(level + 1)
-        
         # Convert set to list for indexing
         items = list(seq) if isinstance(seq, set) else seq
-        
-        result = [header, " {"]
-        
-        # Determine how many items to show
-        indices_to_show = []
-        if length <= MAX_ITEMS:
-            indices_to_show = range(length)
-        else:
-            # Show first few and last few
-            half = MAX_ITEMS // 2
-            indices_to_show = list(range(half)) + [-1] + list(range(length - half, length))
+        runs = structure_runs(items)
+        if runs is not None:
+            return header, self._folded_entries(items, runs)
+        return header, self._sequence_entries(items, length)
+
+    def _numeric_summary(self, seq):
+        """Stats of a list of numbers, appended to its header (empty otherwise)"""
+        try:
+            result = numeric_list_sample(seq)
+            if result is None:
+                return ""
+            values, sampled = result
+            note = " <i>(sampled)</i>" if sampled else ""
+            return f" {values.dtype} {summarize_values(values)}{note}"
+        except Exception:
+            return ""
 
-        for i in indices_to_show:
+    def _record_entries(self, rows, schema):
+        """Head and tail rows as one table, then one stats entry per column"""
+        length = len(rows)
+        table_rows = [None if i == -1 else
+                      (f"[{i}]", [cell_html(record_value(schema, rows[i], column)) for column in schema.columns])
+                      for i in table_indices(length)]
+        yield None, Html(html_table(schema.columns, table_rows, length))
+
+        # Column stats over at most STATS_SAMPLE_SIZE cells
+        step = max(-(-length * len(schema.columns) // STATS_SAMPLE_SIZE), 1)
+        sample = rows[::step]
+        if step > 1:
+            yield None, Html(f"<i>(column stats sampled from {len(sample)} of {length} rows)</i>")
+        for column in schema.columns:
+            if limit_reached():
+                return
+            label = f"'{column}'" if schema.kind == 'dict' else column
+            values = [record_value(schema, row, column) for row in sample]
+            yield f"<b>{label}</b>", Html(column_summary(values))
+
+    def _folded_entries(self, items, runs):
+        """Like _sequence_entries, but runs of FOLD_MIN_RUN same-shaped objects take one entry"""
+        units = []
+        for start, stop in runs:
+            if stop - start >= FOLD_MIN_RUN and structure_signature(items[start]) is not None:
+                units.append((start, stop))
+            else:
+                units.extend((i, None) for i in range(start, stop))
+        for i in self._indices_to_show(len(units)):
             if i == -1:
-                result.append(f"<br>{child_indent}<i>... ({length - MAX_ITEMS} more items) ...</i>")
+                yield None, Html(f"<i>... ({len(units) - MAX_ITEMS} more entries) ...</i>")
                 continue
-                
-            val = items[i]
-            formatted_val = self.format(val, level + 1)
-            result.append(f"<br>{child_indent}[{i}]: {formatted_val}")
-            
-        result.append(f"<br>{indent}}}")
-        return "".join(result)
+            start, stop = units[i]
+            if stop is None:
+                yield f"[{start}]", items[start]
+            else:
+                yield f"[{start}:{stop}]", FoldedRun(items, start, stop)
+
+    def _format_folded_run(self, run, level):
+        example = run.items[run.start]
+        _, names, _ = structure_signature(example)
+        count = run.stop - run.start
+        header = self._format_header(type(example).__name__, f"(attrs={len(names)})") + f" × {count}"
+        return self._block(header, self._folded_run_entries(run, names), level)
+
+    def _folded_run_entries(self, run, names):
+        """One full example, then the value range of each attribute over the run"""
+        yield "<i>example</i>", run.items[run.start]
+        count = run.stop - run.start
+        step = max(-(-count * max(len(names), 1) // STATS_SAMPLE_SIZE), 1)
+        sample = run.items[run.start:run.stop:step]
+        if step > 1:
+            yield None, Html(f"<i>(ranges sampled from {len(sample)} of {count} objects)</i>")
+        for name in names[:MAX_ITEMS]:
+            if limit_reached():
+                return
+            yield f"<b>{name}</b>", Html(column_summary([getattr(obj, name) for obj in sample]))
+        if len(names) > MAX_ITEMS:
+            yield None, Html(f"<i>... ({len(names) - MAX_ITEMS} more attributes)</i>")
+
+    def _format_pandas(self, obj, level):
+        import pandas as pd
+        frame = obj.to_frame() if isinstance(obj, pd.Series) else obj
+        memory = _format_bytes(int(np.sum(obj.memory_usage(index=True, deep=False))))
+        columns = list(frame.columns[:MAX_ITEMS])
+        length = len(frame)
+        step = max(-(-length // FRAME_SAMPLE_ROWS), 1)
+        sample = frame.iloc[::step, :len(columns)]
+
+        def row(i):
+            return cell_html(frame.index[i]), [cell_html(value) for value in frame.iloc[i, :len(columns)].tolist()]
+
+        def column(j):
+            values = sample.iloc[:, j]
+            non_null = values.dropna()
+            if pd.api.types.is_numeric_dtype(values.dtype) and not pd.api.types.is_bool_dtype(values.dtype) \
+                    or pd.api.types.is_datetime64_any_dtype(values.dtype):
+                return non_null.to_numpy(), len(values) - len(non_null)
+            return non_null.tolist(), len(values) - len(non_null)
+
+        header = self._frame_header(obj, frame.shape, memory)
+        entries = self._frame_entries(frame.columns, [str(t) for t in frame.dtypes], length, row, column, step)
+        return self._block(header, entries, level)
+
+    def _format_polars(self, obj, level):
+        import polars as pl
+        frame = obj.to_frame() if isinstance(obj, pl.Series) else obj
+        memory = _format_bytes(obj.estimated_size())
+        columns = frame.columns[:MAX_ITEMS]
+        length = frame.height
+        step = max(-(-length // FRAME_SAMPLE_ROWS), 1)
+        sample = frame.select(columns).gather_every(step)
+
+        def row(i):
+            return f"[{i}]", [cell_html(value) for value in frame.row(i)[:len(columns)]]
+
+        def column(j):
+            values = sample.to_series(j)
+            non_null = values.drop_nulls()
+            if values.dtype.is_numeric() or values.dtype.is_temporal():
+                return non_null.to_numpy(), values.null_count()
+            return non_null.to_list(), values.null_count()
+
+        header = self._frame_header(obj, frame.shape, memory)
+        entries = self._frame_entries(frame.columns, [str(t) for t in frame.dtypes], length, row, column, step)
+        return self._block(header, entries, level)
+
+    def _format_h5_group(self, group, level):
+        names = list(group.keys())
+        type_name = "File" if group.name == '/' else "Group"
+        header = self._format_header(type_name, f"({group.name}, members={len(names)}, attrs={len(group.attrs)})")
+        return self._block(header, self._h5_group_entries(group, names), level)
+
+    def _h5_group_entries(self, group, names):
+        """Attributes as @name, then members; MATLAB's internal #refs# groups are skipped"""
+        attr_names = list(group.attrs.keys())
+        for name in attr_names[:MAX_ITEMS]:
+            yield f"<b>@{name}</b>", group.attrs[name]
+        if len(attr_names) > MAX_ITEMS:
+            yield None, Html(f"<i>... ({len(attr_names) - MAX_ITEMS} more attrs)</i>")
+        names = [name for name in names if not name.startswith('#')]
+        for i in self._indices_to_show(len(names)):
+            if i == -1:
+                yield None, Html(f"<i>... ({len(names) - MAX_ITEMS} more members) ...</i>")
+                continue
+            try:
+                member = group[names[i]]
+            except (KeyError, OSError) as e:
+                # Dangling soft links and missing external files
+                member = Html(f"&lt;unresolved link: {e}&gt;")
+            yield f"<b>{names[i]}</b>", member
+
+    def _format_h5_dataset(self, ds, level):
+        details = [f"shape={str(ds.shape).replace(' ', '')}", f"dtype={ds.dtype}"]
+        if ds.chunks:
+            details.append(f"chunks={str(ds.chunks).replace(' ', '')}")
+        if ds.compression:
+            details.append(ds.compression)
+        header = self._format_header("Dataset", f"({', '.join(details)})")
+        if ds.shape is None or ds.size == 0:
+            return header + " []"
+        if not self.read_payload:
+            return header + " <i>[header only]</i>"
+        if ds.shape == ():
+            return self._join(header + " ", self.format(ds[()], level + 1))
+        if ds.size < 20 and ds.ndim <= 2:
+            content = str(ds[()]).replace('\n', f'\n{self._get_indent(level+1)}')
+            return f"{header}<br>{self._get_indent(level+1)}{content}"
+        if ds.dtype.kind not in 'biuf':
+            return header
+        try:
+            sample, sampled = h5_chunk_sample(ds)
+            note = " <i>(sampled)</i>" if sampled else ""
+            return f"{header} {summarize_values(sample)}{note}"
+        except Exception as e:
+            return f"{header} &lt;stats error: {e}&gt;"
+
+    def _frame_header(self, obj, shape, memory):
+        type_name = type(obj).__name__
+        if type_name == 'Series':
+            return self._format_header(type_name, f"(len={shape[0]}, name={html.escape(repr(obj.name), quote=False)}, memory={memory})")
+        return self._format_header(type_name, f"(shape={shape[0]}×{shape[1]}, memory={memory})")
+
+    def _frame_entries(self, columns, dtypes, length, row, column, step):
+        """
+        dtype counts, head/tail rows and per-column stats of a DataFrame, shared by
+        pandas and polars: `row(i)` returns (label, cells) HTML of row i, `column(j)`
+        the (values, nulls) of column j over every `step`-th row.
+        """
+        shown = columns[:MAX_ITEMS]
+        dtype_counts = Counter(dtypes)
+        yield "<b>dtypes</b>", Html(', '.join(f"{name} ×{count}" for name, count in dtype_counts.items()))
+        rows = [None if i == -1 else row(i) for i in table_indices(length)]
+        yield None, Html(html_table(shown, rows, length))
+        if len(columns) > MAX_ITEMS:
+            yield None, Html(f"<i>... ({len(columns) - MAX_ITEMS} more columns not shown)</i>")
+        if step > 1:
+            yield None, Html(f"<i>(column stats sampled from {-(-length // step)} of {length} rows)</i>")
+        for j, name in enumerate(shown):
+            if limit_reached():
+                return
+            yield f"<b>{str(name).replace('<', '&lt;').replace('>', '&gt;')}</b>", Html(column_summary(*column(j)))
+
+    def _sequence_entries(self, items, length):
+        for i in self._indices_to_show(length):
+            if i == -1:
+                yield None, Html(f"<i>... ({length - MAX_ITEMS} more items) ...</i>")
+                continue
+            yield f"[{i}]", items[i]
 
     def _format_dict(self, d, level):
+        header, entries = self._dict_block(d)
+        if entries is None:
+            return header + " {}"
+        return self._block(header, entries, level)
+
+    def _dict_block(self, d):
         length = len(d)
+        if is_state_dict(d):
+            root = build_module_tree(d.items(), 'state_dict')
+            return self._module_tree_header(root), self._module_tree_entries(root)
         header = self._format_header("dict", f"(len={length})")
         
         if length == 0:
-            return header + " {}"
+            return header, None
+        return header, self._dict_entries(d, length)
 
-        indent = self._get_indent(level)
-        child_indent = self._get_indent(level + 1)
-        
-        result = [header, " {"]
-        
+    def _dict_entries(self, d, length):
         keys = list(d.keys())
-        indices_to_show = []
-        
-        if length <= MAX_ITEMS:
-            indices_to_show = range(length)
-        else:
-            half = MAX_ITEMS // 2
-            indices_to_show = list(range(half)) + [-1] + list(range(length - half, length))
-
-        for i in indices_to_show:
+        for i in self._indices_to_show(length):
             if i == -1:
-                result.append(f"<br>{child_indent}<i>... ({length - MAX_ITEMS} more items) ...</i>")
+                yield None, Html(f"<i>... ({length - MAX_ITEMS} more items) ...</i>")
                 continue
                 
             key = keys[i]
-            val = d[key]
             
             # Format Key
             key_str = str(key)
             if isinstance(key, str):
                 key_str = f"'{key}'"
             
-            formatted_val = self.format(val, level + 1)
-            result.append(f"<br>{child_indent}<b>{key_str}</b>: {formatted_val}")
-            
-        result.append(f"<br>{indent}}}")
-        return "".join(result)
+            yield f"<b>{key_str}</b>", d[key]
+
+    def _format_module(self, module, level):
+        kinds = {prefix: type(sub).__name__ for prefix, sub in module.named_modules()}
+        named = list(module.named_parameters()) + list(module.named_buffers())
+        root = build_module_tree(named, type(module).__name__, kinds)
+        if not root.tensor_count:
+            return self._format_header(root.kind, "(no parameters)")
+        return self._block(self._module_tree_header(root), self._module_tree_entries(root), level)
+
+    def _format_module_tree(self, obj, level):
+        node, count = (obj.node, obj.count) if isinstance(obj, ModuleRepeat) else (obj, 1)
+        header = self._module_tree_header(node) + (f" × {count}" if count > 1 else "")
+        return self._block(header, self._module_tree_entries(node), level)
+
+    def _module_tree_header(self, node):
+        return self._format_header(node.kind, (
+            f"(tensors={node.tensor_count}, parameters={_format_count(node.params)}, "
+            f"bytes={_format_bytes(node.nbytes)}, {dtype_mix(node.dtypes)})"))
+
+    def _module_tree_entries(self, node):
+        entries = [(f"<b>{name}</b>", child) for name, child in module_tree_children(node)]
+        entries += [(f"<b>{name}</b>", value) for name, value in node.tensors.items()]
+        for i in self._indices_to_show(len(entries)):
+            if limit_reached():
+                return
+            if i == -1:
+                yield None, Html(f"<i>... ({len(entries) - MAX_ITEMS} more items) ...</i>")
+                continue
+            yield entries[i]
 
     def _format_object(self, obj, level):
         # Custom objects
         attrs = {k: v for k, v in obj.__dict__.items() if not k.startswith('_')}
         header = self._format_header(type(obj).__name__, f"(attrs={len(attrs)})")
-        
-        indent = self._get_indent(level)
-        child_indent = self._get_indent(level + 1)
-        
-        result = [header, " {"]
-        
+        return self._block(header, self._object_entries(attrs), level)
+
+    def _format_fallback(self, obj, level):
+        view = structural_view(obj)
+        if view is not None:
+            source, attrs = view
+            header = self._format_header(type(obj).__name__, f"(attrs={len(attrs)}, from {source})")
+            return self._block(header, self._object_entries(attrs), level)
+        text, note = guarded_str(obj)
+        if text is None:
+            reason = (f"took over {REPR_TIME_LIMIT_SEC:g}s" if note == 'slow'
+                      else f"over {_format_bytes(REPR_MAX_LEN)}")
+            return self._format_header(type(obj).__name__, f"(str() skipped: {reason})")
+        text = text.replace('<', '&lt;').replace('>', '&gt;').replace('\n', '<br>')
+        if note is not None:
+            text += f"... <i>(len={note})</i>"
+        return text
+
+    def _object_entries(self, attrs):
         for k, v in list(attrs.items())[:MAX_ITEMS]:
-            formatted_val = self.format(v, level + 1)
-            result.append(f"<br>{child_indent}<b>{k}</b>: {formatted_val}")
+            yield f"<b>{k}</b>", v
             
         if len(attrs) > MAX_ITEMS:
-             result.append(f"<br>{child_indent}<i>... ({len(attrs) - MAX_ITEMS} more attributes)</i>")
-             
-        result.append(f"<br>{indent}}}")
-        return "".join(result)
+            yield None, Html(f"<i>... ({len(attrs) - MAX_ITEMS} more attributes)</i>")
+
+# ============ Preview Planner ============
+
+class Strategy(Enum):
+    FULL = 'full'        # Load everything, rich output
+    MMAP = 'mmap'        # Memory-map array payloads, sampled statistics
+    HEADER = 'header'    # Headers and directories only, no payload
+    SAMPLED = 'sampled'  # Read the first elements of compressed members
+    SCAN = 'scan'        # Walk pickle opcodes without building objects
+
+PreviewPlan = namedtuple('PreviewPlan', ['strategy', 'kind', 'reason'])
+
+# Strategies each file kind supports; anything else falls back in this order
+_KIND_STRATEGIES = {
+    'npy': (Strategy.FULL, Strategy.MMAP, Strategy.HEADER),
+    'pickle-npy': (Strategy.FULL, Strategy.HEADER),
+    'npz': (Strategy.FULL, Strategy.MMAP, Strategy.SAMPLED, Strategy.HEADER),
+    'pickle': (Strategy.FULL, Strategy.SCAN, Strategy.HEADER),
+    'torch': (Strategy.FULL, Strategy.MMAP, Strategy.SCAN, Strategy.HEADER),
+    # Columnar files never load fully: metadata plus the first row group / batch
+    'parquet': (Strategy.SAMPLED, Strategy.HEADER),
+    'arrow': (Strategy.SAMPLED, Strategy.HEADER),
+    'hdf5': (Strategy.SAMPLED, Strategy.HEADER),
+    'mat': (Strategy.SAMPLED, Strategy.HEADER),
+    'safetensors': (Strategy.SAMPLED, Strategy.HEADER),
+    # Shard headers only; tensor stats are read when expanded
+    'sharded': (Strategy.HEADER,),
+    'tar': (Strategy.SAMPLED, Strategy.HEADER),
+    # joblib maps its embedded arrays in place; `full` reads them into memory
+    'joblib': (Strategy.MMAP, Strategy.FULL),
+    'dbm': (Strategy.SAMPLED, Strategy.HEADER),
+}
+# Kinds read lazily whatever their size, and what their `sampled` preview reads
+_LAZY_KINDS = {
+    'parquet': 'footer metadata and first row group',
+    'arrow': 'footer metadata and first row group',
+    'hdf5': 'hierarchy and sampled chunks',
+    'mat': 'variable headers and small variables',
+    'safetensors': 'JSON header, sampled reads of the tensors',
+    'sharded': 'headers of every shard, tensor stats on expand',
+    'tar': 'member index and first sample',
+    'joblib': 'embedded arrays memory-mapped',
+    'dbm': 'key index, values of the keys shown',
+}
+_STRATEGY_FALLBACKS = {
+    Strategy.FULL: (Strategy.SAMPLED,),
+    Strategy.MMAP: (Strategy.SAMPLED, Strategy.SCAN, Strategy.HEADER),
+    Strategy.SAMPLED: (Strategy.MMAP, Strategy.SCAN, Strategy.HEADER),
+    Strategy.SCAN: (Strategy.HEADER,),
+    Strategy.HEADER: (Strategy.SCAN,),
+}
+
+def _file_kind(file_type, file_path):
+    if file_type == FileType.CHECKPOINT_INDEX.value:
+        return 'sharded'
+    if MERGE_SHARDS and file_type in (FileType.SAFETENSORS.value, FileType.PYTORCH.value) \
+            and is_shard(file_path):
+        return 'sharded'
+    if file_type == FileType.NUMPY.value:
+        return 'npz' if zipfile.is_zipfile(file_path) else 'npy'
+    if file_type in (FileType.PICKLE.value, FileType.COMPRESSED_PICKLE.value):
+        return 'pickle'
+    if file_type == FileType.PYTORCH.value:
+        return 'torch'
+    if file_type == FileType.PARQUET.value:
+        return 'parquet'
+    if file_type == FileType.ARROW.value:
+        return 'arrow'
+    if file_type == FileType.HDF5.value:
+        return 'hdf5'
+    if file_type == FileType.MATLAB.value:
+        return 'mat'
+    if file_type == FileType.SAFETENSORS.value:
+        return 'safetensors'
+    if file_type == FileType.TAR.value:
+        return 'tar'
+    if file_type == FileType.JOBLIB.value:
+        return 'joblib'
+    if file_type == FileType.DBM.value:
+        return 'dbm'
+    return None
+
+def _pickle_header(f):
+    """Returns (protocol, first frame size) from the opening opcodes of a pickle stream"""
+    head = f.read(11)
+    if len(head) < 2 or head[0] != 0x80:
+        return None, None  # protocol 0/1, no PROTO opcode
+    frame = None
+    if len(head) == 11 and head[2] == 0x95:  # FRAME
+        frame = int.from_bytes(head[3:11], 'little')
+    return head[1], frame
+
+def _open_pickle_stream(file_type, file_path):
+    if file_type == FileType.COMPRESSED_PICKLE.value and file_path.endswith('.gz'):
+        import gzip
+        return gzip.open(file_path, 'rb')
+    return open(file_path, 'rb')
+
+def _supported_strategy(strategy, kind):
+    supported = _KIND_STRATEGIES[kind]
+    if strategy in supported:
+        return strategy
+    for fallback in _STRATEGY_FALLBACKS.get(strategy, ()):
+        if fallback in supported:
+            return fallback
+    return Strategy.FULL
+
+def plan_preview(file_type, file_path):
+    """Picks a preview strategy from cheap signals: headers, file size and free memory"""
+    kind = _file_kind(file_type, file_path)
+    if kind is None:
+        return PreviewPlan(Strategy.FULL, None, 'unknown file type')
+    if kind == 'npy' and np is None:
+        return PreviewPlan(Strategy.FULL, kind, 'numpy not installed')
+    if kind in _LAZY_KINDS:
+        # Metadata and bounded samples cost the same whatever the file size
+        reason = _LAZY_KINDS[kind]
+        if STRATEGY == 'auto':
+            return PreviewPlan(_KIND_STRATEGIES[kind][0], kind, reason)
+        try:
+            requested = Strategy(STRATEGY)
+        except ValueError:
+            requested = Strategy.FULL
+        return PreviewPlan(_supported_strategy(requested, kind), kind, f"overridden, {reason}")
+
+    estimate = estimate_cost(file_type, file_path)
+    signals = [f"~{_format_bytes(estimate.memory)} from {estimate.basis}"]
+
+    budget = MEMORY_LIMIT_MB * 1024 * 1024 if MEMORY_LIMIT_MB else None
+    available = _available_memory()
+    if available:
+        signals.append(f"{_format_bytes(available)} available")
+        budget = min(budget, available // 2) if budget else available // 2
+
+    compressed_members = False
+    if kind == 'npy':
+        with open(file_path, 'rb') as f:
+            if f.read(6) == b'\x93NUMPY':
+                f.seek(0)
+                _, _, dtype = _read_npy_header(f)
+                if dtype.hasobject:
+                    signals.append("object dtype")
+                    kind = 'pickle-npy'
+    elif kind == 'npz':
+        with zipfile.ZipFile(file_path) as zf:
+            compressed_members = any(i.compress_type != zipfile.ZIP_STORED for i in zf.infolist())
+        signals.append("compressed members" if compressed_members else "stored members")
+    elif kind == 'pickle':
+        with _open_pickle_stream(file_type, file_path) as f:
+            protocol, frame = _pickle_header(f)
+        signals.append(f"protocol {protocol if protocol is not None else '<2'}")
+        if frame is not None:
+            signals.append(f"first frame {_format_bytes(frame)}")
+
+    if STRATEGY != 'auto':
+        try:
+            requested = Strategy(STRATEGY)
+        except ValueError:
+            requested = Strategy.FULL
+        chosen = _supported_strategy(requested, kind)
+        kind = 'npy' if kind == 'pickle-npy' else kind
+        return PreviewPlan(chosen, kind, ', '.join(['overridden'] + signals))
+
+    if budget is None or estimate.memory <= budget:
+        chosen = Strategy.FULL
+    else:
+        signals.append(f"over budget {_format_bytes(budget)}")
+        if kind == 'pickle-npy':
+            chosen = Strategy.HEADER  # object arrays are pickles, can't be mapped
+        elif kind == 'npz':
+            chosen = Strategy.SAMPLED if compressed_members else Strategy.MMAP
+        elif kind == 'pickle':
+            chosen = Strategy.SCAN
+        elif kind == 'torch':
+            chosen = Strategy.MMAP if zipfile.is_zipfile(file_path) and torch_supports_mmap() else Strategy.SCAN
+        else:
+            chosen = Strategy.MMAP
+    kind = 'npy' if kind == 'pickle-npy' else kind
+    return PreviewPlan(chosen, kind, ', '.join(signals))
+
+def _zip_member_offset(f, info):
+    """Returns the offset of a zip member's data, past its local file header"""
+    f.seek(info.header_offset)
+    local = f.read(30)
+    name_len, extra_len = struct.unpack('<HH', local[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+def _npz_member_array(file_path, zf, info, strategy):
+    """
+    Returns (array, note) for an npz member without inflating the archive:
+    stored members are memory-mapped in place, compressed ones are either
+    sampled from their head or reduced to their header.
+    """
+    if info.compress_type == zipfile.ZIP_STORED:
+        with open(file_path, 'rb') as f:
+            f.seek(_zip_member_offset(f, info))
+            shape, fortran, dtype = _read_npy_header(f)
+            offset = f.tell()
+        if not dtype.hasobject and shape:
+            order = 'F' if fortran else 'C'
+            return np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=shape, order=order), None
+
+    with zf.open(info) as member:
+        shape, fortran, dtype = _read_npy_header(member)
+        if strategy is Strategy.SAMPLED and not dtype.hasobject and not fortran:
+            count = min(int(np.prod(shape)), STATS_SAMPLE_SIZE)
+            head = np.frombuffer(member.read(count * dtype.itemsize), dtype=dtype)
+            return head, (shape, dtype, f"first {len(head)} elements")
+    return None, (shape, dtype, "header only")
+
+def _scan_pickle(f, raw, total_size):
+    """
+    Walks pickle opcodes without constructing objects, up to SCAN_MAX_OPS.
+    Returns a dict of counters describing the stream.
+    """
+    ops = Counter()
+    classes = Counter()
+    strings = deque(maxlen=2)
+    scan = {'ops': ops, 'classes': classes, 'objects': 0, 'protocol': None,
+            'frames': 0, 'largest_frame': 0, 'payload_bytes': 0, 'largest_payload': 0,
+            'complete': True, 'position': 0, 'total_size': total_size}
+    visited = 0
+    while f.peek(1):
+        try:
+            for opcode, arg, _ in pickletools.genops(f):
+                visited += 1
+                name = opcode.name
+                ops[name] += 1
+                if name == 'PROTO' and scan['protocol'] is None:
+                    scan['protocol'] = arg
+                elif name == 'FRAME':
+                    scan['frames'] += 1
+                    scan['largest_frame'] = max(scan['largest_frame'], arg)
+                elif name == 'GLOBAL':
+                    classes[arg.replace(' ', '.')] += 1
+                elif name == 'STACK_GLOBAL' and len(strings) == 2:
+                    classes[f"{strings[0]}.{strings[1]}"] += 1
+                elif isinstance(arg, str):
+                    strings.append(arg)
+                elif isinstance(arg, (bytes, bytearray)):
+                    scan['payload_bytes'] += len(arg)
+                    scan['largest_payload'] = max(scan['largest_payload'], len(arg))
+                if visited >= SCAN_MAX_OPS or (visited & 0xffff == 0 and limit_reached()):
+                    scan['complete'] = False
+                    break
+        except ValueError:
+            scan['complete'] = False  # truncated stream
+            break
+        if not scan['complete']:
+            break
+        scan['objects'] += 1
+    scan['position'] = raw.tell()
+    return scan
+
+_OP_GROUPS = (
+    ('dict', ('EMPTY_DICT', 'DICT')),
+    ('list', ('EMPTY_LIST', 'LIST')),
+    ('tuple', ('EMPTY_TUPLE', 'TUPLE', 'TUPLE1', 'TUPLE2', 'TUPLE3')),
+    ('set', ('EMPTY_SET', 'FROZENSET')),
+    ('int', ('INT', 'BININT', 'BININT1', 'BININT2', 'LONG', 'LONG1', 'LONG4')),
+    ('float', ('FLOAT', 'BINFLOAT')),
+    ('str', ('UNICODE', 'SHORT_BINUNICODE', 'BINUNICODE', 'BINUNICODE8',
+             'STRING', 'BINSTRING', 'SHORT_BINSTRING')),
+    ('bytes', ('SHORT_BINBYTES', 'BINBYTES', 'BINBYTES8', 'BYTEARRAY8')),
+    ('object', ('REDUCE', 'NEWOBJ', 'NEWOBJ_EX', 'BUILD', 'INST', 'OBJ')),
+    ('persistent ref', ('PERSID', 'BINPERSID')),
+)
+
+def print_formatted(formatter, obj):
+    """Prints a formatted object line by line as it is produced"""
+    for line in formatter.format_lines(obj):
+        emit(line)
+
+def _print_plan(plan):
+    emit(f"<span style='color:#888'>Preview strategy: <b>{plan.strategy.value}</b> ({plan.reason})</span>")
+    sys.stdout.flush()
+
+def _npz_header(formatter, count):
+    return formatter._format_header("NpzFile", f"(keys={count})")
+
+def _npz_plan_entries(formatter, file_path, zf, members, strategy):
+    for info in members:
+        if limit_reached():
+            break
+        key = info.filename[:-len('.npy')]
+        if strategy is Strategy.HEADER:
+            with zf.open(info) as member:
+                shape, _, dtype = _read_npy_header(member)
+            arr, note = None, (shape, dtype, "header only")
+        else:
+            arr, note = _npz_member_array(file_path, zf, info, strategy)
+        if note is None:
+            yield f"<b>'{key}'</b>", arr
+            continue
+        shape, dtype, label = note
+        value = formatter._format_array_header(shape, dtype) + f" <i>[{label}]</i>"
+        if arr is not None and arr.size and arr.dtype.kind in 'biuf':
+            value += f" min: {np.min(arr):.4g}, max: {np.max(arr):.4g}, mean: {np.mean(arr):.4g}"
+        yield f"<b>'{key}'</b>", Html(value)
+
+def run_plan(plan, file_type, file_path, formatter):
+    """Previews a file with a non-full strategy"""
+    strategy = plan.strategy
+
+    if plan.kind in ('parquet', 'arrow'):
+        print_columnar(formatter, file_type, file_path, strategy)
+        return
+
+    if plan.kind in ('hdf5', 'mat'):
+        print_hierarchical(formatter, file_type, file_path, strategy)
+        return
+
+    if plan.kind == 'safetensors':
+        print_safetensors(formatter, file_path, strategy)
+        return
+
+    if plan.kind == 'sharded':
+        print_sharded(formatter, file_path)
+        return
+
+    if plan.kind == 'tar':
+        print_tar(formatter, file_path, strategy)
+        return
+
+    if plan.kind == 'joblib':
+        print_joblib(formatter, file_path, strategy)
+        return
+
+    if plan.kind == 'dbm':
+        print_dbm(formatter, file_path, strategy)
+        return
+
+    if plan.kind == 'npy':
+        if strategy is Strategy.HEADER:
+            with open(file_path, 'rb') as f:
+                shape, _, dtype = _read_npy_header(f)
+            emit(formatter._format_array_header(shape, dtype) + " <i>[header only]</i>")
+        else:
+            print_formatted(formatter, np.load(file_path, mmap_mode='r', allow_pickle=False))
+        return
+
+    if plan.kind == 'npz':
+        with zipfile.ZipFile(file_path) as zf:
+            members = [i for i in zf.infolist() if i.filename.endswith('.npy')]
+            entries = _npz_plan_entries(formatter, file_path, zf, members, strategy)
+            for line in formatter.stream_block(_npz_header(formatter, len(members)), entries):
+                emit(line)
+        return
+
+    if plan.kind == 'torch' and strategy is Strategy.MMAP:
+        if torch_supports_mmap() and zipfile.is_zipfile(file_path):
+            print_formatted(formatter, torch.load(file_path, map_location='cpu', mmap=True, weights_only=True))
+            return
+        # torch < 2.1 (or a legacy checkpoint) can't map the storages: scan the pickle instead
+        strategy = Strategy.SCAN
+
+    if plan.kind == 'torch' and zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as zf:
+            infos = zf.infolist()
+            data_pkl = next((i for i in infos if i.filename.endswith('/data.pkl')), None)
+            storages = [i for i in infos if '/data/' in i.filename]
+            if strategy is Strategy.HEADER or data_pkl is None:
+                total = sum(i.file_size for i in storages)
+                emit(formatter._format_header(
+                    "torch checkpoint",
+                    f"(records={len(infos)}, storages={len(storages)}, storage bytes={_format_bytes(total)})"
+                ) + " <i>[header only]</i>")
+                return
+            with zf.open(data_pkl) as member:
+                scan = _scan_pickle(member, member, data_pkl.file_size)
+        emit(formatter.format_pickle_scan(scan))
+        return
+
+    # Pickles, compressed pickles and legacy torch files
+    with open(file_path, 'rb') as raw:
+        total_size = os.fstat(raw.fileno()).st_size
+        if file_type == FileType.COMPRESSED_PICKLE.value and file_path.endswith('.gz'):
+            import gzip
+            stream = gzip.GzipFile(fileobj=raw)
+        else:
+            stream = raw
+        if strategy is Strategy.HEADER:
+            protocol, frame = _pickle_header(stream)
+            meta = f"(protocol={protocol if protocol is not None else '<2'}, size={_format_bytes(total_size)}"
+            meta += f", first frame={_format_bytes(frame)})" if frame is not None else ")"
+            emit(formatter._format_header("pickle", meta) + " <i>[header only]</i>")
+            return
+        scan = _scan_pickle(stream, raw, total_size)
+    emit(formatter.format_pickle_scan(scan))
+
+# ============ Loaders ============
+
+class UnknownObject:
+    def __init__(self, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+    def __repr__(self):
+        return f"<UnknownObject>"
+
+class SafeUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        try:
+            return super().find_class(module, name)
+        except (AttributeError, ImportError):
+            # Create a dynamic class with the original name so it shows up correctly in the formatter
+            return type(name, (UnknownObject,), {
+                '__module__': module,
+                '__repr__': lambda self: f"<{module}.{name}>"
+            })
+
+def load_pickle_items(f):
+    """Unpickles every object of a pickle stream, with classes that can't be imported stubbed"""
+    items = []
+    start = f.tell()
+    while True:
+        try:
+            items.append(SafeUnpickler(f).load())
+        except EOFError:
+            break
+        except UnicodeDecodeError:
+            # Fallback for older python 2 pickles
+            f.seek(start)
+            items.append(SafeUnpickler(f, encoding="latin1").load())
+            break
+    return items
+
+def load_torch(f):
+    if torch is None: raise ImportError("Torch not installed")
+    try:
+        return torch.load(f, map_location='cpu', weights_only=True)
+    except TypeError:
+        return torch.load(f, map_location='cpu')
+
+def torch_supports_mmap():
+    """torch.load(mmap=True) exists from torch 2.1"""
+    return torch is not None and 'mmap' in inspect.signature(torch.load).parameters
+
+class FileRegion(RawIOBase):
+    """Seekable read-only view of `size` bytes at `offset` of an open file, e.g. one tar member"""
+    def __init__(self, f, offset, size):
+        self._f = f
+        self._offset = offset
+        self._size = size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, pos, whence=os.SEEK_SET):
+        base = {os.SEEK_SET: 0, os.SEEK_CUR: self._pos, os.SEEK_END: self._size}[whence]
+        self._pos = max(0, base + pos)
+        return self._pos
+
+    def readinto(self, b):
+        count = max(0, min(len(b), self._size - self._pos))
+        self._f.seek(self._offset + self._pos)
+        data = self._f.read(count)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+# ============ Columnar Files ============
+
+def print_columnar(formatter, file_type, file_path, strategy=Strategy.SAMPLED):
+    """
+    Previews a Parquet or Arrow IPC / Feather file from its metadata; with the
+    SAMPLED strategy also the head rows of the first row group (record batch),
+    read through a memory map.
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise ImportError("pyarrow not installed")
+    if file_type == FileType.PARQUET.value:
+        header, entries = _parquet_block(formatter, file_path, strategy)
+    else:
+        header, entries = _arrow_block(formatter, file_path, strategy)
+    for line in formatter.stream_block(header, entries):
+        emit(line)
+
+def _head_table(columns, rows, total):
+    """html_table of the first rows of a table, given as pyarrow pylist dicts"""
+    table_rows = [(f"[{i}]", [cell_html(row.get(column)) for column in columns]) for i, row in enumerate(rows)]
+    html = html_table(columns, table_rows, len(rows))
+    if total is None or total > len(rows):
+        html += f"<i>(first {len(rows)} of {total if total is not None else 'unknown'} rows)</i>"
+    return Html(html)
+
+def _parquet_block(formatter, file_path, strategy):
+    import pyarrow.parquet as pq
+    pf = pq.ParquetFile(file_path, memory_map=True)
+    meta = pf.metadata
+    header = formatter._format_header("Parquet", (
+        f"(rows={meta.num_rows}, columns={meta.num_columns}, row groups={meta.num_row_groups}, "
+        f"size={_format_bytes(os.path.getsize(file_path))})"))
+    return header, _parquet_entries(pf, strategy)
+
+def _parquet_entries(pf, strategy):
+    meta = pf.metadata
+    schema = pf.schema_arrow
+    if meta.created_by:
+        yield "<b>created by</b>", Html(meta.created_by.replace('<', '&lt;').replace('>', '&gt;'))
+    if meta.num_row_groups:
+        group_rows = [meta.row_group(i).num_rows for i in range(meta.num_row_groups)]
+        yield "<b>row groups</b>", Html(
+            f"{len(group_rows)} × {min(group_rows)}–{max(group_rows)} rows, "
+            f"{_format_bytes(sum(meta.row_group(i).total_byte_size for i in range(meta.num_row_groups)))} uncompressed")
+
+    if strategy is Strategy.SAMPLED and meta.num_row_groups and meta.num_rows:
+        # Only the first row group is read, and only up to the rows shown
+        columns = schema.names[:MAX_ITEMS]
+        batch = next(pf.iter_batches(batch_size=TABLE_PREVIEW_ROWS, row_groups=[0], columns=columns), None)
+        if batch is not None:
+            yield None, _head_table(columns, batch.to_pylist(), meta.num_rows)
+
+    # Column chunk statistics, merged over all row groups, from the footer alone
+    for j in range(min(meta.num_columns, MAX_ITEMS)):
+        if limit_reached():
+            return
+        column = meta.schema.column(j)
+        name = column.path
+        field_type = schema.field(name).type if name in schema.names else column.physical_type
+        yield f"<b>{name}</b>", Html(_parquet_column_summary(meta, j, field_type))
+    if meta.num_columns > MAX_ITEMS:
+        yield None, Html(f"<i>... ({meta.num_columns - MAX_ITEMS} more columns)</i>")
+
+def _parquet_column_summary(meta, j, field_type):
+    nulls, lo, hi, compressed, codecs = 0, None, None, 0, set()
+    has_stats = True
+    for i in range(meta.num_row_groups):
+        chunk = meta.row_group(i).column(j)
+        compressed += chunk.total_compressed_size
+        codecs.add(chunk.compression)
+        stats = chunk.statistics
+        if stats is None or not stats.has_min_max:
+            has_stats = False
+            continue
+        if stats.has_null_count:
+            nulls += stats.null_count
+        try:
+            lo = stats.min if lo is None else min(lo, stats.min)
+            hi = stats.max if hi is None else max(hi, stats.max)
+        except TypeError:
+            has_stats = False
+    summary = f"<i>{field_type}</i>"
+    if has_stats and lo is not None:
+        summary += f" min: {cell_html(lo)}, max: {cell_html(hi)}, nulls: {nulls}"
+    codec = '/'.join(sorted(codecs)) or 'none'
+    return summary + f", {_format_bytes(compressed)} {codec.lower()}"
+
+def _arrow_block(formatter, file_path, strategy):
+    import pyarrow as pa
+    source = pa.memory_map(file_path, 'r')
+    try:
+        reader = pa.ipc.open_file(source)
+        batches = reader.num_record_batches
+        # Batches are zero-copy views of the map, so counting rows reads metadata only
+        rows = sum(reader.get_batch(i).num_rows for i in range(batches))
+        first = reader.get_batch(0) if batches else None
+        layout = "IPC file"
+    except pa.ArrowInvalid:
+        try:
+            source.seek(0)
+            reader = pa.ipc.open_stream(source)
+        except pa.ArrowInvalid:
+            # Feather v1 predates the IPC format
+            import pyarrow.feather as feather
+            reader = feather.read_table(file_path, memory_map=True)
+            first = reader  # one memory-mapped table, its null counts are metadata
+            batches, rows, layout = None, reader.num_rows, "Feather v1"
+        else:
+            first = next(iter(reader), None)
+            batches, rows, layout = None, None, "IPC stream"
+    header = formatter._format_header("Arrow", (
+        f"({layout}, rows={rows if rows is not None else 'unknown'}, columns={len(reader.schema)}, "
+        f"batches={batches if batches is not None else 'unknown'}, "
+        f"size={_format_bytes(os.path.getsize(file_path))})"))
+    return header, _arrow_entries(reader.schema, first, rows, strategy)
+
+def _arrow_entries(schema, first, rows, strategy):
+    columns = schema.names[:MAX_ITEMS]
+    if strategy is Strategy.SAMPLED and first is not None and first.num_rows:
+        head = first.slice(0, TABLE_PREVIEW_ROWS).select(columns)
+        yield None, _head_table(columns, head.to_pylist(), rows)
+    for name in columns:
+        field = schema.field(name)
+        summary = f"<i>{field.type}</i>"
+        if not field.nullable:
+            summary += ", not null"
+        elif first is not None and first.num_rows:
+            # Null counts are kept with each array, no values are read
+            summary += f", nulls in first batch: {first.column(name).null_count}"
+        yield f"<b>{name}</b>", Html(summary)
+    if len(schema.names) > MAX_ITEMS:
+        yield None, Html(f"<i>... ({len(schema.names) - MAX_ITEMS} more columns)</i>")
+
+# ============ HDF5 / MAT Files ============
+
+H5_ROW_BLOCK = 65536  # Elements per read of contiguous (unchunked) datasets
+
+def h5py_object_kind(obj):
+    """'group' or 'dataset' for h5py objects, without importing h5py"""
+    for cls in type(obj).__mro__:
+        if cls.__module__.split('.')[0] == 'h5py':
+            if cls.__name__ == 'Group':
+                return 'group'
+            if cls.__name__ == 'Dataset':
+                return 'dataset'
+    return None
+
+def h5_chunk_sample(ds):
+    """
+    Returns (sample, is_sampled) of a numeric HDF5 dataset. Whole chunks are read
+    one at a time, evenly spaced over the chunk grid, until STATS_SAMPLE_SIZE
+    elements, so no chunk is decompressed twice or in part. Contiguous datasets
+    are read in blocks of at most H5_ROW_BLOCK elements instead: whole rows when
+    they fit, else parts of one row along the last axes.
+    """
+    shape = ds.shape
+    chunk = ds.chunks
+    if chunk is None:
+        block, budget = [], H5_ROW_BLOCK
+        for size in reversed(shape):
+            step = max(1, min(size, budget))
+            block.insert(0, step)
+            budget //= step
+        chunk = tuple(block)
+    grid = tuple(-(-size // step) for size, step in zip(shape, chunk))
+    total = int(np.prod(grid))
+    count = min(total, max(1, STATS_SAMPLE_SIZE // int(np.prod(chunk))))
+    parts = []
+    for index in np.unique(np.linspace(0, total - 1, count).astype(np.int64)):
+        if limit_reached():
+            break
+        corner = np.unravel_index(index, grid)
+        selection = tuple(slice(i * step, min((i + 1) * step, size))
+                          for i, step, size in zip(corner, chunk, shape))
+        parts.append(np.asarray(ds[selection]).ravel())
+    return np.concatenate(parts), count < total
+
+def print_hierarchical(formatter, file_type, file_path, strategy=Strategy.SAMPLED):
+    """
+    Previews an HDF5 or MAT file without loading it: the group hierarchy walks
+    metadata only, and with the SAMPLED strategy datasets get chunk-sampled stats.
+    MAT v7.3 files are HDF5; older ones are listed with scipy.io.whosmat.
+    """
+    formatter.read_payload = strategy is not Strategy.HEADER
+    try:
+        import h5py
+    except ImportError:
+        h5py = None
+    if h5py is not None and h5py.is_hdf5(file_path):
+        with h5py.File(file_path, 'r') as f:
+            if file_type == FileType.MATLAB.value:
+                emit(formatter._format_header("MAT-file", "(v7.3, HDF5)"))
+            print_formatted(formatter, f)
+        return
+    if file_type == FileType.HDF5.value:
+        raise ImportError("h5py not installed" if h5py is None else "not an HDF5 file")
+    try:
+        from scipy import io as sio
+    except ImportError:
+        raise ImportError("scipy not installed")
+    variables = sio.whosmat(file_path)
+    header = formatter._format_header("MAT-file", f"(variables={len(variables)})")
+    for line in formatter.stream_block(header, _mat_entries(formatter, file_path, variables)):
+        emit(line)
+
+def _mat_entries(formatter, file_path, variables):
+    from scipy import io as sio
+    for i in formatter._indices_to_show(len(variables)):
+        if i == -1:
+            yield None, Html(f"<i>... ({len(variables) - MAX_ITEMS} more variables) ...</i>")
+            continue
+        if limit_reached():
+            return
+        name, shape, mat_class = variables[i]
+        meta = f"<i>{mat_class}</i> shape={str(tuple(shape)).replace(' ', '')}"
+        if formatter.read_payload and int(np.prod(shape)) <= STATS_SAMPLE_SIZE:
+            # Small variables are loaded one at a time, the others stay on disk
+            value = sio.loadmat(file_path, variable_names=[name], squeeze_me=True,
+                                struct_as_record=False)[name]
+            yield f"<b>{name}</b>", value
+        else:
+            yield f"<b>{name}</b>", Html(f"{meta} <i>[not loaded]</i>")
+
+# ============ safetensors Files ============
+
+# safetensors dtype -> numpy dtype; BF16 is read as uint16 and upcast
+SAFETENSORS_DTYPES = {
+    'F64': 'float64', 'F32': 'float32', 'F16': 'float16', 'BF16': 'uint16',
+    'I64': 'int64', 'I32': 'int32', 'I16': 'int16', 'I8': 'int8',
+    'U64': 'uint64', 'U32': 'uint32', 'U16': 'uint16', 'U8': 'uint8', 'BOOL': 'bool',
+}
+SAFETENSORS_MAX_HEADER = 100 * 1024 * 1024
+BF16_CHUNK = 65536  # Elements upcast to float32 at a time
+
+class SafeTensor:
+    """
+    One tensor of a safetensors file: its header entry, plus the open file to
+    read samples of its bytes from (None when only headers are shown).
+    """
+    def __init__(self, dtype, shape, offsets, file=None):
+        self.dtype = dtype
+        self.shape = tuple(shape)
+        self.offsets = tuple(offsets)  # Absolute [start, stop) byte range in the file
+        self.file = file
+
+    @property
+    def numel(self):
+        count = 1
+        for size in self.shape:
+            count *= size
+        return count
+
+    @property
+    def nbytes(self):
+        return self.offsets[1] - self.offsets[0]
+
+    def sample(self):
+        """
+        (flat values, is_sampled) read with bounded seeks: the whole tensor up to
+        STATS_SAMPLE_SIZE elements, else the same evenly spaced blocks as
+        _stats_sample. None without a file or for dtypes numpy can't read.
+        """
+        np_dtype = SAFETENSORS_DTYPES.get(self.dtype)
+        if self.file is None or np_dtype is None:
+            return None
+        dtype = np.dtype(np_dtype)
+        count = min(self.numel, self.nbytes // dtype.itemsize)
+        if count <= STATS_SAMPLE_SIZE:
+            return self._read(0, count, dtype), False
+        starts, block = _sample_blocks(count)
+        return np.concatenate([self._read(start, block, dtype) for start in starts]), True
+
+    def _read(self, start, count, dtype):
+        self.file.seek(self.offsets[0] + start * dtype.itemsize)
+        data = self.file.read(count * dtype.itemsize)
+        return np.frombuffer(data, dtype=dtype, count=len(data) // dtype.itemsize)
+
+def safetensors_dtype_name(dtype):
+    return 'bfloat16' if dtype == 'BF16' else SAFETENSORS_DTYPES.get(dtype, dtype)
+
+def safetensor_stats(tensor):
+    """Stats HTML of a sample of a SafeTensor's bytes ('' without a file or data)"""
+    try:
+        result = tensor.sample()
+        if result is None or result[0].size == 0:
+            return ''
+        sample, sampled = result
+        if tensor.dtype == 'BF16':
+            sample = bf16_to_float32(sample)
+        if sample.size == 1:
+            return str(sample.reshape(-1)[0])
+        note = " <i>(sampled)</i>" if sampled else ""
+        return f"{summarize_values(sample)}{note}"
+    except Exception as e:
+        return f"&lt;stats error: {e}&gt;"
+
+def read_safetensors_header(f):
+    """Returns (tensor entries, __metadata__, data offset) from the 8-byte length and JSON header"""
+    length = struct.unpack('<Q', f.read(8))[0]
+    if length > SAFETENSORS_MAX_HEADER:
+        raise ValueError(f"safetensors header of {_format_bytes(length)} is too large")
+    header = json.loads(f.read(length))
+    metadata = header.pop('__metadata__', None)
+    return header, metadata, 8 + length
+
+def bf16_to_float32(raw):
+    """Upcasts bfloat16 bits (uint16) to float32, BF16_CHUNK elements at a time"""
+    raw = raw.reshape(-1)
+    out = np.empty(raw.size, dtype=np.float32)
+    bits = out.view(np.uint32)
+    for start in range(0, raw.size, BF16_CHUNK):
+        chunk = raw[start:start + BF16_CHUNK]
+        bits[start:start + chunk.size] = chunk.astype(np.uint32) << 16
+    return out
+
+def print_safetensors(formatter, file_path, strategy=Strategy.SAMPLED):
+    """
+    Previews a safetensors file like a loaded state_dict: the header gives names,
+    dtypes, shapes and offsets without touching tensor data, and is printed before
+    any of it is read; dotted names are grouped into the same module tree as
+    .pth state_dicts. With the SAMPLED strategy each tensor's stats then come
+    from bounded reads of its byte range, never from a map of the whole file.
+    """
+    formatter.read_payload = strategy is not Strategy.HEADER
+    with open(file_path, 'rb') as f:
+        header, metadata, data_start = read_safetensors_header(f)
+        source = f if formatter.read_payload and np is not None else None
+        tensors = {name: SafeTensor(info['dtype'], info['shape'],
+                                    [data_start + offset for offset in info['data_offsets']], source)
+                   for name, info in header.items()}
+        root = None
+        if has_module_keys(tensors):
+            root = build_module_tree(tensors.items(), 'state_dict')
+            block = formatter._module_tree_header(root)
+        else:
+            block = formatter._format_header("dict", f"(len={len(tensors)})")
+        for line in formatter.stream_block(block, _safetensors_entries(formatter, tensors, metadata, root)):
+            emit(line)
+
+def _safetensors_entries(formatter, tensors, metadata, root):
+    params = sum(tensor.numel for tensor in tensors.values())
+    nbytes = sum(tensor.nbytes for tensor in tensors.values())
+    yield None, Html(f"<i>{params:,} parameters, {_format_bytes(nbytes)}</i>")
+    if metadata:
+        yield "<b>__metadata__</b>", metadata
+    if root is not None:
+        yield from formatter._module_tree_entries(root)
+        return
+    names = list(tensors)
+    for i in formatter._indices_to_show(len(names)):
+        if i == -1:
+            yield None, Html(f"<i>... ({len(names) - MAX_ITEMS} more items) ...</i>")
+            continue
+        yield f"<b>'{names[i]}'</b>", tensors[names[i]]
+
+# ============ Sharded Checkpoints ============
+
+# `model-00001-of-00003.safetensors`, `pytorch_model-00001-of-00002.bin`
+SHARD_PATTERN = re.compile(r'^(?P<prefix>.+)-(?P<index>\d+)-of-(?P<total>\d+)\.(?P<ext>safetensors|bin)$')
+SHARD_READERS = 8  # Shard headers read in parallel
+
+class ShardTensor(namedtuple('ShardTensor', ['name', 'dtype', 'shape', 'nbytes', 'shard'])):
+    """Header entry of one tensor of a sharded checkpoint, and the shard file holding it"""
+    @property
+    def numel(self):
+        count = 1
+        for size in self.shape:
+            count *= size
+        return count
+
+def is_shard(file_path):
+    return SHARD_PATTERN.match(os.path.basename(file_path)) is not None
+
+def find_shards(file_path):
+    """
+    Returns (index, shard paths) of the checkpoint an `*.index.json` file or a
+    `-0000k-of-0000n` shard belongs to; index is the parsed index file, or None
+    when there is none and the shards are the numbered siblings of the file.
+    """
+    directory, name = os.path.split(file_path)
+    if name.endswith('.index.json'):
+        with open(file_path, encoding='utf-8') as f:
+            index = json.load(f)
+        shards = sorted(set(index.get('weight_map', {}).values()))
+        return index, [os.path.join(directory, shard) for shard in shards]
+    match = SHARD_PATTERN.match(name)
+    index_path = os.path.join(directory, f"{match['prefix']}.{match['ext']}.index.json")
+    if os.path.exists(index_path):
+        return find_shards(index_path)
+    width = len(match['index'])
+    total = int(match['total'])
+    return None, [os.path.join(directory, f"{match['prefix']}-{i:0{width}d}-of-{match['total']}.{match['ext']}")
+                  for i in range(1, total + 1)]
+
+def read_shard_header(path):
+    """{name: (dtype, shape, bytes)} of one shard, without reading tensor data"""
+    if path.endswith('.safetensors'):
+        with open(path, 'rb') as f:
+            header, _, _ = read_safetensors_header(f)
+        return {name: (safetensors_dtype_name(info['dtype']), tuple(info['shape']),
+                       info['data_offsets'][1] - info['data_offsets'][0])
+                for name, info in header.items()}
+    state = _load_torch_mmap(path)
+    return {name: (str(t.dtype).replace("torch.", ""), tuple(t.shape), t.numel() * t.element_size())
+            for name, t in state.items() if isinstance(t, torch.Tensor)}
+
+def _load_torch_mmap(path):
+    """
+    torch.load with the storages memory-mapped, so only the bytes touched are read.
+    Shards that can't be mapped are reported, never loaded in full: several
+    multi-GB shards would otherwise be read at once by the shard readers.
+    """
+    if torch is None:
+        raise ImportError("Torch not installed")
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except TypeError:
+        raise RuntimeError(f"memory-mapping .bin shards needs torch 2.1 or newer (have {torch.__version__})")
+    except RuntimeError as e:
+        raise RuntimeError(f"can't be memory-mapped (legacy, non-zip checkpoint?): {e}")
+
+def _read_shard(path):
+    try:
+        return read_shard_header(path), None
+    except Exception as e:
+        return {}, e
+
+def _natural_key(name):
+    """Sorts `layers.2` before `layers.10`"""
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part) for part in name.split('.')]
+
+def print_sharded(formatter, file_path):
+    """
+    Previews a sharded checkpoint as one state_dict, from its index file or any
+    shard: the shard headers are read in parallel and merged into the module
+    tree of a state_dict, with the shard of every tensor.
+    Tensor stats are only read when a tensor is expanded (print_expanded).
+    """
+    index, shards = find_shards(file_path)
+    with ThreadPoolExecutor(max_workers=max(1, min(SHARD_READERS, len(shards)))) as pool:
+        results = list(pool.map(_read_shard, shards))
+
+    tensors = {}
+    for path, (header, _) in zip(shards, results):
+        for name, (dtype, shape, nbytes) in header.items():
+            tensors[name] = ShardTensor(name, dtype, shape, nbytes, os.path.basename(path))
+    root = build_module_tree(((name, tensors[name]) for name in sorted(tensors, key=_natural_key)), 'state_dict')
+
+    dtypes = f", {dtype_mix(root.dtypes)}" if root.dtypes else ""
+    header = formatter._format_header("sharded checkpoint", (
+        f"(shards={len(shards)}, tensors={root.tensor_count}, parameters={_format_count(root.params)}, "
+        f"bytes={_format_bytes(root.nbytes)}{dtypes})"))
+    entries = _sharded_entries(formatter, index, shards, results, tensors, root)
+    for line in formatter.stream_block(header, entries):
+        emit(line)
+
+def _sharded_entries(formatter, index, shards, results, tensors, root):
+    yield None, Html(f"<i>{root.params:,} parameters</i>")
+    shard_info = {}
+    for path, (header, error) in zip(shards, results):
+        if error is not None:
+            reason = 'missing' if isinstance(error, FileNotFoundError) else f"unreadable: {error}"
+            shard_info[os.path.basename(path)] = Html(f"<span style='color:red'>{reason}</span>")
+        else:
+            size = sum(nbytes for _, _, nbytes in header.values())
+            shard_info[os.path.basename(path)] = Html(f"<i>{len(header)} tensors, {_format_bytes(size)}</i>")
+    yield "<b>shards</b>", shard_info
+    if index is not None:
+        if index.get('metadata'):
+            yield "<b>metadata</b>", index['metadata']
+        unread = len(set(index.get('weight_map', {})) - set(tensors))
+        if unread:
+            yield None, Html(f"<span style='color:orange'>{unread} tensors of the index are in unreadable shards</span>")
+    yield from formatter._module_tree_entries(root)
+
+# ============ Tar Shards ============
+# WebDataset-style shards: samples are runs of members sharing a key,
+# `000123.jpg`, `000123.cls`, ... Members are read in place at their offset.
+
+TEXT_EXTENSIONS = {'txt', 'text', 'cls', 'cls2', 'id', 'key', 'label', 'caption'}
+TAR_TEXT_LIMIT = 64 * 1024  # Bytes read of text members
+
+class TarSample:
+    """Members of one sample of a tar shard: [(extension, name, offset, size)]"""
+    def __init__(self, tar_path, key, members, load):
+        self.tar_path = tar_path
+        self.key = key
+        self.members = members
+        self.load = load  # Preview the members inline instead of behind expand links
+
+def build_tar_index(file_path):
+    """[(name, data offset, size)] of the regular members, from one pass over the tar headers"""
+    import tarfile
+    with tarfile.open(file_path, 'r:') as tf:
+        return [(member.name, member.offset_data, member.size) for member in tf if member.isfile()]
+
+def tar_index(file_path):
+    """build_tar_index, cached in IMAGE_DIR per file version so reloads and drill-downs skip the pass"""
+    stat = os.stat(file_path)
+    cache = None
+    if IMAGE_DIR:
+        key = hashlib.sha1(f"{os.path.abspath(file_path)}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+        cache = os.path.join(IMAGE_DIR, f"tar-index-{key[:16]}.json")
+        try:
+            with open(cache, encoding='utf-8') as f:
+                return [tuple(entry) for entry in json.load(f)]
+        except (OSError, ValueError):
+            pass
+    index = build_tar_index(file_path)
+    if cache:
+        tmp = f"{cache}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp, cache)
+    return index
+
+def is_tar_archive(file_path):
+    """False for `checkpoint.pth.tar`-style files that torch.save wrote despite their name"""
+    import tarfile
+    return tarfile.is_tarfile(file_path)
+
+def tar_sample_key(name):
+    """WebDataset convention: `dir/000123.seg.npy` -> (`dir/000123`, `seg.npy`)"""
+    directory, _, base = name.rpartition('/')
+    stem, _, extension = base.partition('.')
+    return (f"{directory}/{stem}" if directory else stem), extension
+
+def load_tar_member(tar_path, name, offset, size):
+    """
+    Loads one member in place with the loader of its extension: .npy is
+    memory-mapped at its offset, pickles and torch files are read through a
+    FileRegion; unknown members are shown as their size.
+    """
+    extension = name.rpartition('.')[2].lower()
+    with open(tar_path, 'rb') as f:
+        region = BufferedReader(FileRegion(f, offset, size))
+        if extension == 'npy' and np is not None:
+            if region.read(6) == b'\x93NUMPY':
+                region.seek(0)
+                shape, fortran_order, dtype = _read_npy_header(region)
+                if not dtype.hasobject:
+                    return np.memmap(tar_path, dtype=dtype, mode='r', offset=offset + region.tell(),
+                                     shape=shape, order='F' if fortran_order else 'C')
+            region.seek(0)
+            return np.load(region, allow_pickle=True)
+        if extension == 'npz' and np is not None:
+            with np.load(region, allow_pickle=True) as npz:
+                return {key: npz[key] for key in npz.files[:MAX_ITEMS]}
+        if extension in ('pkl', 'pickle', 'pck'):
+            items = load_pickle_items(region)
+            return items[0] if len(items) == 1 else items
+        if extension in ('pth', 'pt', 'ckpt'):
+            return load_torch(region)
+        if extension == 'json':
+            return json.load(region)
+        if extension in TEXT_EXTENSIONS:
+            return region.read(TAR_TEXT_LIMIT).decode('utf-8', errors='replace')
+    return Html(f"<b>bytes</b> <i>(len={size})</i>")
+
+def print_tar(formatter, file_path, strategy=Strategy.SAMPLED):
+    """
+    Previews a tar shard from its member index (one sequential pass over the
+    headers, cached): members grouped into samples by key, the first sample
+    loaded (SAMPLED strategy), the others behind expand links.
+    """
+    index = tar_index(file_path)
+    samples = {}
+    for name, offset, size in index:
+        key, extension = tar_sample_key(name)
+        samples.setdefault(key, []).append((extension, name, offset, size))
+    extensions = Counter(extension for members in samples.values() for extension, _, _, _ in members)
+
+    header = formatter._format_header("tar", (
+        f"(members={len(index)}, samples={len(samples)}, size={_format_bytes(os.path.getsize(file_path))})"))
+    entries = _tar_entries(formatter, file_path, samples, extensions, strategy is not Strategy.HEADER)
+    for line in formatter.stream_block(header, entries):
+        emit(line)
+
+def _tar_entries(formatter, file_path, samples, extensions, load_first):
+    if extensions:
+        yield "<b>extensions</b>", Html(", ".join(
+            f"{extension or '<i>none</i>'} × {count}" for extension, count in extensions.most_common(MAX_ITEMS)))
+    keys = list(samples)
+    for i in formatter._indices_to_show(len(keys)):
+        if limit_reached():
+            return
+        if i == -1:
+            yield None, Html(f"<i>... ({len(keys) - MAX_ITEMS} more samples) ...</i>")
+            continue
+        yield f"<b>'{keys[i]}'</b>", TarSample(file_path, keys[i], samples[keys[i]], load_first and i == 0)
+
+# ============ joblib Files ============
+
+def print_joblib(formatter, file_path, strategy=Strategy.MMAP):
+    """
+    Loads a joblib dump with its numpy arrays memory-mapped (mmap_mode='r'):
+    the arrays are views of the file, so the bounded array previews only read
+    the pages they touch, and arrays larger than the memory limit open too (the
+    ResourceGuard counts resident pages only). Compressed dumps can't be mapped
+    and load in memory.
+    """
+    try:
+        import joblib
+    except ImportError:
+        raise ImportError("joblib not installed")
+    with open(file_path, 'rb') as f:
+        compressed = f.read(1) != b'\x80'  # Uncompressed dumps start with the pickle PROTO opcode
+    mmap_mode = 'r' if strategy is Strategy.MMAP and not compressed else None
+    if strategy is Strategy.MMAP and compressed:
+        emit("<span style='color:#888'>Compressed joblib file: arrays are decompressed into memory</span>")
+    print_formatted(formatter, joblib.load(file_path, mmap_mode=mmap_mode))
+
+# ============ shelve / dbm Stores ============
+
+SHELVE_INLINE_BYTES = 1024 * 1024  # Larger values of the keys shown wait for an expand
+
+def dbm_base_path(path):
+    """The path dbm.open takes: dumb and ndbm stores are named without their file suffixes"""
+    import dbm
+    root, ext = os.path.splitext(path)
+    for candidate in ((root, path) if ext in ('.dir', '.dat', '.bak', '.db') else (path,)):
+        if dbm.whichdb(candidate):
+            return candidate
+    raise ValueError("not a shelve / dbm store")
+
+def dbm_key_sizes(base):
+    """
+    [(key, value size)] of a dbm store. dbm.dumb lists both in its .dir file,
+    so no value is read; other backends read the raw bytes of each value.
+    """
+    import dbm
+    if dbm.whichdb(base) == 'dbm.dumb':
+        sizes = {}
+        with open(base + '.dir', encoding='Latin-1') as f:
+            for line in f:
+                if line.strip():
+                    key, (_, size) = ast.literal_eval(line)
+                    sizes[key.encode('Latin-1')] = size  # Later lines override earlier ones
+        return list(sizes.items())
+    with dbm.open(base, 'r') as db:
+        return [(key, len(db[key])) for key in db.keys()]
+
+def unpickle_value(raw):
+    """A dbm value unpickled with SafeUnpickler; values that aren't pickles stay bytes"""
+    try:
+        items = load_pickle_items(BytesIO(raw))
+    except Exception as e:
+        return Html(f"<b>bytes</b> <i>(len={len(raw)})</i> <span style='color:#888'>not a pickle: {e}</span>")
+    return items[0] if len(items) == 1 else items
+
+def print_dbm(formatter, file_path, strategy=Strategy.SAMPLED):
+    """
+    Previews a shelve / dbm store as a dict: keys and value sizes come from the
+    store index, and only the values of the keys shown are unpickled (large
+    ones, and all of them with the HEADER strategy, when expanded).
+    """
+    import dbm
+    base = dbm_base_path(file_path)
+    entries = sorted(dbm_key_sizes(base))
+    total = sum(size for _, size in entries)
+    header = formatter._format_header("shelve", (
+        f"({dbm.whichdb(base)}, len={len(entries)}, values={_format_bytes(total)})"))
+    with dbm.open(base, 'r') as db:
+        for line in formatter.stream_block(header, _dbm_entries(formatter, db, entries, strategy is not Strategy.HEADER)):
+            emit(line)
+
+def _dbm_entries(formatter, db, entries, load):
+    for i in formatter._indices_to_show(len(entries)):
+        if limit_reached():
+            return
+        if i == -1:
+            yield None, Html(f"<i>... ({len(entries) - MAX_ITEMS} more keys) ...</i>")
+            continue
+        key, size = entries[i]
+        name = key.decode('utf-8', errors='replace').replace('<', '&lt;').replace('>', '&gt;')
+        if load and size <= SHELVE_INLINE_BYTES:
+            yield f"<b>'{name}'</b>", unpickle_value(db[key])
+        else:
+            token = expand_token(kind='dbm-key', key=key.decode('Latin-1'))
+            yield f"<b>'{name}'</b>", Html(f"<i>{_format_bytes(size)}</i> {expander_html(token, 'preview')}")
+
+# ============ Expand Links ============
+# Details too costly to compute for every entry (e.g. tensor stats of sharded
+# checkpoints) are shown as expand links. The webview reruns the script with
+# `--expand=<token>` on click; the token says what to compute.
+
+def expand_token(**request):
+    return base64.urlsafe_b64encode(json.dumps(request).encode()).decode().rstrip('=')
+
+def expander_html(token, label='stats'):
+    return f"<span class='expand' data-expand='{token}'>[{label}]</span>"
+
+def print_expanded(formatter, file_path, token):
+    """Prints what an expand link stands for, to replace the link in the preview"""
+    request = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    if request.get('kind') == 'tensor':
+        # Shards are looked up next to the previewed file, never elsewhere
+        shard = os.path.join(os.path.dirname(file_path), os.path.basename(request['shard']))
+        emit(shard_tensor_stats(shard, request['name']))
+    elif request.get('kind') == 'tar-member':
+        entry = next((entry for entry in tar_index(file_path) if entry[0] == request['name']), None)
+        if entry is None:
+            emit(f"<span style='color:red'>No member {request['name']} in the archive</span>")
+            return
+        value = load_tar_member(file_path, *entry)
+        emit(value if isinstance(value, Html) else formatter.format(value))
+    elif request.get('kind') == 'dbm-key':
+        import dbm
+        with dbm.open(dbm_base_path(file_path), 'r') as db:
+            value = unpickle_value(db[request['key'].encode('Latin-1')])
+        emit(value if isinstance(value, Html) else formatter.format(value))
+    else:
+        emit(f"<span style='color:red'>Unknown expand request: {request.get('kind')}</span>")
+
+def shard_tensor_stats(path, name):
+    """Stats of one tensor of a shard: bounded reads for safetensors, a memory map for .bin"""
+    if path.endswith('.safetensors'):
+        with open(path, 'rb') as f:
+            header, _, data_start = read_safetensors_header(f)
+            info = header[name]
+            tensor = SafeTensor(info['dtype'], info['shape'],
+                                [data_start + offset for offset in info['data_offsets']], f)
+            return safetensor_stats(tensor) or "<i>(empty)</i>"
+    return torch_tensor_stats(_load_torch_mmap(path)[name])
+
+def torch_tensor_stats(tensor):
+    """Stats of a tensor from at most STATS_SAMPLE_SIZE evenly spaced elements"""
+    flat = tensor.detach().reshape(-1)
+    if flat.numel() == 0:
+        return "<i>(empty)</i>"
+    if flat.numel() == 1:
+        return str(flat[0].item())
+    step = -(-flat.numel() // STATS_SAMPLE_SIZE)
+    try:
+        sample = flat[::step].to(torch.float32).numpy()
+    except Exception as e:
+        return f"&lt;stats error: {e}&gt;"
+    note = " <i>(sampled)</i>" if step > 1 else ""
+    return f"{summarize_values(sample)}{note}"
 
 # ============ Main Processor ============
 
+def _npz_entries(npz):
+    for k in npz.files:
+        if limit_reached():
+            break
+        yield f"<b>'{k}'</b>", npz[k]
+
 def process_file(file_type: int, file_path: str):
     """Loads file and applies formatting"""
     
@@ -301,57 +3398,43 @@ def process_file(file_type: int, file_path: str):
     formatter = JetBrainsFormatter()
 
     try:
+        if EXPAND:
+            print_expanded(formatter, file_path, EXPAND)
+            return
+
+        if file_type == FileType.TAR.value and os.path.isfile(file_path) and not is_tar_archive(file_path):
+            file_type = FileType.PYTORCH.value
+
+        if os.path.exists(file_path):
+            plan = plan_preview(file_type, file_path)
+            _print_plan(plan)
+            if plan.strategy is not Strategy.FULL:
+                run_plan(plan, file_type, file_path, formatter)
+                return
+            warn_if_expensive(file_type, file_path)
+
         # 1. Load the content based on type
         if file_type == FileType.NUMPY.value:
             if np is None: raise ImportError("Numpy not installed")
             content = np.load(file_path, allow_pickle=True)
             # Handle .npz (NpzFile) specifically
             if hasattr(content, 'files'):
-                print("<b>NpzFile</b> <i>(keys={})</i> {{".format(len(content.files)))
-                for k in content.files:
-                    print(f"&nbsp;&nbsp;<b>'{k}'</b>: {formatter.format(content[k], 1)}")
-                print("}")
+                entries = _npz_entries(content)
+                for line in formatter.stream_block(_npz_header(formatter, len(content.files)), entries):
+                    emit(line)
                 return
 
         elif file_type == FileType.PICKLE.value:
-            import pickle
-            
-            class UnknownObject:
-                def __init__(self, *args, **kwargs):
-                    self.args = args
-                    self.kwargs = kwargs
-                def __repr__(self):
-                    return f"<UnknownObject>"
-
-            class SafeUnpickler(pickle.Unpickler):
-                def find_class(self, module, name):
-                    try:
-                        return super().find_class(module, name)
-                    except (AttributeError, ImportError):
-                        # Create a dynamic class with the original name so it shows up correctly in the formatter
-                        return type(name, (UnknownObject,), {
-                            '__module__': module,
-                            '__repr__': lambda self: f"<{module}.{name}>"
-                        })
-
             # Read all objects in the pickle file
-            items = []
             with open(file_path, "rb") as f:
-                while True:
-                    try:
-                        items.append(SafeUnpickler(f).load())
-                    except EOFError:
-                        break
-                    except UnicodeDecodeError:
-                        # Fallback for older python 2 pickles
-                        f.seek(0)
-                        items.append(SafeUnpickler(f, encoding="latin1").load())
-                        break
+                items = load_pickle_items(f)
             
             # v0 compatibility: Print items with headers
             for i, item in enumerate(items):
-                print(f'<b>Item {i+1}/{len(items)}:</b>')
-                print(formatter.format(item))
+                if limit_reached():
+                    break
+                emit(f'<b>Item {i+1}/{len(items)}:</b>')
+                print_formatted(formatter, item)
             return
 
         elif file_type == FileType.COMPRESSED_PICKLE.value:
@@ -359,43 +3442,88 @@ def process_file(file_type: int, file_path: str):
             content = compress_pickle.load(file_path)
 
         elif file_type == FileType.PYTORCH.value:
-            if torch is None: raise ImportError("Torch not installed")
-            try:
-                content = torch.load(file_path, map_location='cpu', weights_only=True)
-            except TypeError:
-                content = torch.load(file_path, map_location='cpu')
+            with open(file_path, 'rb') as f:
+                content = load_torch(f)
+
+        elif file_type in (FileType.PARQUET.value, FileType.ARROW.value):
+            print_columnar(formatter, file_type, file_path)
+            return
+
+        elif file_type in (FileType.HDF5.value, FileType.MATLAB.value):
+            print_hierarchical(formatter, file_type, file_path)
+            return
+
+        elif file_type == FileType.SAFETENSORS.value:
+            print_safetensors(formatter, file_path)
+            return
+
+        elif file_type == FileType.CHECKPOINT_INDEX.value:
+            print_sharded(formatter, file_path)
+            return
+
+        elif file_type == FileType.TAR.value:
+            print_tar(formatter, file_path)
+            return
+
+        elif file_type == FileType.JOBLIB.value:
+            print_joblib(formatter, file_path, Strategy.FULL)
+            return
+
+        elif file_type == FileType.DBM.value:
+            print_dbm(formatter, file_path)
+            return
 
         else:
-            print("Unsupported file type.")
+            emit("Unsupported file type.")
             return
 
         # 2. Format and Print
-        print(formatter.format(content))
+        print_formatted(formatter, content)
 
+    except MemoryError:
+        # The allocator ran out of memory before the watchdog noticed
+        emit(f"<span style='color:orange'>Preview stopped: memory limit "
+              f"({_format_bytes(MEMORY_LIMIT_MB * 1024 * 1024)}) reached while loading.</span>")
     except Exception as e:
         # Print error in red
-        print(f"<span style='color:red'>Error processing file: {e}</span>")
+        emit(f"<span style='color:red'>Error processing file: {e}</span>")
         import traceback
         traceback.print_exc()
+    finally:
+        _figures.close()
 
 def main():
+    global _guard
     sys.stdout.reconfigure(encoding='utf-8')
     if len(sys.argv) < 3:
-        print("Usage: python read_files.py <file_type> <file_path> [mode]")
+        print("Usage: python read_files.py <file_type> <file_path> [mode] [--key=value ...]")
         return
     
     try:
         f_type = int(sys.argv[1])
-        f_path = sys.argv[2]
-        
-        if len(sys.argv) > 3:
-            set_config(sys.argv[3])
-            
-        process_file(f_type, f_path)
     except ValueError:
-        print("Error: file_type must be an integer")
+        emit("Error: file_type must be an integer")
+        return
+    f_path = sys.argv[2]
+
+    if len(sys.argv) > 3 and not sys.argv[3].startswith('--'):
+        set_config(sys.argv[3])
+    try:
+        set_options(parse_options(sys.argv[3:]))
+    except ValueError as e:
+        emit(f"Error: {e}")
+        return
+
+    try:
+        _guard = ResourceGuard(MEMORY_LIMIT_MB, TIME_LIMIT_SEC).start()
+        try:
+            process_file(f_type, f_path)
+        finally:
+            _guard.stop()
+        if _guard.tripped:
+            emit(_guard.notice())
     except Exception as e:
-        print(f"Error: {e}")
+        emit(f"Error: {e}")
 
 if __name__ == "__main__":
     main()
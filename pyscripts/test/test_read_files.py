@@ -7,6 +7,9 @@ matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import os
 import sys
+import json
+import re
+import time
 from pathlib import Path
 import compress_pickle
 
@@ -15,6 +18,7 @@ current_dir = Path(__file__).parent
 project_root = current_dir.parent.parent
 sys.path.insert(0, str(project_root))
 
+from pyscripts import read_files
 from pyscripts.read_files import FileType, process_file
 
 class TestReadFiles:
@@ -108,3 +112,669 @@ class TestReadFiles:
         process_file(FileType.NUMPY.value, 'nonexistent.npy')
         captured = capsys.readouterr()
         assert "No such file" in captured.out
+
+    def test_estimate_cost_from_npy_header(self, setup_test_files):
+        estimate = read_files.estimate_cost(FileType.NUMPY.value, str(setup_test_files['npy_path']))
+        assert estimate.basis == 'npy header'
+        assert estimate.memory == 4 * np.array([[1, 2], [3, 4]]).itemsize
+
+    def test_expensive_file_warning(self, setup_test_files, capsys, monkeypatch):
+        monkeypatch.setattr(read_files, 'MEMORY_LIMIT_MB', 1e-6)
+        monkeypatch.setattr(read_files, 'STRATEGY', 'full')
+        process_file(FileType.NUMPY.value, str(setup_test_files['npy_path']))
+        captured = capsys.readouterr()
+        assert 'above the memory limit' in captured.out
+        assert 'shape=(2,2)' in captured.out
+
+    def test_resource_limit_keeps_partial_output(self, setup_test_files, capsys, monkeypatch):
+        guard = read_files.ResourceGuard(0, 0)
+        guard.tripped = 'time'
+        monkeypatch.setattr(read_files, '_guard', guard)
+        process_file(FileType.PYTORCH.value, str(setup_test_files['pth_path']))
+        captured = capsys.readouterr()
+        assert 'preview stopped: time limit reached' in captured.out
+        assert 'time limit' in guard.notice()
+
+    def test_memory_trip_exits_without_long_grace(self, monkeypatch):
+        exited = []
+        monkeypatch.setattr(os, '_exit', lambda code: exited.append(time.monotonic()))
+        monkeypatch.setattr(read_files, 'emit', lambda line: None)
+        guard = read_files.ResourceGuard(1, 0)  # 1 MB: tripped at the first poll
+        started = time.monotonic()
+        guard.start()
+        try:
+            while not exited and time.monotonic() - started < 5:
+                time.sleep(0.05)
+        finally:
+            guard.stop()
+        assert guard.tripped == 'memory'
+        assert exited and exited[0] - started < read_files.ResourceGuard.GRACE_PERIOD
+
+    def test_invalid_option_is_named(self, capsys, monkeypatch):
+        for name in ('MEMORY_LIMIT_MB', 'TIME_LIMIT_SEC'):
+            monkeypatch.setattr(read_files, name, getattr(read_files, name))
+        monkeypatch.setattr(sys, 'argv', ['read_files.py', '0', 'x.npy', '--memory-limit-mb=abc'])
+        read_files.main()
+        assert capsys.readouterr().out == "Error: invalid value for --memory-limit-mb: 'abc'\n"
+        monkeypatch.setattr(sys, 'argv', ['read_files.py', 'npy', 'x.npy'])
+        read_files.main()
+        assert capsys.readouterr().out == "Error: file_type must be an integer\n"
+
+    def test_guard_allows_maps_larger_than_limit(self, tmp_path):
+        # Only resident memory counts: mapping a file twice the size of the budget works
+        limit_mb = read_files._resident_memory() // 2**20 + 128
+        npy_path = tmp_path / "sparse.npy"
+        np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float32, shape=(limit_mb * 2**19,)).flush()
+        guard = read_files.ResourceGuard(limit_mb, 0).start()
+        try:
+            arr = np.load(npy_path, mmap_mode='r')
+            assert arr.nbytes > limit_mb * 2**20 and arr[-1000:].sum() == 0
+        finally:
+            guard.stop()
+        assert guard.tripped is None
+
+    def test_planner_memory_maps_large_arrays(self, tmp_path, capsys, monkeypatch):
+        npy_path = tmp_path / "large.npy"
+        np.save(npy_path, np.arange(300000, dtype=np.float64))
+        monkeypatch.setattr(read_files, 'MEMORY_LIMIT_MB', 1)
+        monkeypatch.setattr(read_files, 'STATS_SAMPLE_SIZE', 1000)
+        process_file(FileType.NUMPY.value, str(npy_path))
+        captured = capsys.readouterr()
+        assert 'Preview strategy: <b>mmap</b>' in captured.out
+        assert 'shape=(300000,)' in captured.out
+        assert '(sampled)' in captured.out
+
+    def test_planner_mmap_under_active_guard(self, tmp_path, capsys, monkeypatch):
+        # Over budget is exactly when the planner maps the file: it must work with the guard running
+        limit_mb = read_files._resident_memory() // 2**20 + 128
+        npy_path = tmp_path / "huge.npy"
+        np.lib.format.open_memmap(npy_path, mode='w+', dtype=np.float64, shape=(limit_mb * 2**18,)).flush()
+        monkeypatch.setattr(read_files, 'MEMORY_LIMIT_MB', limit_mb)
+        guard = read_files.ResourceGuard(limit_mb, 60).start()
+        monkeypatch.setattr(read_files, '_guard', guard)
+        try:
+            process_file(FileType.NUMPY.value, str(npy_path))
+        finally:
+            guard.stop()
+        captured = capsys.readouterr()
+        assert 'Preview strategy: <b>mmap</b>' in captured.out
+        assert f'shape=({limit_mb * 2**18},)' in captured.out and '(sampled)' in captured.out
+        assert 'Error' not in captured.out and guard.tripped is None
+
+    def test_planner_torch_without_mmap_scans(self, tmp_path, capsys, monkeypatch):
+        pth_path = tmp_path / "large.pth"
+        torch.save({'weight': torch.zeros(1000, 1000)}, pth_path)
+        original_load = torch.load
+
+        def load_without_mmap(f, map_location=None, weights_only=False):  # torch < 2.1
+            return original_load(f, map_location=map_location, weights_only=weights_only)
+
+        monkeypatch.setattr(torch, 'load', load_without_mmap)
+        monkeypatch.setattr(read_files, 'MEMORY_LIMIT_MB', 1)
+        process_file(FileType.PYTORCH.value, str(pth_path))
+        captured = capsys.readouterr()
+        assert 'Preview strategy: <b>scan</b>' in captured.out and 'pickle scan' in captured.out
+        # An explicit `mmap` strategy degrades the same way
+        monkeypatch.setattr(read_files, 'STRATEGY', 'mmap')
+        process_file(FileType.PYTORCH.value, str(pth_path))
+        captured = capsys.readouterr()
+        assert 'Preview strategy: <b>mmap</b>' in captured.out and 'pickle scan' in captured.out
+        assert 'Error' not in captured.out
+
+    def test_planner_scans_large_pickles(self, tmp_path, capsys, monkeypatch):
+        pkl_path = tmp_path / "large.pkl"
+        with open(pkl_path, 'wb') as f:
+            pickle.dump({'rows': [{'id': i, 'name': str(i)} for i in range(20000)]}, f)
+        monkeypatch.setattr(read_files, 'MEMORY_LIMIT_MB', 1)
+        process_file(FileType.PICKLE.value, str(pkl_path))
+        captured = capsys.readouterr()
+        assert 'Preview strategy: <b>scan</b>' in captured.out
+        assert 'pickle scan' in captured.out
+        assert 'dict ×20001' in captured.out
+
+    def test_planner_strategy_override(self, setup_test_files, capsys, monkeypatch):
+        monkeypatch.setattr(read_files, 'STRATEGY', 'header')
+        process_file(FileType.NUMPY.value, str(setup_test_files['npz_path']))
+        captured = capsys.readouterr()
+        assert 'Preview strategy: <b>header</b> (overridden' in captured.out
+        assert "'array'" in captured.out
+        assert '[header only]' in captured.out
+
+    def test_json_output_mode(self, setup_test_files, capsys, monkeypatch):
+        monkeypatch.setattr(read_files, 'OUTPUT_MODE', 'json')
+        process_file(FileType.PICKLE.value, str(setup_test_files['pkl_path']))
+        captured = capsys.readouterr()
+        nodes = [json.loads(line) for line in captured.out.splitlines()]
+        header = next(i for i, node in enumerate(nodes) if node['h'].startswith('<b>dict</b>'))
+        children = nodes[header + 1:]
+        assert [node['k'] for node in children] == ["<b>'a'</b>", "<b>'b'</b>"]
+        assert all(node['child'] for node in children)
+        assert 'shape=(3,)' in children[0]['h']
+        assert children[0]['c'] == [{'h': '[1 2 3]'}]
+
+    def test_figures_spill_to_image_dir(self, setup_test_files, tmp_path, capsys, monkeypatch):
+        image_dir = tmp_path / "images"
+        image_dir.mkdir()
+        monkeypatch.setattr(read_files, 'IMAGE_DIR', str(image_dir))
+        monkeypatch.setattr(read_files, 'IMAGE_URI', 'https://webview/images')
+        process_file(FileType.PICKLE.value, str(setup_test_files['plt_pkl_path']))
+        captured = capsys.readouterr()
+        images = list(image_dir.iterdir())
+        assert len(images) == 1 and images[0].suffix == '.png'
+        assert f'<img src="https://webview/images/{images[0].name}">' in captured.out
+        assert 'base64' not in captured.out
+
+        # A reload of the same figure reuses the file instead of rendering it again
+        monkeypatch.setattr(read_files, 'render_figure', lambda fig, fmt: pytest.fail('re-rendered'))
+        process_file(FileType.PICKLE.value, str(setup_test_files['plt_pkl_path']))
+        assert images[0].name in capsys.readouterr().out
+
+    def test_figures_render_in_background(self, tmp_path, capsys, monkeypatch):
+        figures = []
+        for i in range(3):
+            fig, ax = plt.subplots()
+            ax.plot([0, i])
+            figures.append(fig)
+        pkl_path = tmp_path / "figures.pkl"
+        with open(pkl_path, 'wb') as f:
+            pickle.dump(figures, f)
+        plt.close('all')
+        monkeypatch.setattr(read_files, 'OUTPUT_MODE', 'json')
+        monkeypatch.setattr(read_files, 'MAX_ITEMS', 2)
+        process_file(FileType.PICKLE.value, str(pkl_path))
+        nodes = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        entries = [node for node in nodes if node.get('k', '').startswith('[')]
+        fills = [node for node in nodes if 'fill' in node]
+        # The first figure is rendered in place, the shown rest in the pool
+        assert 'data:image/jpeg;base64' in entries[0]['h']
+        assert f'id="{fills[0]["fill"]}"' in entries[1]['h']
+        assert len(fills) == 1
+        assert 'data:image/jpeg;base64' in fills[0]['h']
+
+    def test_image_arrays_render_thumbnails(self, tmp_path, capsys):
+        npy_path = tmp_path / "image.npy"
+        np.save(npy_path, np.random.rand(64, 48, 3).astype(np.float32))
+        process_file(FileType.NUMPY.value, str(npy_path))
+        captured = capsys.readouterr()
+        assert 'min:' in captured.out
+        assert '<img src="data:image/png;base64,' in captured.out
+
+        # Batches become a contact sheet, and PNG encoding works on uint8 tiles
+        tiles = read_files._contact_sheet(np.zeros((5, 8, 8, 3), dtype=np.uint8))
+        assert tiles.shape == (18, 28, 3)
+        assert read_files.encode_png(tiles).startswith(b'\x89PNG\r\n\x1a\n')
+        # Tables are not images, nor are feature matrices without an image dtype
+        assert read_files.image_layout(np.zeros((1000, 3))) is None
+        assert read_files.image_layout(np.zeros((3, 500), dtype=np.uint8)) is None
+        for matrix in (np.random.randn(100, 20), np.random.randn(200, 50), np.arange(3000).reshape(100, 30)):
+            assert read_files.image_layout(matrix) is None
+            assert '<img' not in read_files.JetBrainsFormatter().format(matrix)
+        assert read_files.image_layout(np.zeros((28, 28), dtype=np.uint8)) == (None, 28, 28, 1)
+        assert read_files.image_layout(np.random.rand(256, 192)) == (None, 256, 192, 1)
+
+    def test_numeric_list_summary(self, tmp_path, capsys, monkeypatch):
+        pkl_path = tmp_path / "numbers.pkl"
+        with open(pkl_path, 'wb') as f:
+            pickle.dump({'floats': [i / 7 for i in range(5000)], 'mixed': [1, 'a'] * 50}, f)
+        monkeypatch.setattr(read_files, 'STATS_SAMPLE_SIZE', 1000)
+        process_file(FileType.PICKLE.value, str(pkl_path))
+        captured = capsys.readouterr()
+        assert '<i>(len=5000)</i> float64 min: 0, max: 714.1' in captured.out
+        assert '(sampled)' in captured.out
+        assert '<i>(len=100)</i> {' in captured.out
+        assert read_files._sparkline(np.array([0, 0, 0, 1.0])) == '█' + '▁' * 14 + '▄'
+        # Floats the probe misses among ints are kept, not truncated to int64
+        values, _ = read_files.numeric_list_sample([1, 2.5])
+        assert values.dtype == np.float64 and values.tolist() == [1.0, 2.5]
+        monkeypatch.setattr(read_files, 'NUMERIC_PROBE_SIZE', 10)
+        values, _ = read_files.numeric_list_sample(list(range(5)) + [0.5] + list(range(94)))
+        assert values.dtype == np.float64 and values[5] == 0.5
+        values, _ = read_files.numeric_list_sample(list(range(100)))
+        assert values.dtype == np.int64
+
+    def test_records_table_view(self, tmp_path, capsys):
+        pkl_path = tmp_path / "records.pkl"
+        rows = [{'step': i, 'split': 'train' if i % 4 else 'val', 'note': None} for i in range(100)]
+        with open(pkl_path, 'wb') as f:
+            pickle.dump(rows, f)
+        process_file(FileType.PICKLE.value, str(pkl_path))
+        captured = capsys.readouterr()
+        assert '<i>table of 3 columns</i>' in captured.out
+        assert "<table class='records'>" in captured.out
+        assert '(90 more rows)' in captured.out
+        assert "<b>'step'</b>: <i>int64</i> min: 0, max: 99" in captured.out
+        assert "'train'</span> ×75" in captured.out
+        assert "<b>'note'</b>: <i>all null</i>, nulls: 100" in captured.out
+        # Dicts with unrelated keys keep the nested view
+        assert read_files.infer_schema([{str(i): i} for i in range(10)]) is None
+
+    def test_same_shaped_objects_fold(self):
+        class Sample:
+            def __init__(self, i):
+                self.index = i
+                self.label = 'cat' if i % 2 else 'dog'
+
+        class Marker:
+            pass
+
+        items = [Marker()] + [Sample(i) for i in range(1000)]
+        output = read_files.JetBrainsFormatter().format(items)
+        assert '[0]: <b>Marker</b>' in output
+        assert '[1:1001]: <b>Sample</b> <i>(attrs=2)</i> × 1000' in output
+        assert output.count('<i>example</i>') == 1
+        assert '<b>index</b>: <i>int64</i> min: 0, max: 999' in output
+        assert "'cat'</span> ×500" in output
+
+    def test_folding_work_is_bounded(self, monkeypatch):
+        class Point:
+            def __init__(self, i):
+                self.x = i
+
+        detected = []
+        detect = read_files._detect_own_formatter
+        monkeypatch.setattr(read_files, '_detect_own_formatter', lambda obj: detected.append(obj) or detect(obj))
+        signature = read_files.structure_signature
+        calls = []
+        monkeypatch.setattr(read_files, 'structure_signature', lambda obj: calls.append(1) or signature(obj))
+        monkeypatch.setattr(read_files, 'FOLD_SCAN_SIZE', 5000)
+
+        # Numbers and strings stop at the probe
+        assert read_files.structure_runs(list(range(100000))) is None
+        assert len(calls) <= read_files.NUMERIC_PROBE_SIZE + 1
+        # Long lists of objects are probed, then folded whole; the formatter check runs once per type
+        calls.clear()
+        assert read_files.structure_runs([Point(i) for i in range(100000)]) == [(0, 100000)]
+        assert len(calls) <= read_files.NUMERIC_PROBE_SIZE + 1
+        assert len(detected) == 1
+
+    def test_dataframe_preview(self, tmp_path, capsys, monkeypatch):
+        pd = pytest.importorskip('pandas')
+        pkl_path = tmp_path / "frame.pkl"
+        frame = pd.DataFrame({'loss': np.linspace(0, 1, 1000), 'split': ['train', 'val'] * 500})
+        frame.to_pickle(pkl_path)
+        monkeypatch.setattr(read_files, 'FRAME_SAMPLE_ROWS', 100)
+        process_file(FileType.PICKLE.value, str(pkl_path))
+        captured = capsys.readouterr()
+        assert '<b>DataFrame</b> <i>(shape=1000×2, memory=' in captured.out
+        assert '<b>dtypes</b>: float64 ×1, object ×1' in captured.out
+        assert "<table class='records'>" in captured.out
+        assert '(column stats sampled from 100 of 1000 rows)' in captured.out
+        assert '<b>loss</b>: <i>float64</i> min: 0, max: 0.991' in captured.out
+        assert '_mgr' not in captured.out
+        series = pd.Series([1.0, 2.0], name='<script>a<b')
+        header = read_files.JetBrainsFormatter().format(series)
+        assert "name='&lt;script&gt;a&lt;b'" in header and '<script>' not in header
+
+    def test_parquet_and_arrow_metadata_preview(self, tmp_path, capsys):
+        pa = pytest.importorskip('pyarrow')
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+        table = pa.table({'step': list(range(1000)), 'name': ['a', None] * 500})
+        parquet_path = tmp_path / "table.parquet"
+        pq.write_table(table, parquet_path, row_group_size=300)
+        process_file(FileType.PARQUET.value, str(parquet_path))
+        captured = capsys.readouterr()
+        assert 'Preview strategy: <b>sampled</b>' in captured.out
+        assert '<b>Parquet</b> <i>(rows=1000, columns=2, row groups=4' in captured.out
+        assert "(first 10 of 1000 rows)" in captured.out
+        assert "<b>step</b>: <i>int64</i> min: <span style='color:#6897bb'>0</span>, max: <span style='color:#6897bb'>999</span>" in captured.out
+        assert 'nulls: 500' in captured.out
+
+        feather_path = tmp_path / "table.feather"
+        feather.write_feather(table, feather_path)
+        process_file(FileType.ARROW.value, str(feather_path))
+        captured = capsys.readouterr()
+        assert '<b>Arrow</b> <i>(IPC file, rows=1000, columns=2' in captured.out
+        assert '<b>name</b>: <i>string</i>, nulls in first batch: 500' in captured.out
+
+    def test_hdf5_and_mat_previews(self, tmp_path, capsys, monkeypatch):
+        h5py = pytest.importorskip('h5py')
+        scipy_io = pytest.importorskip('scipy.io')
+        h5_path = tmp_path / "data.h5"
+        with h5py.File(h5_path, 'w') as f:
+            f.create_dataset('train/x', data=np.arange(10000.0).reshape(100, 100), chunks=(10, 10))
+            wide = f.create_group('wide')
+            for i in range(50):
+                wide.create_dataset(f'd{i:02d}', data=[i])
+                wide.attrs[f'a{i:02d}'] = i
+        monkeypatch.setattr(read_files, 'STATS_SAMPLE_SIZE', 1000)
+        process_file(FileType.HDF5.value, str(h5_path))
+        captured = capsys.readouterr()
+        assert '<b>Group</b> <i>(/train, members=1, attrs=0)</i>' in captured.out
+        assert 'chunks=(10,10)' in captured.out
+        assert 'max: 9999' in captured.out and '(sampled)' in captured.out
+        assert '(20 more members)' in captured.out
+        assert '<b>@a29</b>' in captured.out and '(20 more attrs)' in captured.out
+
+        # Contiguous datasets with huge rows are read in bounded blocks too
+        class ContiguousDataset:
+            shape, chunks = (2, 10**9), None
+            reads = []
+
+            def __getitem__(self, selection):
+                shape = tuple(s.stop - s.start for s in selection)
+                self.reads.append(shape)
+                return np.zeros(shape)
+
+        sample, sampled = read_files.h5_chunk_sample(ContiguousDataset())
+        assert sampled and sample.size <= max(read_files.STATS_SAMPLE_SIZE, read_files.H5_ROW_BLOCK)
+        assert max(int(np.prod(shape)) for shape in ContiguousDataset.reads) <= read_files.H5_ROW_BLOCK
+        assert {shape[0] for shape in ContiguousDataset.reads} == {1}
+
+        mat_path = tmp_path / "data.mat"
+        scipy_io.savemat(mat_path, {'weights': np.ones((3, 4)), 'big': np.zeros((100, 100))})
+        process_file(FileType.MATLAB.value, str(mat_path))
+        captured = capsys.readouterr()
+        assert '<b>MAT-file</b> <i>(variables=2)</i>' in captured.out
+        assert '<b>weights</b>: <b>ndarray</b> <i>(shape=(3,4)' in captured.out
+        assert '<b>big</b>: <i>double</i> shape=(100,100) <i>[not loaded]</i>' in captured.out
+
+    def test_safetensors_preview(self, tmp_path, capsys):
+        safetensors_torch = pytest.importorskip('safetensors.torch')
+        st_path = tmp_path / "model.safetensors"
+        safetensors_torch.save_file({
+            'layer1.weight': torch.arange(12, dtype=torch.float32).reshape(3, 4),
+            'layer1.bias': torch.full((4,), -2.5, dtype=torch.bfloat16),
+        }, str(st_path))
+        process_file(FileType.SAFETENSORS.value, str(st_path))
+        captured = capsys.readouterr()
+        assert '<b>dict</b> <i>(len=2)</i>' in captured.out
+        assert '16 parameters' in captured.out
+        assert "<b>'layer1.weight'</b>: <b>tensor</b> <i>(shape=(3,4), dtype=float32" in captured.out
+        assert 'min: 0, max: 11, mean: 5.5' in captured.out
+        assert 'dtype=bfloat16' in captured.out and 'min: -2.5, max: -2.5' in captured.out
+
+    def test_safetensors_stats_from_bounded_reads(self, tmp_path, capsys, monkeypatch):
+        safetensors_torch = pytest.importorskip('safetensors.torch')
+        import mmap
+        st_path = tmp_path / "large.safetensors"
+        safetensors_torch.save_file({'embed': torch.arange(100000, dtype=torch.float32)}, str(st_path))
+        monkeypatch.setattr(read_files, 'STATS_SAMPLE_SIZE', 6400)
+        monkeypatch.setattr(mmap, 'mmap', lambda *args, **kwargs: pytest.fail('mapped the file'))
+        process_file(FileType.SAFETENSORS.value, str(st_path))
+        captured = capsys.readouterr()
+        assert "<b>'embed'</b>: <b>tensor</b> <i>(shape=(100000,), dtype=float32" in captured.out
+        assert 'min: 0, max: 1e+05' in captured.out and '(sampled)' in captured.out
+
+    def test_sharded_checkpoint_merged_view(self, tmp_path, capsys, monkeypatch):
+        safetensors_torch = pytest.importorskip('safetensors.torch')
+        shards = {
+            'model-00001-of-00002.safetensors': {
+                'model.embed.weight': torch.zeros(10, 4),
+                'model.layers.0.mlp.weight': torch.arange(12, dtype=torch.float32).reshape(3, 4),
+            },
+            'model-00002-of-00002.safetensors': {
+                'model.layers.10.mlp.weight': torch.ones(3, 4),
+                'model.layers.2.mlp.weight': torch.ones(3, 4),
+            },
+        }
+        weight_map = {}
+        for shard, tensors in shards.items():
+            safetensors_torch.save_file(tensors, str(tmp_path / shard))
+            weight_map.update(dict.fromkeys(tensors, shard))
+        index_path = tmp_path / "model.safetensors.index.json"
+        index_path.write_text(json.dumps({'metadata': {'total_size': 256}, 'weight_map': weight_map}))
+
+        process_file(FileType.CHECKPOINT_INDEX.value, str(index_path))
+        out = capsys.readouterr().out
+        assert '<b>sharded checkpoint</b> <i>(shards=2, tensors=4, parameters=76, bytes=304 B, dtype=float32)</i>' in out
+        assert "<b>'model-00001-of-00002.safetensors'</b>: <i>2 tensors, 208 B</i>" in out
+        assert out.index('<b>2.mlp</b>') < out.index('<b>10.mlp</b>')
+        assert 'min:' not in out  # stats wait for an expand
+
+        # Any shard opens the same merged view
+        process_file(FileType.SAFETENSORS.value, str(tmp_path / 'model-00002-of-00002.safetensors'))
+        assert '(shards=2, tensors=4' in capsys.readouterr().out
+
+        token = re.search(r"<b>0.mlp</b>: .*?data-expand='([\w-]+)'", out, re.S).group(1)
+        monkeypatch.setattr(read_files, 'EXPAND', token)
+        process_file(FileType.CHECKPOINT_INDEX.value, str(index_path))
+        assert capsys.readouterr().out.startswith('min: 0, max: 11, mean: 5.5')
+
+    def test_safetensors_module_tree(self, tmp_path, capsys, monkeypatch):
+        safetensors_torch = pytest.importorskip('safetensors.torch')
+        tensors = {'embed.weight': torch.zeros(10, 4), 'norm.weight': torch.ones(4)}
+        for i in range(4):
+            tensors[f'layers.{i}.attn.weight'] = torch.ones(4, 4)
+            tensors[f'layers.{i}.mlp.weight'] = torch.ones(8, 4, dtype=torch.float16)
+        st_path = tmp_path / "model.safetensors"
+        safetensors_torch.save_file(tensors, str(st_path))
+        process_file(FileType.SAFETENSORS.value, str(st_path))
+        out = capsys.readouterr().out
+        assert '<b>state_dict</b> <i>(tensors=10, parameters=236, bytes=688 B, dtypes=float32 ×6, float16 ×4)</i>' in out
+        assert '<b>0..3</b>: <b>module</b> <i>(tensors=2, parameters=48, bytes=128 B, dtypes=float32 ×1, float16 ×1)</i> × 4' in out
+        assert out.count("<b>weight</b>: <b>tensor</b> <i>(shape=(4,4), dtype=float32") == 1
+        # Sharded checkpoints get the same tree from the shard headers alone
+        for name in ('model-00001-of-00002.safetensors', 'model-00002-of-00002.safetensors'):
+            half = dict(list(tensors.items())[:5] if name.startswith('model-00001') else list(tensors.items())[5:])
+            safetensors_torch.save_file(half, str(tmp_path / name))
+        monkeypatch.setattr(read_files.SafeTensor, 'sample', lambda self: pytest.fail('read tensor data'))
+        process_file(FileType.SAFETENSORS.value, str(tmp_path / 'model-00001-of-00002.safetensors'))
+        out = capsys.readouterr().out
+        assert '(shards=2, tensors=10, parameters=236, bytes=688 B, dtypes=float32 ×6, float16 ×4)' in out
+        assert '<b>0..3</b>: <b>module</b> <i>(tensors=2, parameters=48' in out
+
+    def test_sharded_bin_shards_never_load_fully(self, tmp_path, capsys, monkeypatch):
+        for i in (1, 2):
+            torch.save({f'layers.{i}.weight': torch.ones(2, 2)}, tmp_path / f'pytorch_model-0000{i}-of-00002.bin')
+        original_load = torch.load
+
+        def load_without_mmap(*args, mmap=None, **kwargs):
+            if mmap is None:
+                pytest.fail('loaded a shard in full')
+            if 'model-00002' in str(args[0]):
+                raise TypeError("load() got an unexpected keyword argument 'mmap'")
+            return original_load(*args, mmap=mmap, **kwargs)
+
+        monkeypatch.setattr(torch, 'load', load_without_mmap)
+        process_file(FileType.PYTORCH.value, str(tmp_path / 'pytorch_model-00001-of-00002.bin'))
+        out = capsys.readouterr().out
+        assert '(shards=2, tensors=1' in out and '<b>layers.1</b>' in out
+        assert "<b>'pytorch_model-00002-of-00002.bin'</b>: <span style='color:red'>unreadable: " \
+               "memory-mapping .bin shards needs torch 2.1 or newer" in out
+
+    def test_tar_shard_samples(self, tmp_path, capsys, monkeypatch):
+        import io
+        import tarfile
+        tar_path = tmp_path / "shard-000000.tar"
+        with tarfile.open(tar_path, 'w') as tf:
+            def add(name, data):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info, io.BytesIO(data))
+            for i in range(3):
+                buf = io.BytesIO()
+                np.save(buf, np.arange(5.0) + i)
+                add(f"{i:06d}.input.npy", buf.getvalue())
+                add(f"{i:06d}.cls", str(i).encode())
+                add(f"{i:06d}.meta.pkl", pickle.dumps({'id': i}))
+        monkeypatch.setattr(read_files, 'IMAGE_DIR', str(tmp_path))
+
+        process_file(FileType.TAR.value, str(tar_path))
+        out = capsys.readouterr().out
+        assert '<b>tar</b> <i>(members=9, samples=3' in out
+        assert 'input.npy × 3, cls × 3, meta.pkl × 3' in out
+        assert "<b>'input.npy'</b>: <b>ndarray</b> <i>(shape=(5,), dtype=float64)</i>" in out
+        assert "<b>'id'</b>: <span style='color:#6897bb'>0</span>" in out
+        assert len(list(tmp_path.glob('tar-index-*.json'))) == 1
+
+        token = re.search(r"<b>'meta.pkl'</b>: <i>\d+ B</i> <span class='expand' data-expand='([\w-]+)'", out).group(1)
+        monkeypatch.setattr(read_files, 'EXPAND', token)
+        process_file(FileType.TAR.value, str(tar_path))
+        assert "<b>'id'</b>: <span style='color:#6897bb'>1</span>" in capsys.readouterr().out
+
+    def test_torch_checkpoint_named_tar(self, tmp_path, capsys):
+        # `model_best.pth.tar` is a torch.save checkpoint, not an archive
+        path = tmp_path / "model_best.pth.tar"
+        torch.save({'epoch': 7, 'state_dict': {'fc.weight': torch.ones(2, 2)}}, path)
+        process_file(FileType.TAR.value, str(path))
+        out = capsys.readouterr().out
+        assert "<b>'epoch'</b>: <span style='color:#6897bb'>7</span>" in out
+        assert "<b>'fc.weight'</b>: <b>tensor</b> <i>(shape=(2,2)" in out
+
+    def test_joblib_arrays_memory_mapped(self, tmp_path, capsys, monkeypatch):
+        joblib = pytest.importorskip('joblib')
+        path = tmp_path / "model.joblib"
+        joblib.dump({'coef': np.arange(100000.0), 'name': 'ridge'}, path)
+        loaded = []
+        monkeypatch.setattr(read_files, 'print_formatted', lambda formatter, obj: loaded.append(obj))
+        process_file(FileType.JOBLIB.value, str(path))
+        assert 'Preview strategy: <b>mmap</b>' in capsys.readouterr().out
+        assert isinstance(loaded[0]['coef'], np.memmap)
+
+    def test_joblib_array_larger_than_memory_limit(self, tmp_path, capsys, monkeypatch):
+        joblib = pytest.importorskip('joblib')
+        limit_mb = read_files._resident_memory() // 2**20 + 128
+        zeros = np.lib.format.open_memmap(tmp_path / "zeros.npy", mode='w+', dtype=np.float64,
+                                          shape=((limit_mb + 64) * 2**17,))
+        path = tmp_path / "large.joblib"
+        joblib.dump({'weights': zeros}, path)
+        del zeros
+        monkeypatch.setattr(read_files, 'MEMORY_LIMIT_MB', limit_mb)
+        guard = read_files.ResourceGuard(limit_mb, 60).start()
+        monkeypatch.setattr(read_files, '_guard', guard)
+        try:
+            process_file(FileType.JOBLIB.value, str(path))
+        finally:
+            guard.stop()
+        out = capsys.readouterr().out
+        assert f"<b>'weights'</b>: <b>ndarray</b> <i>(shape=({(limit_mb + 64) * 2**17},), dtype=float64)</i>" in out
+        assert '(sampled)' in out and 'Error' not in out and guard.tripped is None
+
+    def test_shelve_unpickles_shown_keys_only(self, tmp_path, capsys, monkeypatch):
+        import dbm.dumb
+        import shelve
+        base = str(tmp_path / "cache")
+        with shelve.Shelf(dbm.dumb.open(base, 'c')) as db:
+            for i in range(100):
+                db[f"key{i:03d}"] = {'value': i}
+        unpickled = []
+        original = read_files.unpickle_value
+        monkeypatch.setattr(read_files, 'unpickle_value', lambda raw: unpickled.append(raw) or original(raw))
+
+        process_file(FileType.DBM.value, base + '.dir')
+        out = capsys.readouterr().out
+        assert '<b>shelve</b> <i>(dbm.dumb, len=100' in out
+        assert "<b>'key099'</b>: <b>dict</b>" in out
+        assert '(70 more keys)' in out
+        assert len(unpickled) == read_files.MAX_ITEMS
+
+    def test_sparse_matrices_stay_sparse(self):
+        sparse = pytest.importorskip('scipy.sparse')
+        dense = np.zeros((100, 50))
+        dense[0, 1] = 1
+        dense[3, 3] = 2
+        dense[99, 49] = 3
+        formatter = read_files.JetBrainsFormatter()
+        for mat in (sparse.csr_matrix(dense), sparse.csc_matrix(dense), sparse.coo_matrix(dense), sparse.lil_matrix(dense)):
+            out = formatter.format(mat)
+            assert '(shape=(100,50), dtype=float64, nnz=3, density=0.06%)' in out
+            assert '<b>values</b>: min: 1, max: 3, mean: 2' in out
+            assert '<b>nnz per row</b>: min: 0, max: 1' in out and 'empty: 97' in out
+            assert '[0. 1. 0. 0. 0. 0. 0. 0.]' in out and '[0. 0. 0. 2. 0. 0. 0. 0.]' in out
+
+        out = formatter.format(torch.tensor(dense).to_sparse())
+        assert 'layout=sparse_coo, nnz=3, density=0.06%' in out
+        assert '<b>nnz per column</b>: min: 0, max: 1' in out and 'empty: 47' in out
+
+    def test_structured_and_object_arrays(self, monkeypatch):
+        formatter = read_files.JetBrainsFormatter()
+        records = np.zeros(1000, dtype=[('id', 'i8'), ('pos', 'f4', (3,)), ('inner', [('flag', 'u1')])])
+        records['id'] = np.arange(1000)
+        out = formatter.format(records)
+        assert "<b>id</b>: <i>int64</i> min: 0, max: 999, mean: 499.5" in out
+        assert "<b>pos</b>: <i>('&lt;f4', (3,))</i> min: 0, max: 0" in out
+        assert "<b>inner</b>: <b>ndarray</b> <i>(shape=(1000,), dtype=[('flag', 'u1')])</i>" in out
+
+        monkeypatch.setattr(read_files, 'OBJECT_PROBE_SIZE', 100)
+        objects = np.empty(10000, dtype=object)
+        objects[::2] = [{'k': i} for i in range(5000)]
+        objects[1::2] = 'x'
+        out = formatter.format(objects)
+        assert '<b>types</b>: dict ×50, str ×50 <i>(of 100 sampled)</i>' in out
+        assert "<b>[9999]</b>: <i>(len=1)</i>" in out
+        assert '(9970 more items)' in out
+
+    def test_dtype_aware_array_summaries(self):
+        formatter = read_files.JetBrainsFormatter()
+        labels = np.tile(np.array([0, 0, 1, 2]), 50)
+        assert '3 distinct: ' in formatter.format(labels) and '×100 (50%)' in formatter.format(labels)
+        full_range = np.tile(np.array([-128, 127, 0, 5], dtype=np.int8), 10)
+        assert "4 distinct: <span style='color:#6897bb'>-128</span> ×10 (25%)" in formatter.format(full_range)
+        mask = np.arange(100) < 25
+        assert 'True: 25 (25.0%), False: 75' in formatter.format(mask)
+        words = np.array(['cat', 'dog', 'cat', 'horse'] * 10)
+        out = formatter.format(words)
+        assert 'len min: 3, max: 5' in out and "'cat'</span> ×20 (50%)" in out and '(3 distinct)' in out
+        days = np.arange('2024-01-01', '2024-03-01', dtype='datetime64[D]')
+        assert 'from 2024-01-01 to 2024-02-29 <i>(span 59 days)</i>' in formatter.format(days)
+        waves = np.exp(1j * np.linspace(0, 3, 100))
+        assert '|z| min: 1, max: 1' in formatter.format(waves) and 'phase min: 0, max: 3' in formatter.format(waves)
+
+    def test_guarded_fallback_for_objects_without_dict(self, monkeypatch):
+        class Point:
+            __slots__ = ('x', 'y', '_cache')
+
+            def __init__(self):
+                self.x, self.y = 1, 2
+
+        class Dataset:
+            __slots__ = ()
+            calls = 0
+
+            def __str__(self):
+                Dataset.calls += 1
+                time.sleep(5)
+                return 'never printed'
+
+        class Verbose:
+            __slots__ = ()
+
+            def __str__(self):
+                return '<row>' * 10
+
+        monkeypatch.setattr(read_files, 'REPR_TIME_LIMIT_SEC', 0.2)
+        monkeypatch.setattr(read_files, 'MAX_STR_LEN', 20)
+        monkeypatch.setattr(read_files, '_slow_repr_types', {})
+        formatter = read_files.JetBrainsFormatter()
+        output = formatter.format(Point())
+        assert '<b>Point</b> <i>(attrs=2, from __slots__)</i>' in output and '_cache' not in output
+        assert formatter.format(Dataset()) == '<b>Dataset</b> <i>(str() skipped: took over 0.2s)</i>'
+        formatter.format(Dataset())
+        assert Dataset.calls == 1
+        assert formatter.format(Verbose()) == '&lt;row&gt;' * 4 + '... <i>(len=50)</i>'
+
+    def test_buffer_objects_use_array_views(self):
+        import array
+        formatter = read_files.JetBrainsFormatter()
+        assert formatter.format(b'\x89PNG<') == "<b>bytes</b> <i>(len=5)</i> <span style='color:#6a8759'>b'\\x89PNG&lt;'</span>"
+        output = formatter.format(bytearray(range(256)))
+        assert output.startswith('<b>bytearray</b> <i>(len=256)</i>') and "...</span> min: 0, max: 255, mean: 127.5" in output
+        samples = array.array('d', range(100))
+        assert np.shares_memory(read_files.buffer_view(samples), np.frombuffer(samples))
+        assert '<b>array</b> <i>(shape=(100,), dtype=float64)</i> min: 0, max: 99, mean: 49.5' in formatter.format(samples)
+        image = memoryview(np.zeros((32, 48, 3), dtype=np.uint8))
+        assert '<b>memoryview</b> <i>(shape=(32,48,3), dtype=uint8)</i>' in formatter.format(image)
+        assert '<img src=' in formatter.format(image)
+        # numpy scalars keep their plain value
+        assert formatter.format(np.int64(3)) == '3'
+
+    def test_state_dict_module_tree(self, tmp_path, capsys):
+        model = torch.nn.Sequential(torch.nn.Embedding(10, 4), *[torch.nn.Linear(4, 4) for _ in range(12)])
+        model[7].half()
+        pth_path = tmp_path / "model.pth"
+        torch.save(model.state_dict(), pth_path)
+        process_file(FileType.PYTORCH.value, str(pth_path))
+        out = capsys.readouterr().out
+        assert '<b>state_dict</b> <i>(tensors=25, parameters=280, bytes=1.055 KB, dtypes=float32 ×23, float16 ×2)</i>' in out
+        assert '<b>1..6</b>: <b>module</b> <i>(tensors=2, parameters=20, bytes=80 B, dtype=float32)</i> × 6' in out
+        assert '<b>7</b>: <b>module</b>' in out and '<b>8..12</b>' in out
+        assert out.count('<b>weight</b>') == 4
+        # Pickled modules get the same tree, with their sub-module classes
+        pkl_path = tmp_path / "model.pkl"
+        with open(pkl_path, 'wb') as f:
+            pickle.dump(model, f)
+        process_file(FileType.PICKLE.value, str(pkl_path))
+        out = capsys.readouterr().out
+        assert '<b>Sequential</b> <i>(tensors=25' in out and '<b>0</b>: <b>Embedding</b>' in out
+        assert '<b>1..6</b>: <b>Linear</b>' in out
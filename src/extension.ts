@@ -40,6 +40,12 @@ export function activate(context: vscode.ExtensionContext) {
 			provider.toggleTruncation();
 		})
 	);
+
+	context.subscriptions.push(
+		vscode.commands.registerCommand('vscode-pydata-viewer.chooseStrategy', () => {
+			void provider.chooseStrategy();
+		})
+	);
 }
 
 // this method is called when your extension is deactivated
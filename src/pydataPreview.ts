@@ -1,8 +1,10 @@
 import * as vscode from 'vscode';
 import * as fs from 'fs';
+import * as os from 'os';
+import * as path from 'path';
 
 import { Disposable } from './disposable';
-import { getOption, getPyScriptsPath, OSUtils } from './utils';
+import { getMediaPath, getOption, getPyScriptsPath, OSUtils } from './utils';
 import { Options, PythonShell } from 'python-shell';
 import { PythonInterpreterService } from './pythonInterpreter';
 import { PythonPathResolutionResult, resolvePythonPathPriority } from './pythonPathResolution';
@@ -13,14 +15,42 @@ enum FileType {
   NUMPY,
   PICKLE,
   PYTORCH,
-  COMPRESSED_PICKLE
+  COMPRESSED_PICKLE,
+  PARQUET,
+  ARROW,
+  HDF5,
+  MATLAB,
+  SAFETENSORS,
+  CHECKPOINT_INDEX,
+  TAR,
+  JOBLIB,
+  DBM
 }
 
 
 export class PyDataPreview extends Disposable {
+  // Delay between file stat polls; a change reloads once two polls agree.
+  private static readonly reloadDebounceMs = 500;
+  // Output lines are posted to the webview in batches of this size, or after this delay.
+  private static readonly streamBatchLines = 200;
+  private static readonly streamFlushMs = 50;
+
   private _previewState: PreviewState = 'Visible';
   private _isFullMode: boolean = false;
+  private _strategyOverride: string | undefined;
   private _loadRequestId: number = 0;
+  private _activeShell: PythonShell | undefined;
+  // Script and options of the current load, rerun with `--expand=<token>` for expand links
+  private _expandRequest: { scriptPath: string; options: Options } | undefined;
+  private _expandShells = new Set<PythonShell>();
+  private _reloadTimer: NodeJS.Timeout | undefined;
+  private _lastFileStat: { size: number; mtimeMs: number } | undefined;
+  private _readyRequestId: number | undefined;
+  private _pendingLines: string[] = [];
+  private _queuedMessages: { type: string; requestId: number; [key: string]: unknown }[] = [];
+  private _flushTimer: NodeJS.Timeout | undefined;
+  // Rendered images of this preview; reused across reloads, removed on dispose
+  private readonly _imageDir: string;
 
   public get resourceUri(): vscode.Uri {
     return this.resource;
@@ -38,14 +68,30 @@ export class PyDataPreview extends Disposable {
       path: resource.path.replace(/\/[^/]+?\.\w+$/, '/'),
     });
 
+    this._imageDir = fs.mkdtempSync(path.join(os.tmpdir(), 'pydata-viewer-'));
+
     webviewEditor.webview.options = {
       enableScripts: true,
-      localResourceRoots: [resourceRoot, extensionRoot],
+      localResourceRoots: [resourceRoot, extensionRoot, vscode.Uri.file(this._imageDir)],
     };
 
     this._register(
       webviewEditor.webview.onDidReceiveMessage((message) => {
         switch (message.type) {
+          case 'ready': {
+            if (message.requestId === this._loadRequestId) {
+              this._readyRequestId = message.requestId;
+              this.flushLines(message.requestId);
+              const queued = this._queuedMessages;
+              this._queuedMessages = [];
+              queued.forEach((item) => this.postToWebview(item));
+            }
+            break;
+          }
+          case 'expand': {
+            this.expand(message.requestId, message.token);
+            break;
+          }
           case 'reopen-as-text': {
             vscode.commands.executeCommand(
               'vscode.openWith',
@@ -68,6 +114,9 @@ export class PyDataPreview extends Disposable {
     this._register(
       webviewEditor.onDidDispose(() => {
         this._previewState = 'Disposed';
+        this.cancelPendingReload();
+        this.cancelActiveLoad();
+        fs.rm(this._imageDir, { recursive: true, force: true }, () => undefined);
       })
     );
 
@@ -77,7 +126,7 @@ export class PyDataPreview extends Disposable {
     this._register(
       watcher.onDidChange((e) => {
         if (e.toString() === this.resource.toString()) {
-          this.reload();
+          this.scheduleReload();
         }
       })
     );
@@ -95,8 +144,62 @@ export class PyDataPreview extends Disposable {
 
   private reload(): void {
     if (this._previewState !== 'Disposed') {
-      this.webviewEditor.webview.postMessage({ type: 'reload' });
+      void this.getWebviewContents(this.resource.path);
+    }
+  }
+
+  /**
+   * Coalesces watcher events: a file that is still being written keeps
+   * changing size/mtime, so only reload once two polls see the same stat.
+   */
+  private scheduleReload(): void {
+    this.cancelPendingReload();
+    this._reloadTimer = setTimeout(() => this.reloadWhenStable(), PyDataPreview.reloadDebounceMs);
+  }
+
+  private reloadWhenStable(): void {
+    this._reloadTimer = undefined;
+    if (this._previewState === 'Disposed') {
+      return;
     }
+
+    let stat: fs.Stats;
+    try {
+      stat = fs.statSync(this.resource.fsPath);
+    } catch (error) {
+      // Deleted or replaced mid-write; the next watcher event reschedules.
+      this._lastFileStat = undefined;
+      return;
+    }
+
+    const previous = this._lastFileStat;
+    this._lastFileStat = { size: stat.size, mtimeMs: stat.mtimeMs };
+    if (!previous || previous.size !== stat.size || previous.mtimeMs !== stat.mtimeMs) {
+      this._reloadTimer = setTimeout(() => this.reloadWhenStable(), PyDataPreview.reloadDebounceMs);
+      return;
+    }
+
+    this._lastFileStat = undefined;
+    this.reload();
+  }
+
+  private cancelPendingReload(): void {
+    if (this._reloadTimer) {
+      clearTimeout(this._reloadTimer);
+      this._reloadTimer = undefined;
+    }
+    this._lastFileStat = undefined;
+  }
+
+  private cancelActiveLoad(): void {
+    const shell = this._activeShell;
+    this._activeShell = undefined;
+    if (shell && shell.childProcess.exitCode === null) {
+      console.log('[PyData Viewer] Killing superseded preview process', shell.childProcess.pid);
+      shell.kill();
+    }
+    this._expandShells.forEach((expandShell) => expandShell.kill());
+    this._expandShells.clear();
   }
 
   private update(): void {
@@ -113,6 +216,8 @@ export class PyDataPreview extends Disposable {
 
   public async getWebviewContents(resourcePath: string): Promise<void> {
     const requestId = ++this._loadRequestId;
+    // A newer load supersedes the running one; don't let it finish in the background.
+    this.cancelActiveLoad();
 
     var path = resourcePath;
     switch (OSUtils.isWindows()) {
@@ -125,7 +230,7 @@ export class PyDataPreview extends Disposable {
     }
     // extract the suffix
     var fileSuffix = path.toString().split('.').at(-1);
-    if (fileSuffix === 'gz' || fileSuffix === 'tar') {
+    if (fileSuffix === 'gz' || fileSuffix === 'tar' || fileSuffix === 'json') {
       const fileSuffix2 = path.toString().split('.').at(-2);
       fileSuffix = fileSuffix2 + '.' + fileSuffix;
     }
@@ -138,6 +243,9 @@ export class PyDataPreview extends Disposable {
     console.log('starting python....');
 
     const pythonResolution = await this.resolvePythonPath(this.resource, workspacePath);
+    if (!this.shouldApplyResult(requestId)) {
+      return;
+    }
     if (!pythonResolution.path) {
       this.renderSimpleMessage(
         `Error: Unable to resolve Python interpreter.<br><br>${pythonResolution.hint}`,
@@ -166,99 +274,156 @@ export class PyDataPreview extends Disposable {
       args: [ft.toString(), path, this._isFullMode ? 'full' : 'truncated']
     };
 
-    const handle = this;
-    var content: string = 'init';
-
     var scriptPath = getOption("vscode-pydata-viewer.scriptPath") as string;
-    if (scriptPath === "default") {
+    const isBundledScript = scriptPath === "default";
+    if (isBundledScript) {
       scriptPath = getPyScriptsPath("read_files.py", this.context);
+      // Only the bundled script understands `--key=value` options
+      options.args = options.args!.concat(this.getScriptOptions());
     } else {
       scriptPath = scriptPath.replace('${workspaceFolder}', workspacePath);
     }
 
+    this._expandRequest = isBundledScript ? { scriptPath, options } : undefined;
+
     console.log("current deployed script", scriptPath);
     console.log("Python options:", JSON.stringify(options));
-    PythonShell.run(scriptPath, options).then(results => {
-        if (!this.shouldApplyResult(requestId)) {
-          return;
-        }
-        // results is an array consisting of messages collected during execution
-        console.log('results: %j', results);
-        console.log('results length:', results?.length);
-        
-        if (!results || results.length === 0) {
-          console.log('Warning: No results returned from Python script');
-          const errorMsg = `<span style='color:orange'>Warning: No output from Python script. File may be empty or unreadable.</span>`;
-          const head = `<!DOCTYPE html>
-          <html dir="ltr" mozdisallowselectionprint>
-          <head>
-          <meta charset="utf-8">
-          </head>`;
-          const tail = ['</html>'].join('\n');
-          const output = head + `<body>              
-          <div id="x" style='font-family: Menlo, Consolas, "Ubuntu Mono",
-          "Roboto Mono", "DejaVu Sans Mono",
-          monospace'>` + errorMsg + `</div></body>` + tail;
-          handle.safeApplyWebviewHtml(requestId, output);
-          return;
-        }
-        
-        var r = results as Array<string>;
-        // display the blank and line break with html labels
-        // for (var i=1; i<r.length; i++) {
-        //   if (r[i].startsWith('<img')) {
-        //     continue;
-        //   }
-        //   r[i] = r[i].replaceAll(" ", "&nbsp;");
-        // }
-        content = r.join('<br>');
-        const head = `<!DOCTYPE html>
-        <html dir="ltr" mozdisallowselectionprint>
-        <head>
-        <meta charset="utf-8">
-        </head>`;
-        const tail = ['</html>'].join('\n');
-        const output = head + `<body>              
-        <div id="x" style='font-family: Menlo, Consolas, "Ubuntu Mono",
-        "Roboto Mono", "DejaVu Sans Mono",
-        monospace'>` + content + `</div></body>` + tail;
-        console.log(output);
-        handle.safeApplyWebviewHtml(requestId, output);
-    }).catch(err => {
-        if (!this.shouldApplyResult(requestId)) {
-          return;
-        }
+    const shell = new PythonShell(scriptPath, options);
+    this._activeShell = shell;
+    // Custom scripts print HTML lines; the bundled one prints tree nodes.
+    this.renderStreamingShell(requestId, isBundledScript ? 'json' : 'html');
+    let lineCount = 0;
+    shell.on('message', (line: string) => {
+      lineCount++;
+      this.queueLine(requestId, line);
+    });
+    shell.end((err) => {
+      if (this._activeShell === shell) {
+        this._activeShell = undefined;
+      }
+      if (!this.shouldApplyResult(requestId)) {
+        return;
+      }
+      console.log(`[PyData Viewer] Python exited, ${lineCount} lines streamed.`);
+
+      if (err) {
         console.log('Python error:', err);
-        console.log('Error type:', typeof err);
         console.log('Error stack:', err?.stack);
-        const head = `<!DOCTYPE html>
+        const errorDetails = err?.message || err?.toString() || 'Unknown error';
+        const interpreterPath = options.pythonPath ?? '<unknown>';
+        this.flushLines(requestId);
+        this.postToWebview({
+          type: 'error',
+          requestId,
+          html: `Error: ${errorDetails}<br><br>Interpreter: ${interpreterPath}`,
+        });
+        return;
+      }
+
+      if (lineCount === 0) {
+        console.log('Warning: No results returned from Python script');
+        this.queueLine(requestId, `<span style='color:orange'>Warning: No output from Python script. File may be empty or unreadable.</span>`);
+      }
+      this.flushLines(requestId);
+      this.postToWebview({ type: 'done', requestId });
+    });
+  }
+
+  /**
+   * Reruns the bundled script for one expand link of the preview (e.g. the
+   * stats of a tensor) and posts its output to replace the link.
+   */
+  private expand(requestId: number, token: string): void {
+    const request = this._expandRequest;
+    if (!request || !this.shouldApplyResult(requestId) || !/^[\w-]+$/.test(token)) {
+      return;
+    }
+    const options: Options = { ...request.options, args: request.options.args!.concat([`--expand=${token}`]) };
+    const shell = new PythonShell(request.scriptPath, options);
+    this._expandShells.add(shell);
+    const lines: string[] = [];
+    shell.on('message', (line: string) => lines.push(line));
+    shell.end((err) => {
+      this._expandShells.delete(shell);
+      if (err) {
+        lines.push(`<span style='color:red'>Error: ${err.message || err.toString()}</span>`);
+      }
+      this.postToWebview({ type: 'expanded', requestId, token, lines });
+    });
+  }
+
+  /**
+   * Sets up an empty document whose script appends output lines as they are
+   * posted, so the first lines paint before the Python process exits.
+   */
+  private renderStreamingShell(requestId: number, mode: 'json' | 'html'): void {
+    this.cancelPendingFlush();
+    this._pendingLines = [];
+    this._queuedMessages = [];
+    this._readyRequestId = undefined;
+
+    const scriptUri = getMediaPath('preview.js', this.context, this.webviewEditor.webview);
+    const head = `<!DOCTYPE html>
         <html dir="ltr" mozdisallowselectionprint>
         <head>
         <meta charset="utf-8">
+        <style>
+          .row { white-space: nowrap; line-height: 18px; }
+          .toggle { display: inline-block; width: 1em; cursor: pointer; color: #888; }
+          .expand { cursor: pointer; color: var(--vscode-textLink-foreground); }
+          table.records { border-collapse: collapse; white-space: nowrap; }
+          table.records th, table.records td { padding: 0 8px; text-align: left; border-bottom: 1px solid rgba(128, 128, 128, 0.3); }
+        </style>
         </head>`;
-        const tail = ['</html>'].join('\n');
-        const errorDetails = err?.message || err?.toString() || 'Unknown error';
-        const interpreterPath = options.pythonPath ?? '<unknown>';
-        const output = head + `<body>              
-        <div id="x" style='color: red; font-family: Menlo, Consolas, "Ubuntu Mono",
+    const tail = ['</html>'].join('\n');
+    const output = head + `<body>
+        <div id="loading" style='color: #888'>Loading...</div>
+        <div id="x" data-request-id="${requestId}" data-mode="${mode}" style='font-family: Menlo, Consolas, "Ubuntu Mono",
         "Roboto Mono", "DejaVu Sans Mono",
-        monospace'>Error: ` + errorDetails + `<br><br>Interpreter: ` + interpreterPath + `</div></body>` + tail;
-        handle.safeApplyWebviewHtml(requestId, output);
-    });
+        monospace'></div>
+        <script src="${scriptUri}"></script></body>` + tail;
+    this.safeApplyWebviewHtml(requestId, output);
+  }
+
+  private queueLine(requestId: number, line: string): void {
+    if (!this.shouldApplyResult(requestId)) {
+      return;
+    }
+    this._pendingLines.push(line);
+    if (this._pendingLines.length >= PyDataPreview.streamBatchLines) {
+      this.flushLines(requestId);
+    } else if (!this._flushTimer) {
+      this._flushTimer = setTimeout(() => this.flushLines(requestId), PyDataPreview.streamFlushMs);
+    }
+  }
+
+  private flushLines(requestId: number): void {
+    this.cancelPendingFlush();
+    // Hold lines until the document's script is listening.
+    if (this._readyRequestId !== requestId || this._pendingLines.length === 0) {
+      return;
+    }
+    const lines = this._pendingLines;
+    this._pendingLines = [];
+    this.postToWebview({ type: 'lines', requestId, lines });
+  }
 
-    // Replace , with ,\n for reading
-    // var re = /,/gi;
-    // content = content.replace(re, `,\n`);
-    // const head = `<!DOCTYPE html>
-    // <html dir="ltr" mozdisallowselectionprint>
-    // <head>
-    // <meta charset="utf-8">
-    // </head>`;
-    // const tail = ['</html>'].join('\n');
-    // const output =  head + `<body>              
-    // <div id="x">` + content + `</div></body>` + tail;
-    // console.log(output);
-    // return output;
+  private cancelPendingFlush(): void {
+    if (this._flushTimer) {
+      clearTimeout(this._flushTimer);
+      this._flushTimer = undefined;
+    }
+  }
+
+  private postToWebview(message: { type: string; requestId: number; [key: string]: unknown }): void {
+    if (!this.shouldApplyResult(message.requestId)) {
+      return;
+    }
+    if (this._readyRequestId !== message.requestId) {
+      this._queuedMessages.push(message);
+      return;
+    }
+    void this.webviewEditor.webview.postMessage(message);
   }
 
   public toggleTruncation(): void {
@@ -266,10 +431,44 @@ export class PyDataPreview extends Disposable {
     void this.getWebviewContents(this.resource.path);
   }
 
+  public get strategyOverride(): string | undefined {
+    return this._strategyOverride;
+  }
+
+  public setStrategy(strategy: string | undefined): void {
+    this._strategyOverride = strategy;
+    void this.getWebviewContents(this.resource.path);
+  }
+
   public refreshFromInterpreterChange(): void {
     void this.getWebviewContents(this.resource.path);
   }
 
+  private getScriptOptions(): string[] {
+    const memoryLimitMB = (getOption('vscode-pydata-viewer.memoryLimitMB') as number | undefined) ?? 4096;
+    const timeLimitSeconds = (getOption('vscode-pydata-viewer.timeLimitSeconds') as number | undefined) ?? 60;
+    const strategy = this._strategyOverride
+      ?? (getOption('vscode-pydata-viewer.previewStrategy') as string | undefined)
+      ?? 'auto';
+    const figureDpi = (getOption('vscode-pydata-viewer.figureDpi') as number | undefined) ?? 100;
+    const thumbnailSize = (getOption('vscode-pydata-viewer.thumbnailSize') as number | undefined) ?? 640;
+    const frameSampleRows = (getOption('vscode-pydata-viewer.frameSampleRows') as number | undefined) ?? 100000;
+    const mergeShards = (getOption('vscode-pydata-viewer.mergeShards') as boolean | undefined) ?? true;
+    const imageUri = this.webviewEditor.webview.asWebviewUri(vscode.Uri.file(this._imageDir));
+    return [
+      `--memory-limit-mb=${memoryLimitMB}`,
+      `--time-limit-sec=${timeLimitSeconds}`,
+      `--strategy=${strategy}`,
+      '--output=json',
+      `--image-dir=${this._imageDir}`,
+      `--image-uri=${imageUri.toString()}`,
+      `--figure-dpi=${figureDpi}`,
+      `--thumbnail-size=${thumbnailSize}`,
+      `--frame-sample-rows=${frameSampleRows}`,
+      `--merge-shards=${mergeShards}`,
+    ];
+  }
+
   private shouldApplyResult(requestId: number): boolean {
     return this._previewState !== 'Disposed' && requestId === this._loadRequestId;
   }
@@ -333,6 +532,14 @@ export class PyDataPreview extends Disposable {
   }
 
   public static suffixToType(suffix: string) {
+    // `.tar` has been joined with the previous part of the name, e.g. `shard-000001.tar`;
+    // `model_best.pth.tar` checkpoints are written by torch.save, not tar archives
+    if (suffix === 'pth.tar' || suffix === 'pt.tar') {
+      return FileType.PYTORCH;
+    }
+    if (suffix.endsWith('.tar')) {
+      return FileType.TAR;
+    }
     switch (suffix) {
       case 'npz': return FileType.NUMPY;
       case 'npy': return FileType.NUMPY;
@@ -343,6 +550,20 @@ export class PyDataPreview extends Disposable {
       case 'pth': return FileType.PYTORCH;
       case 'pt': return FileType.PYTORCH;
       case 'ckpt': return FileType.PYTORCH;
+      case 'bin': return FileType.PYTORCH;
+      case 'parquet': return FileType.PARQUET;
+      case 'feather': return FileType.ARROW;
+      case 'arrow': return FileType.ARROW;
+      case 'h5': return FileType.HDF5;
+      case 'hdf5': return FileType.HDF5;
+      case 'mat': return FileType.MATLAB;
+      case 'safetensors': return FileType.SAFETENSORS;
+      case 'index.json': return FileType.CHECKPOINT_INDEX;
+      case 'joblib': return FileType.JOBLIB;
+      case 'dir': return FileType.DBM;
+      case 'dat': return FileType.DBM;
+      case 'db': return FileType.DBM;
+      case 'shelve': return FileType.DBM;
       default: return FileType.NUMPY;
     }
   }
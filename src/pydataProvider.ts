@@ -58,6 +58,28 @@ export class PyDataCustomProvider implements vscode.CustomReadonlyEditorProvider
     }
   }
 
+  public async chooseStrategy(): Promise<void> {
+    const preview = this._activePreview;
+    if (!preview) {
+      return;
+    }
+    const items: vscode.QuickPickItem[] = [
+      { label: 'default', description: 'Use the vscode-pydata-viewer.previewStrategy setting' },
+      { label: 'auto', description: 'Pick from file size, headers and available memory' },
+      { label: 'full', description: 'Load everything' },
+      { label: 'mmap', description: 'Memory-map arrays, sampled statistics' },
+      { label: 'header', description: 'Headers only, no payload' },
+      { label: 'sampled', description: 'Read the head of compressed members' },
+      { label: 'scan', description: 'Scan pickle opcodes without loading' },
+    ];
+    const picked = await vscode.window.showQuickPick(items, {
+      placeHolder: `Preview strategy (current: ${preview.strategyOverride ?? 'default'})`,
+    });
+    if (picked) {
+      preview.setStrategy(picked.label === 'default' ? undefined : picked.label);
+    }
+  }
+
   public reloadAllPreviews(resource?: Resource): void {
     for (const preview of this._previews) {
       if (resource && !this.isResourceMatch(preview, resource)) {
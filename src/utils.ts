@@ -44,4 +44,10 @@ export function getPyScriptsPath(file: string, context: vscode.ExtensionContext,
     }
 
     return context.asAbsolutePath(path.join("pyscripts", file));
+}
+
+export function getMediaPath(file: string, context: vscode.ExtensionContext, webview: vscode.Webview): string {
+    const uri = vscode.Uri.file(context.asAbsolutePath(path.join("media", file)));
+
+    return webview.asWebviewUri(uri).toString();
 }
\ No newline at end of file